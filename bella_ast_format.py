@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+from array import array
+import mmap
+import struct
+
+from bella_node import Node
+
+# File layout, all little endian:
+#   header   magic, version, section counts and the offset of each section
+#   nodes    one fixed size record per node, the root first
+#   children node index of every child, each node's children stored contiguously
+#   floats   pool of FLOAT literal values as doubles
+#   strings  end offset of each string in the blob, then the UTF-8 blob itself
+# Node types, operators, identifiers, INT literals (kept as strings, as the lexer produces them) and
+# inferred types are interned once in the string table
+MAGIC = b"BAST"
+VERSION = 2
+HEADER = struct.Struct("<4sIIIIIQQQQ")
+# type string, value tag, value index, first child, child count, inferred type string, binding depth, slot,
+# source start and end offsets (-1 when the node has no span)
+NODE_RECORD = struct.Struct("<IIIIIIiiqq")
+# Marks a missing string or child: a None inferred type, or a None child left in a Block by a comment
+NONE_INDEX = 0xFFFFFFFF
+
+VALUE_NONE = 0
+VALUE_STRING = 1
+VALUE_FLOAT = 2
+
+def align(offset, size=8):
+    return (offset + size - 1) // size * size
+
+# Serialize a tree of Node or CompactNode objects. Nodes shared by several parents are stored once
+def dumps(root):
+    strings = {}
+    floats = array("d")
+    float_indices = {}
+
+    def intern(string):
+        index = strings.get(string)
+        if index is None:
+            index = len(strings)
+            strings[string] = index
+        return index
+
+    # Number the nodes in pre-order with an explicit stack, so deep trees do not hit the recursion limit
+    order = []
+    indices = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in indices:
+            continue
+        indices[id(node)] = len(order)
+        order.append(node)
+        stack.extend(reversed(node.children))
+
+    records = bytearray(NODE_RECORD.size * len(order))
+    children = array("I")
+    for number, node in enumerate(order):
+        value = node.value
+        if value is None:
+            value_tag, value_index = VALUE_NONE, 0
+        elif isinstance(value, str):
+            value_tag, value_index = VALUE_STRING, intern(value)
+        elif isinstance(value, float):
+            key = value.hex()
+            value_index = float_indices.get(key)
+            if value_index is None:
+                value_index = len(floats)
+                float_indices[key] = value_index
+                floats.append(value)
+            value_tag = VALUE_FLOAT
+        else:
+            raise Exception(f"Cannot serialize node value {value!r}")
+
+        inferred_type = NONE_INDEX if node.inferred_type is None else intern(node.inferred_type)
+        depth, slot = node.binding if node.binding is not None else (-1, -1)
+        start, end = (node.start, node.end) if node.start is not None else (-1, -1)
+        NODE_RECORD.pack_into(records, number * NODE_RECORD.size, intern(node.type), value_tag, value_index,
+                              len(children), len(node.children), inferred_type, depth, slot, start, end)
+        children.extend(NONE_INDEX if child is None else indices[id(child)] for child in node.children)
+
+    blob = bytearray()
+    string_ends = array("I")
+    for string in strings:
+        blob += string.encode()
+        string_ends.append(len(blob))
+
+    node_offset = HEADER.size
+    child_offset = node_offset + len(records)
+    float_offset = align(child_offset + children.itemsize * len(children))
+    string_offset = float_offset + floats.itemsize * len(floats)
+    header = HEADER.pack(MAGIC, VERSION, len(order), len(children), len(floats), len(strings),
+                         node_offset, child_offset, float_offset, string_offset)
+    padding = bytes(float_offset - child_offset - children.itemsize * len(children))
+    return b"".join([header, records, children.tobytes(), padding, floats.tobytes(), string_ends.tobytes(), blob])
+
+def dump(root, path):
+    with open(path, "wb") as ast_file:
+        ast_file.write(dumps(root))
+
+# A serialized tree read in place from a buffer. Nodes are decoded only when they are reached
+class AstFile:
+    def __init__(self, buffer, mapping=None, file=None):
+        self.mapping = mapping
+        self.file = file
+        self.buffer = memoryview(buffer)
+        if len(self.buffer) < HEADER.size:
+            raise Exception("Not a Bella AST file")
+        (magic, version, self.node_count, self.child_count, self.float_count, self.string_count,
+         self.node_offset, self.child_offset, self.float_offset, self.string_offset) = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise Exception("Not a Bella AST file")
+        if version != VERSION:
+            raise Exception(f"Unsupported Bella AST version {version}")
+
+        self.children = self.buffer[self.child_offset:self.child_offset + 4 * self.child_count].cast("I")
+        self.floats = self.buffer[self.float_offset:self.float_offset + 8 * self.float_count].cast("d")
+        self.string_ends = self.buffer[self.string_offset:self.string_offset + 4 * self.string_count].cast("I")
+        self.blob_offset = self.string_offset + 4 * self.string_count
+        # Decoded strings by index, so each one is decoded once and repeated values share one object
+        self.strings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        # Views into the mapping have to be released before it can be closed
+        for view in (self.children, self.floats, self.string_ends, self.buffer):
+            view.release()
+        if self.mapping is not None:
+            self.mapping.close()
+        if self.file is not None:
+            self.file.close()
+
+    @property
+    def root(self):
+        return LazyNode(self, 0)
+
+    def string(self, index):
+        string = self.strings.get(index)
+        if string is None:
+            start = self.string_ends[index - 1] if index else 0
+            string = str(self.buffer[self.blob_offset + start:self.blob_offset + self.string_ends[index]], "utf-8")
+            self.strings[index] = string
+        return string
+
+    def record(self, index):
+        return NODE_RECORD.unpack_from(self.buffer, self.node_offset + index * NODE_RECORD.size)
+
+    # Build an ordinary Node tree from the whole file
+    def to_node(self):
+        nodes = [None] * self.node_count
+        # Children may point at nodes that come later in the table, so link them in a second pass
+        records = [self.record(index) for index in range(self.node_count)]
+        for index, (type, value_tag, value_index, first_child, child_count, inferred_type, depth, slot, start,
+                    end) in enumerate(records):
+            node = Node(self.string(type), self.value(value_tag, value_index), [])
+            if inferred_type != NONE_INDEX:
+                node.inferred_type = self.string(inferred_type)
+            if depth >= 0:
+                node.binding = (depth, slot)
+            if start >= 0:
+                node.start = start
+                node.end = end
+            if node.type == "Id":
+                # Strings are stored once per file, so their index numbers the file's identifiers
+                node.ident = value_index
+            nodes[index] = node
+        for node, record in zip(nodes, records):
+            first_child, child_count = record[3], record[4]
+            node.children = [None if child == NONE_INDEX else nodes[child]
+                             for child in self.children[first_child:first_child + child_count]]
+        return nodes[0]
+
+    def value(self, value_tag, value_index):
+        if value_tag == VALUE_STRING:
+            return self.string(value_index)
+        if value_tag == VALUE_FLOAT:
+            return self.floats[value_index]
+        return None
+
+# Read-only view of one node of an AstFile with the same type/value/children view as Node
+class LazyNode:
+    __slots__ = ("file", "index", "fields", "child_nodes")
+
+    def __init__(self, file, index):
+        self.file = file
+        self.index = index
+        self.fields = None
+        self.child_nodes = None
+
+    def load_fields(self):
+        if self.fields is None:
+            self.fields = self.file.record(self.index)
+        return self.fields
+
+    @property
+    def type(self):
+        return self.file.string(self.load_fields()[0])
+
+    @property
+    def value(self):
+        fields = self.load_fields()
+        return self.file.value(fields[1], fields[2])
+
+    @property
+    def children(self):
+        if self.child_nodes is None:
+            fields = self.load_fields()
+            self.child_nodes = [None if child == NONE_INDEX else LazyNode(self.file, child)
+                                for child in self.file.children[fields[3]:fields[3] + fields[4]]]
+        return self.child_nodes
+
+    @property
+    def inferred_type(self):
+        inferred_type = self.load_fields()[5]
+        return None if inferred_type == NONE_INDEX else self.file.string(inferred_type)
+
+    @property
+    def binding(self):
+        fields = self.load_fields()
+        return (fields[6], fields[7]) if fields[6] >= 0 else None
+
+    @property
+    def start(self):
+        start = self.load_fields()[8]
+        return start if start >= 0 else None
+
+    @property
+    def end(self):
+        end = self.load_fields()[9]
+        return end if end >= 0 else None
+
+    # Index of an Id's name in the file's string table, which numbers the identifiers like an InternTable
+    @property
+    def ident(self):
+        return self.load_fields()[2] if self.type == "Id" else None
+
+    __str__ = Node.__str__
+
+def loads(data):
+    return AstFile(data)
+
+# Memory-map a serialized tree. The returned AstFile must stay open while its nodes are used
+def load(path):
+    ast_file = open(path, "rb")
+    try:
+        mapping = mmap.mmap(ast_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files cannot be mapped
+        ast_file.close()
+        raise Exception("Not a Bella AST file")
+    return AstFile(mapping, mapping, ast_file)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import glob
+import json
+import os
+import time
+
+import bella_lexer as lexer
+import bella_parser as parser
+import bella_memory_verifier as memory_verifier
+import bella_parallel
+import bella_stats
+from bella_optimizer import Optimizer
+from bella_source import describe
+
+# Checks that can run after the syntax check: scope and type analysis, and memory verification
+PASSES = ("types", "memory")
+# Files of at least this many bytes are lexed from a memory map by StreamLexer instead of being read into a
+# string, so only the tokens of the statement being parsed are held besides the tree
+MAP_SIZE = 32 * 1024 * 1024
+
+# Expand directories and glob patterns into a sorted list of .bla files, keeping plain file paths as given
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                files.extend(os.path.join(directory, name) for name in names if name.endswith(".bla"))
+        elif glob.has_magic(path):
+            files.extend(match for match in glob.glob(path, recursive=True) if os.path.isfile(match))
+        else:
+            files.append(path)
+    # Deduplicate while keeping the order stable between runs
+    return sorted(set(files))
+
+# Check a program a top-level statement at a time, holding the tokens and tree of one statement instead of
+# the whole program. Each statement is checked once it is parsed, so errors are raised in source order
+def check_statements(source, optimize=False, passes=PASSES, share=False):
+    tokens = lexer.TokenWindow(lexer.Lexer(source))
+    statements = parser.Parser(tokens, "types" in passes, share).iter_statements()
+    if optimize:
+        statements = Optimizer.optimize_statements(statements)
+    if "memory" in passes:
+        memory_verifier.MemoryVerifier.verify_statements(statements)
+    else:
+        for _ in statements:
+            pass
+
+# Lex, parse and verify one file, or look up its outcome in a ResultCache. Runs in a worker process, so it
+# returns a plain dict instead of raising. With stats, the result includes the file's front-end stats. With
+# optimize, the tree is optimized before it is verified. Only the syntax and the given passes are checked.
+# With stream, the file is checked by check_statements and no tree is cached. With share, the parser shares
+# identical constant subtrees, which the cached tree keeps. With block_workers, the large blocks of the file are
+# checked by that many processes with bella_parallel, which needs every pass and no optimize, and no tree is
+# cached. Files of at least MAP_SIZE bytes are otherwise checked from a memory map, with the same outcome
+def check_file(path, cache=None, stats=False, optimize=False, passes=PASSES, stream=False, share=False,
+               block_workers=None):
+    if stats:
+        with bella_stats.collecting() as collector:
+            result = check_file(path, cache, optimize=optimize, passes=passes, stream=stream, share=share,
+                                block_workers=block_workers)
+        result["stats"] = collector.as_dict()
+        return result
+
+    start = time.perf_counter()
+    result = {"file": path, "ok": True}
+    ast = None
+    source = None
+    mapped = None
+    try:
+        if not stream and not block_workers and os.path.getsize(path) >= MAP_SIZE:
+            mapped = lexer.StreamLexer(path)
+            source = mapped.buffer
+        else:
+            with open(path, "rb") as program_file:
+                source = program_file.read()
+        if cache is not None:
+            key = cache.key(source)
+            outcome = cache.get_outcome(key)
+            if outcome is not None:
+                result["ok"], error = outcome
+                if error is not None:
+                    result["error"] = error
+                result["cached"] = True
+                result["seconds"] = time.perf_counter() - start
+                return result
+
+        if mapped is None:
+            source = source.decode()
+        if stream:
+            check_statements(source, optimize, passes, share)
+        elif block_workers:
+            bella_parallel.check_source(source, block_workers)
+        else:
+            tokens = lexer.Lexer(source).tokenize_compact() if mapped is None else lexer.StreamCursor(mapped)
+            ast = parser.Parser(tokens, "types" in passes, share).parse()
+            if optimize:
+                Optimizer.optimize(ast)
+            if "memory" in passes:
+                memory_verifier.MemoryVerifier.verify_allocation(ast)
+    except Exception as e:
+        result["ok"] = False
+        if isinstance(source, str):
+            result["error"] = describe(e, source)
+        elif mapped is not None:
+            # Only the lines before the error are split, so the mapped file is not copied whole
+            result["error"] = describe(e, source[:getattr(e, "start", None) or 0])
+        else:
+            result["error"] = f"{type(e).__name__}: {e}"
+        # Unreadable files have nothing to key the cache by
+        if isinstance(e, OSError):
+            cache = None
+    finally:
+        if mapped is not None:
+            mapped.close()
+
+    if cache is not None:
+        cache.put(key, result["ok"], result.get("error"), ast)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+# Yield the result of each file in input order. Files are sent to workers in chunks to amortize the
+# cost of pickling each task
+def check_files(files, workers=None, chunksize=16, cache=None, stats=False, optimize=False, passes=PASSES,
+                stream=False, share=False, block_workers=None):
+    check = partial(check_file, cache=cache, stats=stats, optimize=optimize, passes=passes, stream=stream,
+                    share=share, block_workers=block_workers)
+    if workers == 1:
+        yield from map(check, files)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(check, files, chunksize=chunksize)
+
+# Check files, writing a JSON line per file and then a summary line to output. Returns the summary, which
+# includes the stats of all files combined if stats is set
+def run(files, output, workers=None, chunksize=16, cache=None, stats=False, optimize=False, passes=PASSES,
+        stream=False, share=False, block_workers=None):
+    start = time.perf_counter()
+    passed = 0
+    failed = 0
+    cached = 0
+    checking_time = 0.0
+    total_stats = bella_stats.Stats() if stats else None
+    for result in check_files(files, workers, chunksize, cache, stats, optimize, passes, stream, share,
+                              block_workers):
+        if result["ok"]:
+            passed += 1
+        else:
+            failed += 1
+        if result.get("cached"):
+            cached += 1
+        checking_time += result["seconds"]
+        if stats:
+            total_stats.merge(bella_stats.Stats.from_dict(result["stats"]))
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+
+    # Evict once all workers are done rather than from every worker
+    if cache is not None:
+        cache.evict()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "summary": True,
+        "files": passed + failed,
+        "passed": passed,
+        "failed": failed,
+        "cached": cached,
+        "seconds": elapsed,
+        # Time spent in check_file summed over all workers
+        "checking_seconds": checking_time,
+        "files_per_second": (passed + failed) / elapsed if elapsed else 0.0,
+    }
+    if stats:
+        summary["stats"] = total_stats.as_dict()
+    output.write(json.dumps(summary) + "\n")
+    return summary
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+import argparse
+import io
+import json
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import bella_lexer as lexer
+import bella_parser as parser
+import bella_memory_verifier as memory_verifier
+import bella_token
+from bella_compiler import Compiler, Function
+import bella_vm
+from bella_vm import OPERATIONS, VirtualMachine
+from bella_program_generator import ProgramGenerator
+
+# Node types the parser produces for statements, counted as the verifier's unit of work
+STATEMENT_TYPES = {"Assign", "While", "Branch", "Print", "Free"}
+
+# The tokenizer as it was before the single-pass scanner, kept as a baseline for the comparison
+def legacy_tokenize(input):
+    position = 0
+    tokens = []
+    while position < len(input):
+        remaining_input = input[position:]
+        valid_token = False
+
+        for token_type, regex in lexer.Lexer.token_type_patterns.items():
+            match = re.search(regex, remaining_input)
+            if match:
+                token = bella_token.Token(token_type, match.group())
+                if token.type == "FLOAT":
+                    token.value = float(token.value)
+                if token.type != "WHITESPACE":
+                    tokens.append(token)
+                position += len(match.group())
+                valid_token = True
+                break
+        if not valid_token:
+            raise Exception("Lexer error")
+    return tokens
+
+# A function value of the tree-walking evaluator, closing over the environment it was declared in
+class Closure(Function):
+    __slots__ = ("params", "body", "environment")
+
+    def __init__(self, name, params, body, environment):
+        super().__init__(name, len(params))
+        self.params = params
+        self.body = body
+        self.environment = environment
+
+class Environment:
+    def __init__(self, parent=None):
+        self.values = {}
+        self.parent = parent
+
+    def lookup(self, identifier):
+        environment = self
+        while identifier not in environment.values:
+            environment = environment.parent
+        return environment.values[identifier]
+
+# Runs an AST by walking it recursively and looking names up through a chain of dicts, the way programs
+# were run before the bytecode compiler. Kept as the baseline for the virtual machine
+class TreeEvaluator:
+    def __init__(self, output, loop_limit=None):
+        self.output = output
+        self.loop_limit = loop_limit
+        self.iterations = 0
+        self.heap = set()
+        self.next_address = 1
+
+    def run(self, ast):
+        try:
+            self.run_block(ast, Environment())
+        except ZeroDivisionError:
+            raise Exception("Runtime error: division by zero")
+        except OverflowError:
+            raise Exception("Runtime error: numeric overflow")
+
+    def run_block(self, block, environment):
+        for statement in block.children:
+            if statement is not None:
+                self.run_statement(statement, environment)
+
+    def run_statement(self, statement, environment):
+        match (statement.type):
+            case "Assign":
+                target = statement.children[0]
+                if statement.value == "Declaration":
+                    environment.values[target.value] = self.evaluate(statement.children[1], environment)
+                else:
+                    params = [param.value for param in target.children[0].children]
+                    environment.values[target.value] = Closure(target.value, params, statement.children[1], environment)
+            case "Print":
+                self.output.write(bella_vm.format_value(self.evaluate(statement.children[0], environment)) + "\n")
+            case "Free":
+                address = self.evaluate(statement.children[0], environment)
+                if address not in self.heap:
+                    raise Exception(f"Runtime error: free of unallocated address {address}")
+                self.heap.remove(address)
+            case "While":
+                while self.evaluate(statement.children[0], environment):
+                    self.run_block(statement.children[1], Environment(environment))
+                    self.iterations += 1
+                    if self.loop_limit is not None and self.iterations > self.loop_limit:
+                        raise Exception(f"Runtime error: loop iteration limit of {self.loop_limit} exceeded")
+            case "Branch":
+                if self.evaluate(statement.children[0], environment):
+                    self.run_block(statement.children[1], Environment(environment))
+                elif len(statement.children) > 2:
+                    self.run_block(statement.children[2], Environment(environment))
+
+    def evaluate(self, node, environment):
+        match (node.type):
+            case "Int":
+                return int(node.value)
+            case "Float":
+                return float(node.value)
+            case "Keyword":
+                return node.value == "true"
+            case "Id":
+                if not node.children:
+                    return environment.lookup(node.value)
+                if node.value == "alloc":
+                    address = self.next_address
+                    self.heap.add(address)
+                    self.next_address += 1
+                    return address
+                function = environment.lookup(node.value)
+                call_environment = Environment(function.environment)
+                for param, arg in zip(function.params, node.children[0].children):
+                    call_environment.values[param] = self.evaluate(arg, environment)
+                return self.evaluate(function.body, call_environment)
+            case "Operator":
+                if node.value == "?":
+                    if self.evaluate(node.children[0], environment):
+                        return self.evaluate(node.children[1], environment)
+                    return self.evaluate(node.children[2], environment)
+                if len(node.children) == 1:
+                    value = self.evaluate(node.children[0], environment)
+                    return -value if node.value == "-" else not value
+                if node.value == "&&":
+                    return self.evaluate(node.children[0], environment) and self.evaluate(node.children[1], environment)
+                if node.value == "||":
+                    return self.evaluate(node.children[0], environment) or self.evaluate(node.children[1], environment)
+                return OPERATIONS[node.value](self.evaluate(node.children[0], environment),
+                                              self.evaluate(node.children[1], environment))
+
+# A loop whose body calls a function, allocates and branches; it runs until the loop limit stops it
+EXECUTION_PROGRAM = """
+let n = 10;
+let total = 1;
+function step(x, y) = (x * 3 + y) % 17;
+while n > 0
+{
+    let total = step(total, n) + n * 2;
+    let pointer = alloc();
+    if total % 2 == 0 && total > 4
+    {
+        let half = total / 2;
+        print half;
+    }
+    else
+    {
+        let scaled = 1.5 * 2.0;
+    }
+    free(pointer);
+}
+"""
+
+# Return the loop iterations per second of each way of running a program, stopping at the loop limit
+def compare_execution(program=EXECUTION_PROGRAM, loop_limit=20000, runs=3):
+    ast = parser.Parser(lexer.Lexer(program).tokenize_compact()).parse()
+    memory_verifier.MemoryVerifier.verify_allocation(ast)
+
+    def until_limit(run):
+        try:
+            run()
+        except Exception as e:
+            if "loop iteration limit" not in str(e):
+                raise
+
+    bytecode = Compiler.compile(ast)
+    vm_seconds, _ = best_time(lambda: until_limit(lambda: VirtualMachine.execute(bytecode, io.StringIO(), loop_limit)), runs)
+    tree_seconds, _ = best_time(lambda: until_limit(lambda: TreeEvaluator(io.StringIO(), loop_limit).run(ast)), runs)
+    return {
+        "tree_walker": {"iterations_per_second": loop_limit / tree_seconds},
+        "vm": {"iterations_per_second": loop_limit / vm_seconds},
+    }
+
+# Return the best tokens/sec of a tokenizer over a number of runs
+def tokens_per_second(tokenize, program, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        tokens = tokenize(program)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(tokens) / best
+
+# Return the best time of a function over a number of runs, and its result
+def best_time(function, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+# Peak bytes allocated while a function runs, measured in a separate run since tracing slows it down
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def count_nodes(ast, types=None):
+    count = 0
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        if types is None or node.type in types:
+            count += 1
+        stack.extend(node.children)
+    return count
+
+# Nodes of a tree whose shared subtrees are counted once
+def count_distinct_nodes(ast):
+    seen = set()
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if node is None or id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.extend(node.children)
+    return len(seen)
+
+def stage_result(unit, count, seconds, peak_bytes):
+    return {unit: count, "seconds": seconds, f"{unit}_per_second": count / seconds, "peak_bytes": peak_bytes}
+
+# Time each stage of the front end on a program, each stage starting from the output of the previous one
+def benchmark(program, runs=3):
+    tokenize = lambda: lexer.Lexer(program).tokenize_compact()
+    seconds, tokens = best_time(tokenize, runs)
+    results = {"lexer": stage_result("tokens", len(tokens), seconds, peak_memory(tokenize))}
+
+    parse = lambda: parser.Parser(tokens).parse()
+    seconds, ast = best_time(parse, runs)
+    results["parser"] = stage_result("nodes", count_nodes(ast), seconds, peak_memory(parse))
+
+    # The parse without the scope and type pass, as a syntax-only check runs it
+    parse_syntax = lambda: parser.Parser(tokens, semantic=False).parse()
+    seconds, _ = best_time(parse_syntax, runs)
+    results["syntax"] = stage_result("nodes", count_nodes(ast), seconds, peak_memory(parse_syntax))
+
+    # The parse with identical constant subtrees shared, which holds fewer nodes
+    parse_shared = lambda: parser.Parser(tokens, share=True).parse()
+    seconds, shared_ast = best_time(parse_shared, runs)
+    results["shared_parser"] = stage_result("nodes", count_distinct_nodes(shared_ast), seconds,
+                                            peak_memory(parse_shared))
+
+    verify = lambda: memory_verifier.MemoryVerifier.verify_allocation(ast)
+    seconds, _ = best_time(verify, runs)
+    results["verifier"] = stage_result("statements", count_nodes(ast, STATEMENT_TYPES), seconds, peak_memory(verify))
+    return results
+
+# Throughput metrics of the current results that dropped more than tolerance below the baseline
+def regressions(baseline, results, tolerance):
+    found = []
+    for stage, metrics in results.items():
+        for metric, value in metrics.items():
+            if not metric.endswith("_per_second"):
+                continue
+            old_value = baseline.get(stage, {}).get(metric)
+            if old_value and value < old_value * (1 - tolerance):
+                found.append(f"{stage} {metric}: {value:.0f} vs {old_value:.0f} ({value / old_value - 1:+.1%})")
+    return found
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Benchmark the Bella front end on a generated program")
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--statements", type=int, default=2000)
+    arguments.add_argument("--nesting-depth", type=int, default=3)
+    arguments.add_argument("--expression-depth", type=int, default=3)
+    arguments.add_argument("--alloc-density", type=float, default=0.2)
+    arguments.add_argument("--block-size", type=int, default=4)
+    arguments.add_argument("--runs", type=int, default=3)
+    arguments.add_argument("--output", help="write the results to a JSON file")
+    arguments.add_argument("--baseline", help="compare against the results in a JSON file written by --output")
+    arguments.add_argument("--tolerance", type=float, default=0.1,
+                           help="fraction a throughput may drop below the baseline (default: %(default)s)")
+    arguments.add_argument("--legacy", action="store_true", help="also compare against the legacy tokenizer")
+    arguments.add_argument("--execute", action="store_true",
+                           help="also compare the virtual machine against tree-walking evaluation")
+    options = arguments.parse_args()
+
+    parameters = {
+        "seed": options.seed,
+        "statements": options.statements,
+        "nesting_depth": options.nesting_depth,
+        "expression_depth": options.expression_depth,
+        "alloc_density": options.alloc_density,
+        "block_size": options.block_size,
+    }
+    program = ProgramGenerator(**parameters).generate()
+    results = benchmark(program, options.runs)
+    if options.legacy:
+        results["legacy_lexer"] = {"tokens_per_second": tokens_per_second(legacy_tokenize, program, options.runs)}
+    if options.execute:
+        results.update(compare_execution(runs=options.runs))
+
+    print(f"{len(program)} characters")
+    for stage, metrics in results.items():
+        for metric, value in metrics.items():
+            if metric.endswith("_per_second") or metric == "peak_bytes":
+                print(f"{stage:>12} {metric:>22}: {value:14.0f}")
+    if options.execute:
+        speedup = results["vm"]["iterations_per_second"] / results["tree_walker"]["iterations_per_second"]
+        print(f"{'vm speedup':>35}: {speedup:14.1f}x")
+
+    report = {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "parameters": parameters,
+        "characters": len(program),
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if options.baseline:
+        with open(options.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["parameters"] != parameters:
+            print("warning: baseline was measured with different parameters")
+        found = regressions(baseline["results"], results, options.tolerance)
+        for regression in found:
+            print(f"regression: {regression}")
+        if found:
+            sys.exit(1)
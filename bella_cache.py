@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+import bella_ast_format as ast_format
+
+# Modules whose behaviour decides the cached results; editing any of them invalidates the cache. bella_batch
+# chooses the passes that run and the outcome that is stored, and bella_vm holds the operations the optimizer
+# folds constants with
+FRONT_END_MODULES = ["bella_lexer.py", "bella_token.py", "bella_node.py", "bella_parser.py", "bella_type_checker.py",
+                     "bella_symbol_table.py", "bella_memory_verifier.py", "bella_ast_format.py", "bella_optimizer.py",
+                     "bella_vm.py", "bella_semantic_analyzer.py", "bella_source.py", "bella_parallel.py",
+                     "bella_batch.py"]
+DEFAULT_SIZE_LIMIT = 256 * 1024 * 1024
+
+def front_end_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in FRONT_END_MODULES:
+        with open(os.path.join(directory, module), "rb") as module_file:
+            digest.update(module_file.read())
+    return digest.hexdigest()
+
+# Content-addressed store of check results, keyed by the hash of a file's bytes and the front-end version.
+# Entries are written to a temporary file and renamed into place, so processes sharing the directory never
+# see a partial entry. Reading an entry updates its modification time, which eviction uses as LRU order
+class ResultCache:
+    def __init__(self, directory, size_limit=DEFAULT_SIZE_LIMIT, version=None):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.version = version if version is not None else front_end_version()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source):
+        digest = hashlib.sha256(self.version.encode())
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".pickle")
+
+    # Return the cached outcome for a key as (ok, error), or None on a miss. The AST is not loaded
+    def get_outcome(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as entry:
+                outcome = pickle.load(entry)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return outcome
+
+    # Return the cached AST for a key as a lazily decoded tree, or None on a miss or if the source failed to parse
+    def get_ast(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as entry:
+                pickle.load(entry)
+                data = pickle.load(entry)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return ast_format.loads(data).root if data is not None else None
+
+    def put(self, key, ok, error=None, ast=None):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as entry:
+                # The outcome comes first so get_outcome can stop reading before the AST
+                pickle.dump((ok, error), entry, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(ast_format.dumps(ast) if ast is not None else None, entry, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            raise
+
+    # Remove least recently used entries until the cache fits its size limit. Entries removed by another
+    # process in the meantime are skipped
+    def evict(self):
+        entries = []
+        total = 0
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".pickle"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, path))
+                total += status.st_size
+
+        entries.sort()
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.size_limit:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        return removed
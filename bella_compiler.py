@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# Instructions are an opcode followed by one operand, stored flat in Bytecode.code
+CONST = 0           # push constants[operand]
+LOAD = 1            # push variables[operand]
+STORE = 2           # pop into variables[operand]
+LOAD_LOCAL = 3      # push the current call's argument at operand
+BINARY = 4          # pop the right operand and apply BINARY_OPERATORS[operand] to it and the new top
+NEGATE = 5
+NOT = 6
+JUMP = 7            # continue at operand
+JUMP_IF_FALSE = 8   # pop, continuing at operand if the value is false
+JUMP_IF_FALSE_OR_POP = 9   # for &&: keep a false top and continue at operand, otherwise pop it
+JUMP_IF_TRUE_OR_POP = 10   # for ||: keep a true top and continue at operand, otherwise pop it
+LOOP = 11           # jump back to a loop condition at operand, counting the iteration
+CALL = 12           # call the function below operand arguments on the stack
+RETURN = 13
+PRINT = 14
+ALLOC = 15
+FREE = 16
+HALT = 17
+BINARY_CONST = 18   # apply the operator of fused_operands[operand] to the top and its constant
+
+OPCODE_NAMES = ["CONST", "LOAD", "STORE", "LOAD_LOCAL", "BINARY", "NEGATE", "NOT", "JUMP", "JUMP_IF_FALSE",
+                "JUMP_IF_FALSE_OR_POP", "JUMP_IF_TRUE_OR_POP", "LOOP", "CALL", "RETURN", "PRINT", "ALLOC", "FREE",
+                "HALT", "BINARY_CONST"]
+
+# Operators compiled to BINARY, indexed by its operand
+BINARY_OPERATORS = ["+", "-", "*", "/", "%", "**", "<", "<=", "==", "!=", ">=", ">"]
+BINARY_OPERATOR_CODES = {op: code for code, op in enumerate(BINARY_OPERATORS)}
+
+# A function declared with the function keyword, stored in the constant pool
+class Function:
+    __slots__ = ("name", "arity", "entry")
+
+    def __init__(self, name, arity, entry=None):
+        self.name = name
+        self.arity = arity
+        # Offset of the function's first instruction
+        self.entry = entry
+
+class Bytecode:
+    def __init__(self, code, constants, variable_count, fused_operands=()):
+        self.code = code
+        self.constants = constants
+        # (operator code, constant index) pairs of the BINARY_CONST instructions
+        self.fused_operands = fused_operands
+        # Number of variable slots the program's scopes are flattened into
+        self.variable_count = variable_count
+
+    def disassemble(self):
+        lines = []
+        for offset in range(0, len(self.code), 2):
+            opcode, operand = self.code[offset], self.code[offset + 1]
+            detail = ""
+            if opcode == CONST:
+                constant = self.constants[operand]
+                detail = f"  ({constant.name})" if isinstance(constant, Function) else f"  ({constant!r})"
+            elif opcode == BINARY:
+                detail = f"  ({BINARY_OPERATORS[operand]})"
+            elif opcode == BINARY_CONST:
+                op, constant = self.fused_operands[operand]
+                detail = f"  ({BINARY_OPERATORS[op]} {self.constants[constant]!r})"
+            lines.append(f"{offset:6} {OPCODE_NAMES[opcode]:<20} {operand}{detail}")
+        return "\n".join(lines)
+
+# Compiles a parsed and verified AST to Bytecode. Variables are addressed by the (scope depth, slot)
+# bindings the parser resolved. Scopes that are never live at the same time share slots, so every binding
+# is flattened to one index into a single variable array. Function parameters are the exception: they are
+# read from the arguments of the current call, so nested calls do not overwrite each other's parameters
+class Compiler:
+    def __init__(self):
+        self.code = []
+        self.constants = []
+        self.constant_indices = {}
+        self.variables = {}
+        # (Function, declaration) pairs whose bodies are compiled after the main program
+        self.functions = []
+        # Scope depth of the parameters of the function being compiled, or None outside a function
+        self.parameter_depth = None
+        self.fused_operands = []
+        # Offset the last patched jump points at
+        self.last_target = None
+
+    @staticmethod
+    def compile(ast):
+        compiler = Compiler()
+        compiler.compile_block(ast)
+        compiler.emit(HALT)
+
+        for function, declaration in compiler.functions:
+            function.entry = len(compiler.code)
+            params = declaration.children[0].children[0].children
+            compiler.parameter_depth = params[0].binding[0] if params else None
+            compiler.compile_expression(declaration.children[1])
+            compiler.emit(RETURN)
+        return Bytecode(compiler.code, compiler.constants, len(compiler.variables), compiler.fused_operands)
+
+    def emit(self, opcode, operand=0):
+        # Fuse a constant right operand into its operator, saving a dispatch, unless a jump lands between them
+        code = self.code
+        if opcode == BINARY and len(code) >= 2 and code[-2] == CONST and self.last_target != len(code):
+            self.fused_operands.append((operand, code[-1]))
+            code[-2] = BINARY_CONST
+            code[-1] = len(self.fused_operands) - 1
+            return len(code) - 1
+
+        self.code.append(opcode)
+        self.code.append(operand)
+        return len(self.code) - 1
+
+    # Point the jump whose operand is at operand_offset at the next instruction
+    def patch(self, operand_offset):
+        self.code[operand_offset] = len(self.code)
+        self.last_target = len(self.code)
+
+    def constant(self, value):
+        # Key on the type too, so 1, 1.0 and True get separate entries, and on the bits of floats so 0.0
+        # and -0.0 do
+        key = (float, value.hex()) if isinstance(value, float) else (type(value), value)
+        index = self.constant_indices.get(key)
+        if index is None:
+            index = len(self.constants)
+            self.constants.append(value)
+            self.constant_indices[key] = index
+        return index
+
+    # Emit the load of an identifier's value, from the call's arguments if it is a parameter
+    def load(self, identifier):
+        binding = identifier.binding
+        if self.parameter_depth is not None and binding is not None and binding[0] == self.parameter_depth:
+            self.emit(LOAD_LOCAL, binding[1])
+        else:
+            self.emit(LOAD, self.variable(identifier))
+
+    def variable(self, identifier):
+        if identifier.binding is None:
+            raise Exception(f"Identifier \"{identifier.value}\" not declared")
+        index = self.variables.get(identifier.binding)
+        if index is None:
+            index = len(self.variables)
+            self.variables[identifier.binding] = index
+        return index
+
+    def compile_block(self, block):
+        for statement in block.children:
+            if statement is not None:
+                self.compile_statement(statement)
+
+    def compile_statement(self, statement):
+        match (statement.type):
+            case "Assign":
+                target = statement.children[0]
+                if statement.value == "Declaration":
+                    self.compile_expression(statement.children[1])
+                else:
+                    # Function declaration: its body is compiled once the main program is done
+                    function = Function(target.value, len(target.children[0].children))
+                    self.functions.append((function, statement))
+                    self.emit(CONST, self.constant(function))
+                self.emit(STORE, self.variable(target))
+            case "Print":
+                self.compile_expression(statement.children[0])
+                self.emit(PRINT)
+            case "Free":
+                self.compile_expression(statement.children[0])
+                self.emit(FREE)
+            case "While":
+                start = len(self.code)
+                self.compile_expression(statement.children[0])
+                exit_jump = self.emit(JUMP_IF_FALSE)
+                self.compile_block(statement.children[1])
+                self.emit(LOOP, start)
+                self.patch(exit_jump)
+            case "Branch":
+                self.compile_expression(statement.children[0])
+                else_jump = self.emit(JUMP_IF_FALSE)
+                self.compile_block(statement.children[1])
+                if len(statement.children) > 2:
+                    end_jump = self.emit(JUMP)
+                    self.patch(else_jump)
+                    self.compile_block(statement.children[2])
+                    self.patch(end_jump)
+                else:
+                    self.patch(else_jump)
+            case _:
+                raise Exception(f"Cannot compile {statement.type} statement")
+
+    # Compile an expression with an explicit work stack, so deep expressions do not recurse. Entries are
+    # nodes to compile or tuples of deferred actions: ("emit", opcode, operand), ("jump", opcode, label)
+    # and ("patch", label), where label is a list the jump's operand offset is stored in
+    def compile_expression(self, root):
+        work = [root]
+        while work:
+            item = work.pop()
+            if type(item) is tuple:
+                action = item[0]
+                if action == "emit":
+                    self.emit(item[1], item[2])
+                elif action == "jump":
+                    item[2].append(self.emit(item[1]))
+                else:
+                    self.patch(item[1][0])
+                continue
+
+            node = item
+            match (node.type):
+                case "Int":
+                    self.emit(CONST, self.constant(int(node.value)))
+                case "Float":
+                    self.emit(CONST, self.constant(float(node.value)))
+                case "Keyword":
+                    self.emit(CONST, self.constant(node.value == "true"))
+                case "Id":
+                    if not node.children:
+                        self.load(node)
+                        continue
+                    args = node.children[0].children
+                    if node.value == "alloc" and node.binding == (0, 0):
+                        self.emit(ALLOC)
+                        continue
+                    # Load the function now, then its arguments left to right, then call
+                    self.load(node)
+                    work.append(("emit", CALL, len(args)))
+                    work.extend(reversed(args))
+                case "Operator":
+                    children = node.children
+                    if node.value == "?":
+                        else_label = []
+                        end_label = []
+                        work.extend([("patch", end_label), children[2], ("patch", else_label),
+                                     ("jump", JUMP, end_label), children[1], ("jump", JUMP_IF_FALSE, else_label),
+                                     children[0]])
+                    elif len(children) == 1:
+                        work.append(("emit", NEGATE if node.value == "-" else NOT, 0))
+                        work.append(children[0])
+                    elif node.value == "&&" or node.value == "||":
+                        # Short-circuit: the right operand is skipped when the left one decides the result
+                        end_label = []
+                        opcode = JUMP_IF_FALSE_OR_POP if node.value == "&&" else JUMP_IF_TRUE_OR_POP
+                        work.extend([("patch", end_label), children[1], ("jump", opcode, end_label), children[0]])
+                    else:
+                        work.extend([("emit", BINARY, BINARY_OPERATOR_CODES[node.value]), children[1], children[0]])
+                case _:
+                    raise Exception(f"Cannot compile {node.type} expression")
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+import json
+import os
+import sys
+import time
+
+import bella_batch as batch
+import bella_cache as cache
+from bella_incremental import IncrementalDocument
+from bella_source import describe
+
+# Largest message the server reads, as one line of JSON
+MAX_MESSAGE = 64 * 1024 * 1024
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+# Apply queued edits to an OpenDocument and verify the result, in an executor thread. Each edit is either
+# {"offset", "deleted", "inserted"} or {"text"} to replace the whole text. The edits are always applied,
+# since later ones are relative to them, but verification is skipped once stale() reports that a newer
+# version of the document is waiting to be checked. An edit that fails before it changes the text leaves
+# the server's text different from the client's, so the document reports an error and ignores edits until
+# a {"text"} edit resyncs it. Returns None if the check was skipped
+def check_document(open_document, edits, stale):
+    start = time.perf_counter()
+    document = open_document.document
+    for edit in edits:
+        if "text" in edit:
+            open_document.desync = None
+        elif open_document.desync is not None:
+            continue
+        try:
+            if "text" in edit:
+                document.edit(0, len(document.text), edit["text"])
+            else:
+                document.edit(edit["offset"], edit["deleted"], edit["inserted"])
+        except Exception as e:
+            # A parse error keeps the edited text, and the document is parsed from scratch on its next edit
+            if document.error is not e:
+                open_document.desync = f"{type(e).__name__}: {e}"
+
+    result = {"ok": True}
+    if open_document.desync is not None:
+        result["ok"] = False
+        result["error"] = f"Document out of sync after a failed edit ({open_document.desync}); send its full text"
+        result["seconds"] = time.perf_counter() - start
+        return result
+    if document.error is not None:
+        # Spans from the last parse match the text, as the parse that failed was of the current text
+        result["ok"] = False
+        result["error"] = describe(document.error, document.text)
+        result["seconds"] = time.perf_counter() - start
+        return result
+    try:
+        if stale():
+            return None
+        document.verify()
+    except Exception as e:
+        result["ok"] = False
+        result["error"] = describe(e, document.text)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+# Check that edits are well formed and within the text they apply to, which is length characters long once
+# the edits before them are applied. Returns the length of the text after the edits
+def validate_edits(edits, length):
+    if not isinstance(edits, list):
+        raise RpcError(INVALID_PARAMS, "Edits must be a list")
+    for edit in edits:
+        if isinstance(edit, dict) and isinstance(edit.get("text"), str):
+            length = len(edit["text"])
+            continue
+        if not isinstance(edit, dict) or not isinstance(edit.get("inserted"), str) or not all(
+                type(edit.get(field)) is int for field in ("offset", "deleted")):
+            raise RpcError(INVALID_PARAMS, "Each edit must be {\"text\"} or {\"offset\", \"deleted\", \"inserted\"}")
+        if edit["offset"] < 0 or edit["deleted"] < 0 or edit["offset"] + edit["deleted"] > length:
+            raise RpcError(INVALID_PARAMS, "Edit outside of document")
+        length += len(edit["inserted"]) - edit["deleted"]
+    return length
+
+# A document open in the server. version counts the changes the client sent; result is the outcome of
+# the last check that was not stale
+class OpenDocument:
+    def __init__(self, uri):
+        self.uri = uri
+        self.document = IncrementalDocument("")
+        self.version = 0
+        self.checked_version = None
+        self.result = None
+        # Length of the text once every edit received is applied, which new edits are validated against
+        self.length = 0
+        # Why the text no longer matches the client's, or None while it does
+        self.desync = None
+        # Edits received since the last check started
+        self.pending = []
+        # Task sleeping out the debounce delay before a check, or None
+        self.timer = None
+        # Held while a check runs, so checks of one document run one at a time and in order
+        self.lock = asyncio.Lock()
+
+# Long-running checker that keeps open documents parsed in memory. Clients send newline-delimited JSON-RPC
+# 2.0 messages over stdio or a Unix socket:
+#   open {uri, text}, change {uri, edits}, close {uri}  - notifications, no reply needed
+#   check {uri}        - flush pending edits and return the diagnostics of the document's latest version
+#   checkFile {path}   - check a file from disk, as bella_batch.check_file does
+#   shutdown           - stop the server
+# After each check the server sends a diagnostics notification {uri, version, ok, error, seconds}. Edits
+# that arrive within the debounce delay of each other are checked together, and a check whose document
+# changed while it ran is not verified or reported
+class CheckServer:
+    def __init__(self, debounce=0.05, workers=None, result_cache=None):
+        self.debounce = debounce
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.result_cache = result_cache
+        self.documents = {}
+        self.writers = []
+        # Tasks serving connected clients
+        self.connections = set()
+        self.stopped = asyncio.Event()
+
+    # Serve one client until it disconnects or the server is shut down
+    async def serve(self, reader, writer):
+        self.writers.append(writer)
+        self.connections.add(asyncio.current_task())
+        tasks = set()
+        stop = asyncio.ensure_future(self.stopped.wait())
+        try:
+            while True:
+                read = asyncio.ensure_future(reader.readline())
+                await asyncio.wait((read, stop), return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    read.cancel()
+                    break
+                line = read.result()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # Handle each message in its own task, so a slow check does not hold up later changes
+                task = asyncio.ensure_future(self.handle(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            stop.cancel()
+            self.writers.remove(writer)
+            self.connections.discard(asyncio.current_task())
+
+    async def handle(self, line, writer):
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            await self.send(writer, {"jsonrpc": "2.0", "id": None,
+                                     "error": {"code": PARSE_ERROR, "message": str(e)}})
+            return
+        if not isinstance(message, dict) or not isinstance(message.get("method"), str):
+            await self.send(writer, {"jsonrpc": "2.0", "id": None,
+                                     "error": {"code": INVALID_REQUEST, "message": "Invalid request"}})
+            return
+
+        request_id = message.get("id")
+        params = message.get("params") or {}
+        method = getattr(self, "rpc_" + message["method"], None)
+        try:
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"Method \"{message['method']}\" not found")
+            # Params are bound before the call, so a TypeError raised by the method itself is an internal error
+            try:
+                signature = inspect.signature(method)
+                arguments = signature.bind(*params) if isinstance(params, list) else signature.bind(**params)
+            except TypeError as e:
+                raise RpcError(INVALID_PARAMS, str(e))
+            result = await method(*arguments.args, **arguments.kwargs)
+        except RpcError as e:
+            response = {"error": {"code": e.code, "message": str(e)}}
+        except Exception as e:
+            response = {"error": {"code": INTERNAL_ERROR, "message": f"{type(e).__name__}: {e}"}}
+        else:
+            response = {"result": result}
+        # Notifications get no reply
+        if "id" in message:
+            await self.send(writer, {"jsonrpc": "2.0", "id": request_id, **response})
+
+    async def send(self, writer, message):
+        if writer.is_closing():
+            return
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+
+    async def notify(self, method, params):
+        for writer in list(self.writers):
+            await self.send(writer, {"jsonrpc": "2.0", "method": method, "params": params})
+
+    def document(self, uri):
+        document = self.documents.get(uri)
+        if document is None:
+            raise RpcError(INVALID_PARAMS, f"Document \"{uri}\" is not open")
+        return document
+
+    async def rpc_open(self, uri, text):
+        if uri in self.documents:
+            await self.rpc_close(uri)
+        document = OpenDocument(uri)
+        self.documents[uri] = document
+        document.pending.append({"text": text})
+        document.length = len(text)
+        document.version += 1
+        # An opened document is checked straight away
+        await self.run_check(document)
+
+    async def rpc_change(self, uri, edits):
+        document = self.document(uri)
+        # Malformed edits are rejected before any of them is queued
+        document.length = validate_edits(edits, document.length)
+        document.pending.extend(edits)
+        document.version += 1
+        if document.timer is not None:
+            document.timer.cancel()
+        document.timer = asyncio.ensure_future(self.check_later(document))
+
+    async def rpc_close(self, uri):
+        document = self.documents.pop(uri, None)
+        if document is not None and document.timer is not None:
+            document.timer.cancel()
+
+    async def rpc_check(self, uri):
+        document = self.document(uri)
+        if document.timer is not None:
+            document.timer.cancel()
+            document.timer = None
+        # Changes that arrive while a check runs make it stale, so check again until the reply is for the
+        # latest version
+        while document.pending or document.checked_version != document.version:
+            if document.timer is not None:
+                document.timer.cancel()
+                document.timer = None
+            await self.run_check(document)
+            if self.documents.get(uri) is not document:
+                raise RpcError(INVALID_PARAMS, f"Document \"{uri}\" was closed")
+        return self.diagnostics(document)
+
+    async def rpc_checkFile(self, path):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, batch.check_file, path, self.result_cache)
+
+    async def rpc_shutdown(self):
+        self.stopped.set()
+
+    async def check_later(self, document):
+        await asyncio.sleep(self.debounce)
+        # Past this point the check is not cancelled, since it takes the pending edits with it
+        document.timer = None
+        await self.run_check(document)
+
+    async def run_check(self, document):
+        async with document.lock:
+            if not document.pending and document.checked_version == document.version:
+                return
+            edits = document.pending
+            document.pending = []
+            version = document.version
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, check_document, document, edits,
+                                                lambda: document.version != version)
+            if result is None or document.version != version or self.documents.get(document.uri) is not document:
+                return
+            document.result = result
+            document.checked_version = version
+        await self.notify("diagnostics", self.diagnostics(document))
+
+    def diagnostics(self, document):
+        return {"uri": document.uri, "version": document.checked_version, **(document.result or {})}
+
+# Raised by an RPC method to reply with an error
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+# Serve a single client over stdin and stdout
+async def serve_stdio(server):
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_MESSAGE)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    await server.serve(reader, writer)
+
+# Serve any number of clients on a Unix socket until one of them sends shutdown
+async def serve_socket(server, path):
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = await asyncio.start_unix_server(server.serve, path, limit=MAX_MESSAGE)
+    async with listener:
+        await server.stopped.wait()
+        # Let every client finish the requests it already sent
+        await asyncio.gather(*server.connections, return_exceptions=True)
+    os.unlink(path)
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description="Serve Bella checks over JSON-RPC")
+    arguments.add_argument("--socket", metavar="PATH", help="listen on a Unix socket instead of stdio")
+    arguments.add_argument("--debounce", type=float, default=50,
+                           help="milliseconds to wait for more edits before checking (default: %(default)s)")
+    arguments.add_argument("--workers", type=int, default=None, help="threads that run checks")
+    arguments.add_argument("--cache", metavar="DIR", help="reuse checkFile results stored in a cache directory")
+    options = arguments.parse_args(argv)
+
+    async def run():
+        result_cache = None
+        if options.cache:
+            # Shares entries with the checker CLI run with its default passes
+            version = cache.front_end_version() + "+" + ",".join(sorted(batch.PASSES))
+            result_cache = cache.ResultCache(options.cache, version=version)
+        server = CheckServer(options.debounce / 1000, options.workers, result_cache)
+        try:
+            if options.socket:
+                await serve_socket(server, options.socket)
+            else:
+                await serve_stdio(server)
+        finally:
+            server.executor.shutdown(wait=False)
+            if result_cache is not None:
+                result_cache.evict()
+
+    asyncio.run(run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
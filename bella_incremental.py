@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+from array import array
+from bisect import bisect_left, bisect_right
+import heapq
+
+from bella_lexer import Lexer
+from bella_memory_verifier import MemoryVerifier
+from bella_node import Node
+from bella_parser import Parser
+from bella_semantic_analyzer import SemanticAnalyzer
+from bella_symbol_table import Symbol, SymbolTable
+from bella_token import InternTable
+
+# Types of the identifiers every program starts with
+BUILTINS = {"alloc": "INTEGER", "free": "VOID"}
+# Gap left between the order keys of neighbouring statements so new ones can be inserted between them
+KEY_SPACING = 1 << 20
+MISSING = object()
+
+# One top-level statement of a document
+class Segment:
+    __slots__ = ("key", "node", "declares", "uses")
+
+    def __init__(self, key, node, declares, uses):
+        # Orders segments without depending on their index, which changes as statements are spliced in
+        self.key = key
+        self.node = node
+        # Interned identifier -> type of the root-scope declarations the statement makes
+        self.declares = declares
+        # Root-scope identifiers declared before the statement that it reads or redeclares
+        self.uses = uses
+
+# Root scope for one top-level statement. Identifiers declared by earlier statements are bound on first use
+# and recorded as dependencies of the statement. Root slots are numbered per document, so bindings stay
+# consistent across statements that were parsed at different times
+class StatementScope(SymbolTable):
+    def __init__(self, document, key, range_declares):
+        super().__init__(interns=document.interns)
+        self.slots = {}
+        self.document = document
+        # Declarations of segments with a smaller key are visible
+        self.key = key
+        # Declarations of the statements parsed before this one in the same range
+        self.range_declares = range_declares
+        self.declares = {}
+        self.uses = set()
+
+    def resolve_missing(self, identifier):
+        type = self.range_declares.get(identifier, MISSING)
+        if type is MISSING:
+            type = self.document.declared_type(identifier, self.key)
+        # Record misses too, so the statement is bound again if a declaration is added before it
+        self.uses.add(identifier)
+        if type is MISSING:
+            return None
+
+        slot = self.document.root_slot(identifier)
+        self.table[identifier] = slot
+        self.slots[slot] = Symbol(type)
+        return (0, slot)
+
+    def add(self, identifier, type, initialized=False):
+        # Redeclaring an earlier statement's identifier is checked against its type, as in a full parse
+        if identifier not in self.table:
+            self.resolve_missing(identifier)
+
+        if identifier in self.table:
+            super().add(identifier, type, initialized)
+        else:
+            slot = self.document.root_slot(identifier)
+            self.table[identifier] = slot
+            self.slots[slot] = Symbol(type, initialized)
+        self.declares[identifier] = self.slots[self.table[identifier]].type
+
+# A parsed program that can be updated in place by text edits. An edit re-lexes and re-parses only the
+# top-level statements around it and splices them into the Program node. Statements after the edit are
+# checked again only if a declaration they depend on changed type
+class IncrementalDocument:
+    def __init__(self, text):
+        self.text = text
+        # Every parse of the document interns identifiers in the same table, so their numbers agree
+        self.interns = InternTable()
+        # Interned builtin -> type
+        self.builtins = {self.interns.intern(identifier): type for identifier, type in BUILTINS.items()}
+        self.error = None
+        self.parse_all()
+
+    # Replace deleted characters at offset with inserted, returning the updated Program node
+    def edit(self, offset, deleted, inserted):
+        old_end = offset + deleted
+        if offset < 0 or old_end > len(self.text):
+            raise Exception("Edit outside of document")
+        text = self.text[:offset] + inserted + self.text[old_end:]
+        delta = len(inserted) - deleted
+
+        if self.error is not None or not self.segments:
+            self.text = text
+            self.parse_all()
+            return self.ast
+
+        self.text = text
+        try:
+            self.reparse(offset, old_end, delta)
+        except Exception as e:
+            # Leave the document to be parsed from scratch on the next edit
+            self.error = e
+            raise
+        return self.ast
+
+    # Verify the document's allocations a statement at a time. Statements that were not parsed again keep the
+    # offsets they were parsed at, so an error's span is moved by how far its statement has shifted since
+    def verify(self):
+        verifier = MemoryVerifier()
+        for index, segment in enumerate(self.segments):
+            try:
+                verifier.feed(segment.node)
+            except Exception as error:
+                shift = self.segment_start(index) - segment.node.start
+                if shift and getattr(error, "start", None) is not None:
+                    error.start += shift
+                    error.end += shift
+                raise
+        verifier.finish()
+
+    def parse_all(self):
+        self.ast = Node("Program", "program", [])
+        self.segments = []
+        self.keys = []
+        self.starts = array("q")
+        # Segments from shift_from onwards start at their stored offset plus shift
+        self.shift_from = 0
+        self.shift = 0
+        # Identifier -> sorted keys of the segments that declare it, and of the segments that use it
+        self.declarations = {}
+        self.users = {}
+        self.segment_by_key = {}
+        self.root_slots = {identifier: slot for slot, identifier in enumerate(self.builtins)}
+        self.error = None
+
+        try:
+            parsed = self.parse_range(self.text, 0, len(self.text), KEY_SPACING)
+        except Exception as e:
+            self.error = e
+            raise
+        self.splice(0, 0, parsed, 0)
+
+    # Type of the last declaration of an identifier in a segment ordered before key
+    def declared_type(self, identifier, key):
+        keys = self.declarations.get(identifier)
+        if keys:
+            index = bisect_left(keys, key)
+            if index:
+                return self.segment_by_key[keys[index - 1]].declares[identifier]
+        return self.builtins.get(identifier, MISSING)
+
+    def root_slot(self, identifier):
+        slot = self.root_slots.get(identifier)
+        if slot is None:
+            slot = len(self.root_slots)
+            self.root_slots[identifier] = slot
+        return slot
+
+    def segment_start(self, index):
+        if index >= self.shift_from:
+            return self.starts[index] + self.shift
+        return self.starts[index]
+
+    # Move the point the pending shift applies from. Costs the distance moved, which stays small while
+    # edits are close together
+    def move_shift(self, index):
+        starts = self.starts
+        if index > self.shift_from:
+            starts[self.shift_from:index] = array("q", map(self.shift.__add__, starts[self.shift_from:index]))
+        elif index < self.shift_from:
+            starts[index:self.shift_from] = array("q", map((-self.shift).__add__, starts[index:self.shift_from]))
+        self.shift_from = index
+
+    # Index of the first segment starting after offset, searching the gap-shifted starts
+    def segment_after(self, offset):
+        low = 0
+        high = len(self.segments)
+        while low < high:
+            middle = (low + high) // 2
+            if self.segment_start(middle) <= offset:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def reparse(self, offset, old_end, delta):
+        text = self.text
+        count = len(self.segments)
+        # Start from the statement that owns the start of the edited line: no token spans a newline, so
+        # the lexer is known to pass through that point
+        line_start = text.rfind("\n", 0, offset) + 1
+        first = max(self.segment_after(line_start) - 1, 0)
+        lex_start = self.segment_start(first) if first else 0
+        # First statement that starts after the deleted text
+        last = bisect_left(range(count), old_end, key=self.segment_start)
+
+        # Widen the damaged range until it ends on an unchanged statement boundary
+        while True:
+            end = self.segment_start(last) + delta if last < count else len(text)
+            parsed = self.parse_range(text, lex_start, end, self.keys[first])
+            if parsed is not None:
+                break
+            last = min(count, last + max(1, last - first))
+
+        old_declares = [self.segments[index].declares for index in range(first, last)]
+        self.splice(first, last, parsed, delta)
+        self.recheck(first, first + len(parsed), old_declares)
+
+    # Lex and parse text[start:end] as a run of top-level statements, with the declarations of segments
+    # ordered before key in scope. Returns (start offset, node, scope) for each statement, or None if the
+    # range does not end on a token and statement boundary
+    def parse_range(self, text, start, end, key):
+        lexer = Lexer(text, self.interns)
+        lexer.position = start
+        tokens = lexer.tokenize_compact(end)
+        at_end_of_text = end == len(text)
+        if lexer.position != end and not at_end_of_text:
+            return None
+
+        parser = Parser(tokens, semantic=False)
+        parsed = []
+        range_declares = {}
+        while parser.position < len(tokens):
+            # Comments belong to the statement before them
+            if tokens.type_at(parser.position) == "COMMENT":
+                parser.position += 1
+                continue
+
+            first_token = parser.position
+            try:
+                node = parser.parse_statement()
+            except Exception:
+                # The statement runs past the end of the range
+                if parser.position >= len(tokens) and not at_end_of_text:
+                    return None
+                raise
+            scope = StatementScope(self, key, range_declares)
+            SemanticAnalyzer(scope, self.interns).analyze_statement(node)
+            parsed.append((tokens.starts[first_token], node, scope))
+            range_declares.update(scope.declares)
+        return parsed
+
+    # Replace segments [first, last) with newly parsed statements
+    def splice(self, first, last, parsed, delta):
+        # Spread the new keys between the neighbouring segments, renumbering everything if they do not fit
+        low = self.keys[first - 1] if first else 0
+        high = self.keys[last] if last < len(self.keys) else low + (len(parsed) + 1) * KEY_SPACING
+        step = (high - low) // (len(parsed) + 1)
+        if step == 0:
+            self.renumber()
+            low = self.keys[first - 1] if first else 0
+            high = self.keys[last] if last < len(self.keys) else low + (len(parsed) + 1) * KEY_SPACING
+            step = (high - low) // (len(parsed) + 1)
+
+        for segment in self.segments[first:last]:
+            self.unindex(segment)
+        segments = []
+        for number, (start, node, scope) in enumerate(parsed, 1):
+            segment = Segment(low + number * step, node, scope.declares, scope.uses)
+            self.index(segment)
+            segments.append(segment)
+
+        self.move_shift(last)
+        self.segments[first:last] = segments
+        self.keys[first:last] = [segment.key for segment in segments]
+        self.starts[first:last] = array("q", (start for start, node, scope in parsed))
+        self.ast.children[first:last] = [segment.node for segment in segments]
+        self.shift_from = first + len(segments)
+        self.shift += delta
+
+    def index(self, segment):
+        self.segment_by_key[segment.key] = segment
+        for identifier in segment.declares:
+            keys = self.declarations.setdefault(identifier, [])
+            keys.insert(bisect_left(keys, segment.key), segment.key)
+        for identifier in segment.uses:
+            keys = self.users.setdefault(identifier, [])
+            keys.insert(bisect_left(keys, segment.key), segment.key)
+
+    def unindex(self, segment):
+        del self.segment_by_key[segment.key]
+        for identifier in segment.declares:
+            keys = self.declarations[identifier]
+            del keys[bisect_left(keys, segment.key)]
+        for identifier in segment.uses:
+            keys = self.users[identifier]
+            del keys[bisect_left(keys, segment.key)]
+
+    def renumber(self):
+        for segment in self.segments:
+            self.unindex(segment)
+        for number, segment in enumerate(self.segments, 1):
+            segment.key = number * KEY_SPACING
+            self.index(segment)
+        self.keys = [segment.key for segment in self.segments]
+
+    # Re-check the statements after segments [first, last) that read a root declaration whose type the
+    # replaced statements changed, following changes they cause in turn
+    def recheck(self, first, last, old_declares):
+        bound = self.keys[last] if last < len(self.keys) else None
+        if bound is None:
+            return
+
+        # Type of each identifier as seen just after the old and the new statements
+        old_types = {}
+        for declares in old_declares:
+            old_types.update(declares)
+        new_types = {}
+        for segment in self.segments[first:last]:
+            new_types.update(segment.declares)
+
+        pending = []
+        queued = set()
+        for identifier in old_types.keys() | new_types.keys():
+            before = self.declared_type(identifier, self.keys[first])
+            if old_types.get(identifier, before) != new_types.get(identifier, before):
+                self.queue_dependents(identifier, bound - 1, pending, queued)
+
+        while pending:
+            key = heapq.heappop(pending)
+            index = bisect_left(self.keys, key)
+            segment = self.segments[index]
+            end = self.segment_start(index + 1) if index + 1 < len(self.segments) else len(self.text)
+            parsed = self.parse_range(self.text, self.segment_start(index), end, key)
+
+            start, node, scope = parsed[0]
+            changed = [identifier for identifier in segment.declares.keys() | scope.declares.keys()
+                       if segment.declares.get(identifier, MISSING) != scope.declares.get(identifier, MISSING)]
+            self.unindex(segment)
+            segment.node = node
+            segment.declares = scope.declares
+            segment.uses = scope.uses
+            self.index(segment)
+            self.ast.children[index] = node
+
+            for identifier in changed:
+                self.queue_dependents(identifier, key, pending, queued)
+
+    # Queue the segments after key that use an identifier, up to and including the next one that declares it
+    def queue_dependents(self, identifier, key, pending, queued):
+        declarations = self.declarations.get(identifier, [])
+        next_declaration = bisect_right(declarations, key)
+        limit = declarations[next_declaration] if next_declaration < len(declarations) else None
+
+        # The next declaration checks its type against the previous one, so it depends on it too
+        dependents = [] if limit is None else [limit]
+        users = self.users.get(identifier, [])
+        for user in users[bisect_right(users, key):]:
+            if limit is not None and user > limit:
+                break
+            dependents.append(user)
+
+        for dependent in dependents:
+            if dependent not in queued:
+                queued.add(dependent)
+                heapq.heappush(pending, dependent)
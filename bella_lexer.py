@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 
+from bisect import bisect_left
+
+import bella_prescan
+import bella_stats
 import bella_token
+from bella_source import SourceError
+import mmap
+import os
 import re
+import time
 
 class Lexer:
     token_type_patterns = {
@@ -27,33 +35,372 @@ class Lexer:
         "ASSIGN":"^(\\=)",
     }
 
-    def __init__(self, input):
+    # A run of whitespace, which the scanner steps over in one match instead of one per character
+    whitespace_regex = re.compile(token_type_patterns["WHITESPACE"][1:] + "*")
+    # All other token patterns joined into one alternation of named groups, after the run of whitespace that
+    # comes before the token, so the scanner does Python work once per token. The regex engine tries the
+    # alternatives left to right, so the first pattern in token_type_patterns still wins. The empty last
+    # alternative matches the whitespace at the end of the input, and leaves lastindex as None
+    token_regex = re.compile(whitespace_regex.pattern + "(?:" + "|".join(
+        f"(?P<{token_type}>{regex[1:]})" for token_type, regex in token_type_patterns.items()
+        if token_type != "WHITESPACE") + "|\\Z)")
+
+    # Token type names indexed by the kind codes stored in a TokenStream
+    token_types = tuple(token_type_patterns)
+    # Master regex group number -> kind code, so the scanner never compares group names
+    group_kinds = [None] * (token_regex.groups + 1)
+    for token_type, group in token_regex.groupindex.items():
+        group_kinds[group] = token_types.index(token_type)
+    del token_type, group
+
+    # Identifiers found by tokenize_compact are numbered in interns, which callers lexing several pieces
+    # of one program pass in so the numbers agree
+    def __init__(self, input, interns=None):
         self.input = input
         self.position = 0
         self.tokens = []
+        self.interns = interns if interns is not None else bella_token.InternTable()
 
     # Convert the input string into a list of token objects
     def tokenize(self):
-        while self.position < len(self.input):
-            remaining_input = self.input[self.position:]
-            valid_token = False
-
-            # Find the first token type regex that matches from the start of the string
-            for token_type, regex in self.token_type_patterns.items():
-                match = re.search(regex, remaining_input)
-                if match:
-                    token = bella_token.Token(token_type, match.group())
-                    if token.type == "INTEGER":
-                        token.value = int(token.value)
-                    if token.type == "FLOAT":
-                        token.value = float(token.value)
-                    if token.type != "WHITESPACE":
-                        self.tokens.append(token)
-                    self.position += len(match.group())
-                    valid_token = True
-                    break
-            if not valid_token:
-                raise Exception("Lexer error")
+        stats = bella_stats.collector
+        if stats is not None:
+            started = time.perf_counter()
+            skipped = 0
+        input = self.input
+        input_length = len(input)
+        match_token = self.token_regex.match
 
+        while self.position < input_length:
+            # Match the token starting at the current position without slicing the input
+            match = match_token(input, self.position)
+            if match is None:
+                self.position = self.whitespace_regex.match(input, self.position).end()
+                raise SourceError("Lexer error", self.position, self.position + 1)
 
+            token_type = match.lastgroup
+            self.position = match.end()
+            if token_type is None:
+                # Only whitespace was left
+                if stats is not None:
+                    skipped += 1
+                continue
+
+            token = bella_token.Token(token_type, match.group(token_type), match.start(token_type), self.position)
+            if token.type == "INTEGER":
+                token.value = int(token.value)
+            if token.type == "FLOAT":
+                token.value = float(token.value)
+            self.tokens.append(token)
+
+        if stats is not None:
+            stats.time("lex", time.perf_counter() - started)
+            stats.count("tokens", len(self.tokens))
+            stats.count("regex_attempts", len(self.tokens) + skipped)
         return self.tokens
+
+    # Convert the input string into a compact TokenStream of kind codes and offsets. Lexing starts at the
+    # current position and stops at the first token boundary at or after end. A whole input is lexed by the
+    # NumPy pre-pass where it can be, and by scan elsewhere
+    def tokenize_compact(self, end=None):
+        stats = bella_stats.collector
+        if stats is not None:
+            started = time.perf_counter()
+        stream = bella_token.TokenStream(self.input, self.token_types, self.interns)
+        prescanned = bella_prescan.prescan(self.input, self) if end is None and self.position == 0 else None
+        if prescanned is None:
+            attempts = self.scan(stream, len(self.input) if end is None else end)
+        else:
+            attempts = 0
+            done = 0
+            for index, start, span_end in prescanned.spans:
+                self.extend(stream, prescanned, done, index)
+                self.position = start
+                attempts += self.scan(stream, span_end)
+                done = index
+            self.extend(stream, prescanned, done, len(prescanned.kinds))
+            self.position = len(self.input)
+
+        if stats is not None:
+            stats.time("lex", time.perf_counter() - started)
+            stats.count("tokens", len(stream))
+            stats.count("regex_attempts", attempts)
+        return stream
+
+    # Append the tokens of the source from the current position to the first token boundary at or after end
+    # to stream. Returns the number of regex attempts made
+    def scan(self, stream, end):
+        input = self.input
+        input_length = end
+        match_token = self.token_regex.match
+        group_kinds = self.group_kinds
+        id_kind = self.token_types.index("ID")
+
+        kinds = stream.kinds
+        first = len(kinds)
+        append_kind = kinds.append
+        append_start = stream.starts.append
+        append_end = stream.ends.append
+        identifiers = stream.identifiers
+        numbers = self.interns.numbers
+        intern = self.interns.intern
+
+        position = self.position
+        # Attempts that did not produce a token: at most the one that reaches the stopping point
+        skipped = 0
+        while position < input_length:
+            match = match_token(input, position)
+            if match is None:
+                position = self.whitespace_regex.match(input, position).end()
+                if position >= input_length:
+                    # The offending character is past where lexing stops
+                    position = input_length
+                    break
+                self.position = position
+                raise SourceError("Lexer error", position, position + 1)
+
+            group = match.lastindex
+            if group is None:
+                # Only whitespace was left
+                position = input_length
+                skipped = 1
+                break
+            start, end = match.span(group)
+            if start >= input_length:
+                # The token starts past the stopping point, so stop in the whitespace before it
+                position = input_length
+                skipped = 1
+                break
+            position = end
+            kind = group_kinds[group]
+            if kind == id_kind:
+                name = input[start:position]
+                number = numbers.get(name)
+                identifiers[len(kinds)] = number if number is not None else intern(name)
+            append_kind(kind)
+            append_start(start)
+            append_end(position)
+
+        self.position = position
+        return len(kinds) - first + skipped
+
+    # Append the pre-pass tokens from index first up to index last to stream, interning identifiers in order
+    def extend(self, stream, prescanned, first, last):
+        offset = len(stream.kinds) - first
+        stream.kinds.extend(prescanned.kinds[first:last])
+        stream.starts.extend(prescanned.starts[first:last])
+        stream.ends.extend(prescanned.ends[first:last])
+        input = self.input
+        identifiers = stream.identifiers
+        numbers = self.interns.numbers
+        intern = self.interns.intern
+        for index in prescanned.identifiers[bisect_left(prescanned.identifiers, first):
+                                            bisect_left(prescanned.identifiers, last)]:
+            name = input[prescanned.starts[index]:prescanned.ends[index]]
+            number = numbers.get(name)
+            identifiers[index + offset] = number if number is not None else intern(name)
+
+# Lex a file through a read-only memory map, yielding tokens one at a time instead of building a list
+class StreamLexer:
+    token_regex = re.compile(Lexer.token_regex.pattern.encode())
+    whitespace_regex = re.compile(Lexer.whitespace_regex.pattern.encode())
+
+    # The source is either a path or a binary file object opened for reading
+    def __init__(self, source):
+        if isinstance(source, (str, bytes, os.PathLike)):
+            self.file = open(source, "rb")
+            self.owns_file = True
+        else:
+            self.file = source
+            self.owns_file = False
+
+        # An empty file cannot be memory-mapped
+        if os.fstat(self.file.fileno()).st_size == 0:
+            self.buffer = b""
+        else:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        if self.owns_file:
+            self.file.close()
+
+    # Yield lazy token objects whose values are decoded from the map only when they are read
+    def tokens(self):
+        buffer = self.buffer
+        buffer_length = len(buffer)
+        match_token = self.token_regex.match
+
+        while self.position < buffer_length:
+            match = match_token(buffer, self.position)
+            if match is None:
+                self.position = self.whitespace_regex.match(buffer, self.position).end()
+                raise SourceError("Lexer error", self.position, self.position + 1)
+
+            token_type = match.lastgroup
+            self.position = match.end()
+            if token_type is not None:
+                yield bella_token.LazyToken(token_type, buffer, match.start(token_type), self.position)
+
+# The tokens of a StreamLexer behind the cursor API of a TokenStream, so a Parser can read a mapped file.
+# Tokens are lexed as the parser reaches them, and those before a point the parser will not return to are
+# released with discard. As in a TokenWindow, indexes are those of the whole stream, and the length counts one
+# token past the ones lexed while input is left. Offsets are byte offsets into the file
+class StreamCursor:
+    # Released tokens are dropped once this many have built up, rather than once a statement
+    drop_size = 4096
+
+    def __init__(self, stream_lexer, interns=None):
+        self.lexer = stream_lexer
+        self.scanner = stream_lexer.tokens()
+        self.interns = interns if interns is not None else bella_token.InternTable()
+        self.held = []
+        # Index of the first token held, and of the first one not yet released
+        self.base = 0
+        self.released = 0
+        self.skip_whitespace()
+
+    # Input is only left while another token is, as whitespace is not a token
+    def skip_whitespace(self):
+        buffer = self.lexer.buffer
+        self.exhausted = self.lexer.whitespace_regex.match(buffer, self.lexer.position).end() >= len(buffer)
+
+    # Lex until the token at index is held or the input runs out
+    def fill(self, index):
+        while index >= self.base + len(self.held) and not self.exhausted:
+            dropped = self.released - self.base
+            if dropped >= self.drop_size:
+                del self.held[:dropped]
+                self.base = self.released
+            self.held.append(next(self.scanner))
+            self.skip_whitespace()
+
+    def token(self, index):
+        if index - self.base >= len(self.held):
+            self.fill(index)
+        return self.held[index - self.base]
+
+    # Release the tokens before index
+    def discard(self, index):
+        self.released = max(self.released, index)
+
+    def __len__(self):
+        return self.base + len(self.held) + (0 if self.exhausted else 1)
+
+    def type_at(self, index):
+        return self.token(index).type
+
+    def value_at(self, index):
+        return self.token(index).value
+
+    def start_at(self, index):
+        return self.token(index).start
+
+    def end_at(self, index):
+        return self.token(index).end
+
+    def identifier_at(self, index):
+        return self.interns.intern(self.token(index).value)
+
+    __getitem__ = token
+
+# A TokenStream that lexes its source a chunk at a time, as a parser reads ahead. Tokens before a point
+# the parser will not return to are released with discard, so only a window of the stream is held. Indexes
+# are those of the whole stream, and the length counts one token past the window while input is left
+class TokenWindow(bella_token.TokenStream):
+    def __init__(self, lexer, chunk_size=16 * 1024):
+        super().__init__(lexer.input, lexer.token_types, lexer.interns)
+        self.lexer = lexer
+        self.chunk_size = chunk_size
+        # Index of the first token held, and of the first one not yet released
+        self.base = 0
+        self.released = 0
+        self.skip_whitespace()
+
+    # Move the lexer over whitespace, so that input is only left while another token is
+    def skip_whitespace(self):
+        self.lexer.position = self.lexer.whitespace_regex.match(self.source, self.lexer.position).end()
+        self.exhausted = self.lexer.position >= len(self.source)
+
+    # Lex until the token at index is held or the input runs out
+    def fill(self, index):
+        while index >= self.base + len(self.kinds) and not self.exhausted:
+            # Released tokens are dropped once a chunk, rather than once a statement
+            dropped = self.released - self.base
+            if dropped:
+                del self.kinds[:dropped]
+                del self.starts[:dropped]
+                del self.ends[:dropped]
+                self.identifiers = {i: number for i, number in self.identifiers.items() if i >= self.released}
+                self.base = self.released
+
+            first = self.base + len(self.kinds)
+            chunk = self.lexer.tokenize_compact(min(self.lexer.position + self.chunk_size, len(self.source)))
+            self.kinds.extend(chunk.kinds)
+            self.starts.extend(chunk.starts)
+            self.ends.extend(chunk.ends)
+            for i, number in chunk.identifiers.items():
+                self.identifiers[first + i] = number
+            self.skip_whitespace()
+
+    # Release the tokens before index
+    def discard(self, index):
+        self.released = max(self.released, index)
+
+    def __len__(self):
+        return self.base + len(self.kinds) + (0 if self.exhausted else 1)
+
+    def append(self, kind, start, end):
+        raise Exception("A TokenWindow is only filled by its lexer")
+
+    # The accessors only lex more once the held tokens run out
+    def type_at(self, index):
+        try:
+            return self.types[self.kinds[index - self.base]]
+        except IndexError:
+            self.fill(index)
+            return self.types[self.kinds[index - self.base]]
+
+    def value_at(self, index):
+        if index - self.base >= len(self.kinds):
+            self.fill(index)
+        index -= self.base
+        value = self.source[self.starts[index]:self.ends[index]]
+        if self.kinds[index] == self.float_kind:
+            return float(value)
+        return value
+
+    def start_at(self, index):
+        try:
+            return self.starts[index - self.base]
+        except IndexError:
+            self.fill(index)
+            return self.starts[index - self.base]
+
+    def end_at(self, index):
+        try:
+            return self.ends[index - self.base]
+        except IndexError:
+            self.fill(index)
+            return self.ends[index - self.base]
+
+    # Every ID token is interned as it is lexed
+    def identifier_at(self, index):
+        return self.identifiers[index]
+
+    def __getitem__(self, index):
+        return bella_token.Token(self.type_at(index), self.value_at(index), self.start_at(index), self.end_at(index))
+
+    def __iter__(self):
+        index = self.base
+        while index < len(self):
+            yield self[index]
+            index += 1
@@ -1,114 +1,229 @@
-class MemoryVerifier:
+import time
+
+import bella_stats
+from bella_node import Visitor, walk
+
+# Marks a name that had no binding before a scope shadowed it
+UNBOUND = object()
+
+# May-analysis state at one program point. Bit n of each integer stands for allocation site n, the n-th
+# alloc() declaration seen in the program
+class AllocationState:
+    __slots__ = ("live", "freed")
+
+    def __init__(self, live=0, freed=0):
+        # Sites that may still be allocated
+        self.live = live
+        # Sites that may already have been freed
+        self.freed = freed
+
+    def copy(self):
+        return AllocationState(self.live, self.freed)
+
+    # Join the state at the end of another path into this one
+    def merge(self, other):
+        self.live |= other.live
+        self.freed |= other.freed
+
+# A lexical scope: the bindings it shadows, so they can be restored on exit, and the sites allocated in it
+class Scope:
+    __slots__ = ("shadowed", "sites")
+
+    def __init__(self):
+        self.shadowed = {}
+        self.sites = 0
+
+# Walks the program with Visitor, so deeply nested blocks do not recurse
+class MemoryVerifier(Visitor):
+    def __init__(self):
+        self.state = AllocationState()
+        # Interned identifier -> allocation site it points to, or None for a declaration that is not a pointer.
+        # Names are only used for messages
+        self.bindings = {}
+        self.scopes = []
+        self.site_names = []
+        # Sites read or freed since the innermost enclosing loop started
+        self.touched = 0
+        # (entry state, touched before the loop) of each loop being verified
+        self.loops = []
+        self.branches = []
+
+    # Check that every allocation is freed exactly once before its scope ends and that no freed
+    # allocation is referenced, in a single pass over the program
     @staticmethod
-    def verify_allocation(ast, allocation_table = None):
-        if allocation_table == None:
-            allocation_table = AllocationTable()
-        for child in ast.children:
-            try:
-                if child.children[1].value == "alloc":
-                    id = child.children[0].value
-                    # Attempt to allocate the variable, fail if it already is allocated in the current scope
-                    allocation_table.allocate(id)
-                    # Continue to the next child node (statement or portion of expression)
-                    continue
-            except:
-                pass
-            if child.value == "free":
-                id = child.children[0].value
-                # Attempt to free the variable in the closest scope possible, fail if it is not allocated
-                allocation_table.free(id)
-                # Continue to the next child node (statement or portion of expression)
-                continue
-            if child.type == "Branch" or child.type == "While":
-                # Use DFS to confirm that the condition expression does not contain a null reference
-                condition = child.children[1]
-                MemoryVerifier.check_expression_for_null_reference(condition, allocation_table)
-
-                # Recursively check for memory errors in the block
-                MemoryVerifier.verify_allocation(child.children[1], AllocationTable(allocation_table))
-            if child.value == "Declaration":
-                # Use DFS to confirm that the expression being assigned does not contain a null reference
-                exp = child.children[1]
-                # If the expression is a ternary operator, check each expression separately
-                if exp.value == "?":
-                    MemoryVerifier.check_expression_for_null_reference(exp.children[0], allocation_table)
-                    MemoryVerifier.check_expression_for_null_reference(exp.children[1], allocation_table)
-                    MemoryVerifier.check_expression_for_null_reference(exp.children[2], allocation_table)
-                else:
-                    MemoryVerifier.check_expression_for_null_reference(exp, allocation_table)
-            if child.type == "print":
-                exp = child.children[0]
-                MemoryVerifier.check_expression_for_null_reference(exp, allocation_table)
-
-        if not allocation_table.isEmpty():
-            raise Exception("Memory leak: not all allocated variables are freed")
-
-        return
-
+    def verify_allocation(ast):
+        stats = bella_stats.collector
+        if stats is not None:
+            started = time.perf_counter()
+        verifier = MemoryVerifier()
+        verifier.visit(ast)
+        if stats is not None:
+            stats.time("verify", time.perf_counter() - started)
+            stats.count("allocation_sites", len(verifier.site_names))
+
+    # Verify a program given as its top-level statements, as Parser.iter_statements yields them. Each
+    # statement is verified as it arrives and then dropped, so only the bindings and allocation sites of
+    # the program's scope outlive it
     @staticmethod
-    def check_expression_for_null_reference(exp, allocation_table):
-        nodes = []
-        nodes.append(exp)
-        while len(nodes) != 0:
-            node = nodes.pop()
-
-            # If the node is an identifier, check if it is a null reference
-            if node.type == "Id":
-                if allocation_table.isNull(node.value):
-                    raise Exception(f"Null pointer reference: Identifier \"{node.value}\" has already been freed")
-            for child in node.children:
-                nodes.append(child)
-
-
-class AllocationTable:
-    def __init__(self, parent = None):
-        self.table = {}
-        self.parent = parent
-
-    def allocate(self, identifier):
-        if identifier in self.table and self.table[identifier] != None:
-            raise Exception(f"Variable \"{identifier}\" already allocated in current scope")
-
-        self.table[identifier] = True
-
-    def isAllocated(self, identifier):
-        if identifier in self.table and self.table[identifier] != None:
-            return True
-        cur_table = self.parent
-        while cur_table != None:
-            if identifier in cur_table.table and cur_table.table[identifier] == True:
-                return True
-            cur_table = cur_table.parent
-
+    def verify_statements(statements):
+        stats = bella_stats.collector
+        seconds = 0.0
+        verifier = MemoryVerifier()
+        for statement in statements:
+            if stats is not None:
+                started = time.perf_counter()
+            verifier.feed(statement)
+            if stats is not None:
+                seconds += time.perf_counter() - started
+        verifier.finish()
+        if stats is not None:
+            stats.time("verify", seconds)
+            stats.count("allocation_sites", len(verifier.site_names))
+
+    # Verify the next top-level statement of a program
+    def feed(self, statement):
+        if not self.scopes:
+            self.enter_scope()
+        self.visit(statement)
+
+    # Verify the end of a program whose statements were all fed, reporting what is still allocated
+    def finish(self):
+        if not self.scopes:
+            self.enter_scope()
+        self.exit_scope()
+
+    def enter_Program(self, program):
+        self.enter_scope()
+
+    def leave_Program(self, program):
+        self.exit_scope()
+
+    def enter_Block(self, block):
+        self.enter_scope()
+
+    def leave_Block(self, block):
+        self.exit_scope()
+        # After the if block of a branch, verify the else block from the state the branch was entered with
+        branch = self.branches[-1] if self.branches else None
+        if branch is not None and branch[1] is block:
+            branch[2] = self.state
+            self.state = branch[0]
+
+    def enter_Assign(self, statement):
+        lhs = statement.children[0]
+        if statement.value != "Declaration":
+            # Function declaration: the body only runs when called, so just bind the name
+            self.declare(lhs.ident, None)
+            return False
+        rhs = statement.children[1]
+        if rhs.type == "Id" and rhs.value == "alloc":
+            self.allocate(lhs)
+            return False
+        self.check_expression_for_null_reference(rhs)
+        # Declaring one pointer as another aliases the same allocation
+        self.declare(lhs.ident, self.bindings.get(rhs.ident) if rhs.type == "Id" and not rhs.children else None)
         return False
 
-    # If identifier was freed and there is not a separate object with the same name allocated in a parent scope, return True to indicate a reference to that identifier is a null pointer reference
-    def isNull(self, identifier):
-        if identifier in self.table and self.table[identifier] == None:
-            return True
-        cur_table = self.parent
-        while cur_table != None:
-            if identifier in cur_table.table and cur_table.table[identifier] == None and not cur_table.parent.isAllocated(identifier):
-                return True
-            cur_table = cur_table.parent
+    def enter_Free(self, statement):
+        self.free(statement.children[0])
+        return False
 
+    def enter_Print(self, statement):
+        self.check_expression_for_null_reference(statement.children[0])
         return False
 
-    def free(self, identifier):
-        if not self.isAllocated(identifier):
-            raise Exception(f"Variable \"{identifier}\" never allocated")
-
-        cur_table = self
-        while cur_table != None:
-            if identifier in cur_table.table and cur_table.table[identifier] != None:
-                # Set value to None to indicate null pointer
-                cur_table.table[identifier] = None
-                return
-            cur_table = cur_table.parent
-
-    # Return True if the table does not contain any allocated variables
-    def isEmpty(self):
-        for id, status in self.table.items():
-            if status != None:
-                return False
-        return True
+    # The body runs zero or more times, so the state after the loop joins the entry state with the state
+    # after one iteration
+    def enter_While(self, statement):
+        self.check_expression_for_null_reference(statement.children[0])
+        self.loops.append((self.state.copy(), self.touched))
+        self.touched = 0
+        return statement.children[1:2]
+
+    def leave_While(self, statement):
+        entry, outer_touched = self.loops.pop()
+
+        # An outer allocation freed by the body is freed again, or read after being freed, on the next
+        # iteration
+        freed_in_body = self.state.freed & ~entry.freed
+        repeated = freed_in_body & self.touched
+        if repeated:
+            name = self.site_names[repeated.bit_length() - 1]
+            raise Exception(f"Null pointer reference: Identifier \"{name}\" is freed on every iteration of a loop")
+
+        self.touched |= outer_touched
+        self.state.merge(entry)
+
+    # Either block may run, so the state after the branch joins the states at the end of both
+    def enter_Branch(self, statement):
+        self.check_expression_for_null_reference(statement.children[0])
+        # [entry state, if block, state at the end of the if block]
+        self.branches.append([self.state.copy(), statement.children[1], None])
+        return statement.children[1:]
+
+    def leave_Branch(self, statement):
+        entry, if_block, if_state = self.branches.pop()
+        if if_state is None:
+            # No else block: the if block may be skipped
+            if_state = entry
+        self.state.merge(if_state)
+
+    def enter_scope(self):
+        self.scopes.append(Scope())
+
+    # Report allocations of this scope that may still be live, then drop its sites and bindings
+    def exit_scope(self):
+        scope = self.scopes.pop()
+        if self.state.live & scope.sites:
+            raise Exception("Memory leak: not all allocated variables are freed")
+
+        self.state.live &= ~scope.sites
+        self.state.freed &= ~scope.sites
+        for identifier, previous in scope.shadowed.items():
+            if previous is UNBOUND:
+                del self.bindings[identifier]
+            else:
+                self.bindings[identifier] = previous
+
+    def declare(self, identifier, site):
+        scope = self.scopes[-1]
+        if identifier not in scope.shadowed:
+            scope.shadowed[identifier] = self.bindings.get(identifier, UNBOUND)
+        self.bindings[identifier] = site
+
+    def allocate(self, node):
+        identifier = node.ident
+        scope = self.scopes[-1]
+        if identifier in scope.shadowed:
+            site = self.bindings[identifier]
+            if site is not None and self.state.live & (1 << site):
+                raise Exception(f"Variable \"{node.value}\" already allocated in current scope")
+
+        site = len(self.site_names)
+        self.site_names.append(node.value)
+        self.state.live |= 1 << site
+        scope.sites |= 1 << site
+        self.declare(identifier, site)
+
+    def free(self, node):
+        site = self.bindings.get(node.ident)
+        if site is None:
+            raise Exception(f"Variable \"{node.value}\" never allocated")
+
+        bit = 1 << site
+        if self.state.freed & bit:
+            raise Exception(f"Variable \"{node.value}\" already freed")
+        self.touched |= bit
+        self.state.live &= ~bit
+        self.state.freed |= bit
+
+    # Confirm that the expression does not reference an allocation that may already be freed
+    def check_expression_for_null_reference(self, exp):
+        for node, _ in walk(exp):
+            if node.type == "Id":
+                site = self.bindings.get(node.ident)
+                if site is not None:
+                    bit = 1 << site
+                    if self.state.freed & bit:
+                        raise Exception(f"Null pointer reference: Identifier \"{node.value}\" has already been freed")
+                    self.touched |= bit
@@ -1,13 +1,195 @@
 #!/usr/bin/env python3
 
+import io
+
+from bella_source import locate
+
 class Node:
+    # Type inferred by TypeChecker.annotate, or None if the node has not been annotated
+    inferred_type = None
+    # (scope depth, slot index) an Id was resolved to by SymbolTable.resolve, or None
+    binding = None
+    # Number an Id's name is interned as, unique among the identifiers of one compilation
+    ident = None
+    # Offsets of the source the node was parsed from, or None for nodes made by other passes
+    start = None
+    end = None
+    # Number of pairs of parentheses the parser read the expression between, each of which checks its type
+    parentheses = 0
+
     def __init__(self, type, value=None, children=None):
         self.type = type
         self.value = value
         self.children = children if children is not None else []
 
     def __str__(self, level=0):
-        ret = "|\t" * level + f'{self.type}: {self.value}\n'
-        for child in self.children:
-            ret += child.__str__(level + 1)
-        return ret
+        output = io.StringIO()
+        write_tree(self, output, level)
+        return output.getvalue()
+
+# Literal node types, which a NodeTable shares by type and value
+SHAREABLE_LEAVES = {"Int", "Float", "Keyword"}
+
+# Hash-consing table that hands out one node for every structurally identical closed subtree: a literal, or
+# an operator whose operands are all shared. Ids are never shared, since each occurrence is bound in its own
+# scope, and so nothing containing one is either. A shared node keeps the span of its first occurrence, and
+# results cached on it, such as its inferred type, hold at every occurrence
+class NodeTable:
+    def __init__(self):
+        # Key -> shared node. Literals are keyed by (type, value) and operators by (operator, identities of
+        # the operands)
+        self.nodes = {}
+        # id() of every shared node, which stay alive in nodes, so their ids are not reused
+        self.shared = set()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    # Return the shared node equal to node, which is node itself the first time it is seen. Nodes that are
+    # not closed are returned as they are
+    def share(self, node):
+        children = node.children
+        if children:
+            if node.type != "Operator":
+                return node
+            shared = self.shared
+            for child in children:
+                if id(child) not in shared:
+                    return node
+            key = (node.value, *map(id, children))
+        elif node.type in SHAREABLE_LEAVES:
+            value = node.value
+            # -0.0 equals 0.0, so floats are keyed by their exact representation
+            key = (node.type, value.hex() if type(value) is float else value)
+        else:
+            return node
+        existing = self.nodes.get(key)
+        if existing is not None:
+            return existing
+        self.nodes[key] = node
+        self.shared.add(id(node))
+        return node
+
+# Yield (node, depth) for every node of a tree in pre-order, using an explicit stack so deep trees do not
+# hit the recursion limit. None children, which comments leave in blocks, are skipped
+def walk(root, depth=0):
+    stack = [(root, depth)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        children = node.children
+        for index in range(len(children) - 1, -1, -1):
+            if children[index] is not None:
+                stack.append((children[index], depth + 1))
+
+# Yield every node of a tree after all of its children. children(node) chooses the children to descend
+# into and defaults to all of them
+def post_order(root, children=None):
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+            continue
+        stack.append((node, True))
+        selected = node.children if children is None else children(node)
+        for index in range(len(selected) - 1, -1, -1):
+            if selected[index] is not None:
+                stack.append((selected[index], False))
+
+# Write the indented listing of a tree to a file object one line at a time, in time linear in its size
+def write_tree(root, output, level=0):
+    output.writelines("|\t" * depth + f"{node.type}: {node.value}\n" for node, depth in walk(root, level))
+
+# Walks a tree with an explicit stack, calling enter_<Type>(node) before a node's children and
+# leave_<Type>(node) after them, for the types the subclass defines methods for. An enter method may return
+# False to skip the node's children, or a list of the children to visit instead of all of them. An error
+# raised by a method gets the span of the node it was called for, unless it already has one
+class Visitor:
+    def visit(self, root):
+        enter_methods = {}
+        leave_methods = {}
+        stack = [(root, False)]
+        try:
+            while stack:
+                node, entered = stack.pop()
+                type = node.type
+                if entered:
+                    leave = leave_methods.get(type)
+                    if leave is None:
+                        leave = leave_methods[type] = getattr(self, "leave_" + type, False)
+                    if leave:
+                        leave(node)
+                    continue
+
+                enter = enter_methods.get(type)
+                if enter is None:
+                    enter = enter_methods[type] = getattr(self, "enter_" + type, False)
+                children = enter(node) if enter else None
+                stack.append((node, True))
+                if children is False:
+                    continue
+                if children is None:
+                    children = node.children
+                for index in range(len(children) - 1, -1, -1):
+                    if children[index] is not None:
+                        stack.append((children[index], False))
+        except Exception as error:
+            raise locate(error, node.start, node.end)
+
+# Node kinds interned as small integers; CompactNode stores the code instead of the type string
+NODE_KINDS = ["Program", "Block", "Assign", "Id", "Parameters", "While", "Branch", "Print", "Free", "Operator", "Int", "Float", "Keyword"]
+NODE_KIND_CODES = {kind: code for code, kind in enumerate(NODE_KINDS)}
+
+def kind_code(type):
+    code = NODE_KIND_CODES.get(type)
+    if code is None:
+        code = len(NODE_KINDS)
+        NODE_KINDS.append(type)
+        NODE_KIND_CODES[type] = code
+    return code
+
+# Immutable, memory-light AST node: an integer kind tag, a value and a tuple of children.
+# Exposes the same type/value/children view as Node so the verifier and type checker can walk either
+class CompactNode:
+    __slots__ = ("kind", "value", "children", "inferred_type", "binding", "ident", "start", "end")
+
+    def __init__(self, type, value=None, children=(), inferred_type=None, binding=None, ident=None, start=None,
+                 end=None):
+        self.kind = kind_code(type)
+        self.value = value
+        self.children = tuple(children)
+        self.inferred_type = inferred_type
+        self.binding = binding
+        self.ident = ident
+        self.start = start
+        self.end = end
+
+    @property
+    def type(self):
+        return NODE_KINDS[self.kind]
+
+    __str__ = Node.__str__
+
+# Convert a Node tree into CompactNodes. Leaves share the empty tuple and the walk uses an explicit
+# stack, so deep trees do not hit the recursion limit. None children, which comments leave in blocks, are
+# kept as None
+def compact(root):
+    # Each entry is (node, converted children so far); a node is built once all of its children are
+    stack = [(root, [])]
+    while True:
+        node, converted = stack[-1]
+        if len(converted) < len(node.children):
+            child = node.children[len(converted)]
+            if child is None:
+                converted.append(None)
+            else:
+                stack.append((child, []))
+            continue
+
+        stack.pop()
+        compact_node = CompactNode(node.type, node.value, converted, node.inferred_type, node.binding, node.ident,
+                                   node.start, node.end)
+        if not stack:
+            return compact_node
+        stack[-1][1].append(compact_node)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import bella_stats
+from bella_node import Node
+from bella_vm import OPERATIONS
+
+# Marks a statement the optimizer removed from its block
+REMOVED = object()
+
+LITERAL_TYPES = {"Int": "INTEGER", "Float": "FLOAT", "Keyword": "BOOLEAN"}
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node is not None:
+            count += 1
+            stack.extend(node.children)
+    return count
+
+def literal_value(node):
+    if node.type == "Int":
+        return int(node.value)
+    if node.type == "Float":
+        return float(node.value)
+    return node.value == "true"
+
+# Build the literal node for a folded value. INT literals keep their value as a string, as the lexer makes them
+def literal_node(value):
+    if value is True or value is False:
+        node = Node("Keyword", "true" if value else "false", [])
+    elif isinstance(value, int):
+        node = Node("Int", str(value), [])
+    else:
+        node = Node("Float", value, [])
+    node.inferred_type = LITERAL_TYPES[node.type]
+    return node
+
+# Folds operators whose operands are literals, short-circuits && and || on a literal left operand, picks the
+# branch of a ternary with a literal condition, and removes Branch and While statements whose condition
+# makes a block dead. Operations that would fail at run time, such as a division by zero, are left for the
+# run to report. Works in place on a Node tree from Parser.parse, since CompactNode children are immutable.
+# Dead blocks are removed before MemoryVerifier sees them, so they are no longer verified: a use after free
+# or double free that only happens in a dead block is not reported once the tree is optimized. Subtrees
+# shared by Parser with share are folded once, and every occurrence is replaced by the same result, so only
+# the first counts the nodes removed
+class Optimizer:
+    def __init__(self):
+        self.removed = 0
+        # id() of each node that was replaced -> (node, replacement). The node is held so its id is not reused
+        self.replaced = {}
+
+    # Optimize a tree in place, returning the number of nodes removed from it
+    @staticmethod
+    def optimize(ast):
+        optimizer = Optimizer()
+        # Post-order walk with an explicit stack: each node's children are folded once all of their own
+        # children are final
+        stack = [(ast, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children if child is not None)
+                continue
+            optimizer.fold_children(node)
+
+        stats = bella_stats.collector
+        if stats is not None:
+            stats.count("nodes_removed", optimizer.removed)
+        return optimizer.removed
+
+    # Optimize top-level statements as Parser.iter_statements yields them, yielding what is left of each.
+    # Each statement is optimized in a Program of its own, so a dead one is dropped as it would be from the
+    # whole program
+    @staticmethod
+    def optimize_statements(statements):
+        for statement in statements:
+            program = Node("Program", "program", [statement])
+            Optimizer.optimize(program)
+            yield from program.children
+
+    def fold_children(self, node):
+        children = node.children
+        for index, child in enumerate(children):
+            if child is None:
+                continue
+            replaced = self.replaced.get(id(child))
+            if replaced is not None:
+                # A shared subtree already folded under another parent
+                children[index] = replaced[1]
+                continue
+            folded = self.fold(child)
+            if folded is not child:
+                self.removed += count_nodes(child) - (0 if folded is REMOVED else count_nodes(folded))
+                # A new literal stands in for the source of the expression it was folded from
+                if folded is not REMOVED and folded.start is None:
+                    folded.start = child.start
+                    folded.end = child.end
+                self.replaced[id(child)] = (child, folded)
+                children[index] = folded
+        if REMOVED in children:
+            node.children = [child for child in children if child is not REMOVED]
+
+    # Return the node to replace node with, which is node itself if nothing changes
+    def fold(self, node):
+        match (node.type):
+            case "Operator":
+                return self.fold_operator(node)
+            case "Branch":
+                condition = node.children[0]
+                if condition.type != "Keyword":
+                    return node
+                # Keep the live block in a Branch with a true condition, which gives it its scope
+                if condition.value == "true":
+                    return Node("Branch", node.value, node.children[:2]) if len(node.children) > 2 else node
+                if len(node.children) < 3:
+                    return REMOVED
+                return Node("Branch", node.value, [literal_node(True), node.children[2]])
+            case "While":
+                condition = node.children[0]
+                if condition.type == "Keyword" and condition.value == "false":
+                    return REMOVED
+                return node
+        return node
+
+    def fold_operator(self, node):
+        children = node.children
+        first = children[0]
+        if node.value == "?":
+            if first.type == "Keyword":
+                return children[1] if first.value == "true" else children[2]
+            return node
+
+        if len(children) == 1:
+            if first.type not in LITERAL_TYPES:
+                return node
+            value = literal_value(first)
+            return literal_node(-value if node.value == "-" else not value)
+
+        second = children[1]
+        if node.value == "&&" or node.value == "||":
+            # The right operand only runs when the left one does not decide the result
+            if first.type != "Keyword":
+                return node
+            decides = (first.value == "false") if node.value == "&&" else (first.value == "true")
+            return first if decides else second
+
+        if first.type not in LITERAL_TYPES or second.type not in LITERAL_TYPES:
+            return node
+        left = literal_value(first)
+        right = literal_value(second)
+        # Integer powers with a negative exponent give floats, and large ones are left to the run
+        if node.value == "**" and type(right) is int and not 0 <= right <= 64:
+            return node
+        try:
+            value = OPERATIONS[node.value](left, right)
+        except (ZeroDivisionError, OverflowError):
+            return node
+        # A fractional power of a negative number is complex, which no literal can hold
+        if type(value) not in (int, float, bool):
+            return node
+        return literal_node(value)
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from bella_lexer import Lexer
+from bella_memory_verifier import MemoryVerifier
+from bella_node import Node, Visitor
+from bella_parser import Parser
+from bella_semantic_analyzer import SemanticAnalyzer
+from bella_symbol_table import SymbolTable
+
+# Blocks with fewer tokens than this are checked where they are, as shipping them costs more than checking
+MIN_BLOCK_TOKENS = 2000
+# Deferred blocks are sent to workers in batches of about this many per worker, to balance their load
+BATCHES_PER_WORKER = 4
+
+# A While or Branch block that the skeleton leaves out, to be checked in a worker. Holds what the worker
+# needs: the span of its source, and the type and allocation class of each outer identifier it uses
+class DeferredBlock:
+    __slots__ = ("start", "end", "tokens", "identifiers", "types", "classes", "representatives", "summary")
+
+    def __init__(self, start, end, tokens, identifiers):
+        self.start = start
+        self.end = end
+        self.tokens = tokens
+        # Interned identifiers used in the block, in ascending order
+        self.identifiers = identifiers
+        # Identifier -> type of the declaration it resolves to at the block, for the visible ones
+        self.types = {}
+        # Identifier -> index of the allocation it points to at the block, for pointers. Pointers that alias
+        # the same allocation share an index, and representatives[index] is one of them
+        self.classes = {}
+        self.representatives = []
+        # (accessed, freed on every path, freed on some path) masks over the classes, from the worker
+        self.summary = None
+
+    # Picklable description of the work, with identifiers as names since the worker interns its own
+    def task(self, names):
+        return (self.start, self.end, [(names[identifier], self.types[identifier], self.classes.get(identifier))
+                                       for identifier in self.identifiers if identifier in self.types])
+
+# Parses the program but skips over the tokens of large blocks, leaving empty Block nodes in their place.
+# A block is deferred if it has between min_tokens and max_tokens tokens; larger ones are parsed here, so
+# their own blocks can be deferred instead
+class SkeletonParser(Parser):
+    def __init__(self, tokens, min_tokens, max_tokens):
+        super().__init__(tokens, semantic=False)
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        # id() of each deferred Block node -> DeferredBlock, in source order
+        self.deferred = {}
+        self.closing = self.match_braces()
+
+    # Token index of each "{" -> token index of the "}" that closes it
+    def match_braces(self):
+        tokens = self.tokens
+        brace = bytes([tokens.types.index("CURLY_BRACE")])
+        kinds = tokens.kinds.tobytes()
+        source = tokens.source
+        closing = {}
+        opened = []
+        index = kinds.find(brace)
+        while index >= 0:
+            if source[tokens.starts[index]] == "{":
+                opened.append(index)
+            elif opened:
+                closing[opened.pop()] = index
+            index = kinds.find(brace, index + 1)
+        return closing
+
+    def parse_block(self):
+        first = self.position
+        last = self.closing.get(first)
+        if last is None or not self.min_tokens <= last + 1 - first <= self.max_tokens:
+            return super().parse_block()
+
+        tokens = self.tokens
+        identifiers = tokens.identifiers
+        used = sorted({identifiers[index] for index in range(first, last) if index in identifiers})
+        block = Node("Block", "block", [])
+        self.position = last + 1
+        self.span(block, first)
+        self.deferred[id(block)] = DeferredBlock(block.start, block.end, last + 1 - first, used)
+        return block
+
+# Scope and type pass over the skeleton that records, at each deferred block, the types of the outer
+# identifiers the block uses
+class SkeletonAnalyzer(SemanticAnalyzer):
+    def __init__(self, deferred, interns):
+        super().__init__(interns=interns)
+        self.deferred = deferred
+
+    def enter_Block(self, block):
+        deferred = self.deferred.get(id(block))
+        if deferred is not None:
+            symbol_table = self.cur_symbol_table
+            for identifier in deferred.identifiers:
+                binding = symbol_table.resolve(identifier)
+                if binding is not None:
+                    deferred.types[identifier] = symbol_table.symbol_at(binding).type
+        super().enter_Block(block)
+
+# Follows the declarations of the skeleton as MemoryVerifier binds them, without its dataflow, to find which
+# allocation each pointer a deferred block uses points to. Bindings do not depend on the dataflow, so this
+# can run before any block is verified
+class BindingPlanner(Visitor):
+    def __init__(self, deferred):
+        self.deferred = deferred
+        # Identifier -> allocation site, or None for a declaration that is not a pointer
+        self.bindings = {}
+        # The bindings each open scope shadowed
+        self.scopes = []
+        self.sites = 0
+
+    def enter_Program(self, program):
+        self.scopes.append({})
+
+    def leave_Program(self, program):
+        self.leave_scope()
+
+    def enter_Block(self, block):
+        deferred = self.deferred.get(id(block))
+        if deferred is not None:
+            classes = {}
+            for identifier in deferred.identifiers:
+                site = self.bindings.get(identifier)
+                if site is None:
+                    continue
+                if site not in classes:
+                    classes[site] = len(deferred.representatives)
+                    deferred.representatives.append(identifier)
+                deferred.classes[identifier] = classes[site]
+        self.scopes.append({})
+
+    def leave_Block(self, block):
+        self.leave_scope()
+
+    def leave_scope(self):
+        for identifier, previous in self.scopes.pop().items():
+            if previous is None:
+                self.bindings.pop(identifier, None)
+            else:
+                self.bindings[identifier] = previous[0]
+
+    def declare(self, identifier, site):
+        scope = self.scopes[-1]
+        if identifier not in scope:
+            scope[identifier] = (self.bindings[identifier],) if identifier in self.bindings else None
+        self.bindings[identifier] = site
+
+    def enter_Assign(self, statement):
+        lhs = statement.children[0]
+        rhs = statement.children[1] if statement.value == "Declaration" else None
+        if rhs is None:
+            site = None
+        elif rhs.type == "Id" and rhs.value == "alloc":
+            site = self.sites
+            self.sites += 1
+        elif rhs.type == "Id" and not rhs.children:
+            site = self.bindings.get(rhs.ident)
+        else:
+            site = None
+        self.declare(lhs.ident, site)
+        return False
+
+    def enter_While(self, statement):
+        return statement.children[1:]
+
+    def enter_Branch(self, statement):
+        return statement.children[1:]
+
+    def enter_Print(self, statement):
+        return False
+
+    def enter_Free(self, statement):
+        return False
+
+# MemoryVerifier over the skeleton that applies the summary of each deferred block in its place. A block
+# that accesses an allocation that may already be freed when it is entered fails here, since the worker
+# verified it as if none were
+class SkeletonVerifier(MemoryVerifier):
+    def __init__(self, deferred):
+        super().__init__()
+        self.deferred = deferred
+
+    def enter_Block(self, block):
+        super().enter_Block(block)
+        deferred = self.deferred.get(id(block))
+        if deferred is None:
+            return None
+
+        accessed, freed_on_every_path, freed_on_some_path = (
+            self.sites_of(deferred, mask) for mask in deferred.summary)
+        if self.state.freed & accessed:
+            raise Exception("Deferred block accesses an allocation that may already be freed")
+        self.state.live &= ~freed_on_every_path
+        self.state.freed |= freed_on_some_path
+        self.touched |= accessed
+        return False
+
+    # Bits of the allocation sites a mask over a block's classes stands for here
+    def sites_of(self, deferred, mask):
+        sites = 0
+        for index, identifier in enumerate(deferred.representatives):
+            if mask >> index & 1:
+                sites |= 1 << self.bindings[identifier]
+        return sites
+
+# Source of the program being checked, set once in each worker
+worker_source = None
+
+def set_worker_source(source):
+    global worker_source
+    worker_source = source
+
+# Check deferred blocks in a worker. Each block is parsed from its span of the source, analyzed in a scope
+# holding the outer identifiers it uses, and verified with each outer allocation live and not freed.
+# Returns the (accessed, freed on every path, freed on some path) class masks of every block, or None if
+# any block fails, in which case the whole program is checked again to report the error
+def summarize_blocks(tasks, source=None):
+    source = source if source is not None else worker_source
+    summaries = []
+    for start, end, outer in tasks:
+        try:
+            lexer = Lexer(source)
+            lexer.position = start
+            tokens = lexer.tokenize_compact(end)
+            parser = Parser(tokens, semantic=False)
+            block = parser.parse_block()
+            if parser.position != len(tokens):
+                return None
+            interns = tokens.interns
+
+            root = SymbolTable(interns=interns)
+            root.add(interns.intern("alloc"), "INTEGER")
+            root.add(interns.intern("free"), "VOID")
+            symbol_table = SymbolTable(root)
+            for name, type, _ in outer:
+                symbol_table.add(interns.intern(name), type)
+            SemanticAnalyzer(symbol_table, interns).visit(block)
+
+            verifier = MemoryVerifier()
+            verifier.enter_scope()
+            classes = 0
+            for name, _, index in outer:
+                if index is not None:
+                    verifier.bindings[interns.intern(name)] = index
+                    classes = max(classes, index + 1)
+            verifier.site_names = [None] * classes
+            every_class = (1 << classes) - 1
+            verifier.state.live = every_class
+            verifier.visit(block)
+        except Exception:
+            return None
+        summaries.append((verifier.touched & every_class, every_class & ~verifier.state.live,
+                          verifier.state.freed & every_class))
+    return summaries
+
+# Split tasks into contiguous batches of roughly batch_tokens tokens each
+def batches(deferred, tasks, batch_tokens):
+    batch = []
+    size = 0
+    for block, task in zip(deferred, tasks):
+        batch.append(task)
+        size += block.tokens
+        if size >= batch_tokens:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+# Check a whole program with its large blocks checked in parallel. The skeleton of the program is parsed,
+# analyzed and verified here, and each deferred block is checked in a worker against the state it is
+# entered with, summarized by the outer allocations it accesses and frees. The summaries are applied in
+# source order, so the outcome does not depend on which worker finishes first. If anything fails, the
+# program is checked again in one pass, so errors are the ones, and in the order, that a sequential check
+# reports. With one worker, the blocks are checked in this process
+def check_source(source, workers=None, min_block_tokens=MIN_BLOCK_TOKENS):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    try:
+        if check_skeleton(source, workers, min_block_tokens):
+            return
+    except Exception:
+        pass
+    # Check sequentially, which raises the error the program reports
+    tokens = Lexer(source).tokenize_compact()
+    MemoryVerifier.verify_allocation(Parser(tokens).parse())
+
+# Returns False if a deferred block fails
+def check_skeleton(source, workers, min_block_tokens):
+    tokens = Lexer(source).tokenize_compact()
+    max_tokens = max(min_block_tokens, len(tokens) // (workers * BATCHES_PER_WORKER))
+    parser = SkeletonParser(tokens, min_block_tokens, max_tokens)
+    ast = parser.parse()
+    deferred = parser.deferred
+    SkeletonAnalyzer(deferred, tokens.interns).visit(ast)
+    BindingPlanner(deferred).visit(ast)
+
+    blocks = list(deferred.values())
+    names = tokens.interns.names
+    tasks = [block.task(names) for block in blocks]
+    if workers == 1 or len(blocks) < 2:
+        results = [summarize_blocks(tasks, source)]
+    else:
+        batch_tokens = sum(block.tokens for block in blocks) // (workers * BATCHES_PER_WORKER) + 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_worker_source,
+                                 initargs=(source,)) as executor:
+            results = list(executor.map(summarize_blocks, batches(blocks, tasks, batch_tokens)))
+
+    summaries = []
+    for result in results:
+        if result is None:
+            return False
+        summaries.extend(result)
+    for block, summary in zip(blocks, summaries):
+        block.summary = summary
+    SkeletonVerifier(deferred).visit(ast)
+    return True
@@ -1,103 +1,184 @@
 #!/usr/bin/env python3
 
-from bella_token import Token
-from bella_node import Node
-from bella_type_checker import TypeChecker
-from bella_symbol_table import SymbolTable
-
+import time
+
+import bella_stats
+from bella_token import TokenList
+from bella_node import Node, NodeTable
+from bella_semantic_analyzer import SemanticAnalyzer
+from bella_source import SourceError
+
+# Builds the AST from tokens. With semantic, parse also runs SemanticAnalyzer over the tree, binding
+# identifiers and checking types. Without it, only the syntax is checked, so undeclared identifiers and
+# type errors are not reported. Every node records the start and end offsets of the source it was parsed
+# from, and syntax errors are SourceErrors at the offending token. With share, identical literals and
+# constant subexpressions are hash-consed into one node through a NodeTable, so the tree is a DAG
 class Parser:
-    def __init__(self, tokens):
+    # Binary operator token types and their precedence, from loosest to tightest binding
+    binary_precedence = {
+        "OPERATOR1": 1,
+        "OPERATOR2": 2,
+        "OPERATOR3": 3,
+        "OPERATOR4": 4,
+        "OPERATOR5": 5,
+        "OPERATOR6": 6,
+    }
+
+    # Tokens are a TokenStream, a cursor with its API such as a TokenWindow or StreamCursor, or a list of
+    # Token objects
+    def __init__(self, tokens, semantic=True, share=False):
+        if isinstance(tokens, (list, tuple)):
+            tokens = TokenList(tokens)
         self.tokens = tokens
         self.position = 0
-        self.root_symbol_table = SymbolTable()
-        self.root_symbol_table.add("alloc", "INTEGER")
-        self.root_symbol_table.add("free", "VOID")
-        self.cur_symbol_table = self.root_symbol_table
+        self.semantic = semantic
+        self.node_table = NodeTable() if share else None
 
-    # Read the current token and ensure it is of the expected type, moving the position to the next token
+    # Read the current token and ensure it is of the expected type, moving the position to the next token.
+    # Returns the token's value
     def consume(self, expected_type = None):
-        token = self.tokens[self.position]
-        if (token.type != expected_type):
-            raise Exception(f"Syntax error")
+        if self.position >= len(self.tokens):
+            raise self.syntax_error("Syntax error: unexpected end of input")
+        if (self.tokens.type_at(self.position) != expected_type):
+            raise self.syntax_error()
         self.position += 1
-        return Token(token.type, token.value)
+        return self.tokens.value_at(self.position - 1)
+
+    # A syntax error at the current token, or at the end of the last token once the input has run out
+    def syntax_error(self, message="Syntax error"):
+        if self.position < len(self.tokens):
+            return SourceError(message, self.tokens.start_at(self.position), self.tokens.end_at(self.position))
+        end = self.tokens.end_at(len(self.tokens) - 1) if len(self.tokens) else 0
+        return SourceError(message, end, end)
+
+    # Set a node's span to run from the start of token first to the end of the last consumed token
+    def span(self, node, first):
+        node.start = self.tokens.start_at(first)
+        node.end = self.tokens.end_at(self.position - 1)
+        return node
 
 
     # Return the current token without consuming it
     def peek(self):
         if self.position >= len(self.tokens):
-            raise Exception("Syntax error: unexpected end of input")
+            raise self.syntax_error("Syntax error: unexpected end of input")
         return self.tokens[self.position]
 
+    # Return the type of the current token without consuming it
+    def peek_type(self):
+        try:
+            return self.tokens.type_at(self.position)
+        except IndexError:
+            raise self.syntax_error("Syntax error: unexpected end of input")
+
+    # Return the value of the current token without consuming it
+    def peek_value(self):
+        try:
+            return self.tokens.value_at(self.position)
+        except IndexError:
+            raise self.syntax_error("Syntax error: unexpected end of input")
+
     # To construct the root of the Abstract Syntax Tree (AST) and iteratively parse each statement in the token list
     def parse(self):
+        stats = bella_stats.collector
+        if stats is not None:
+            started = time.perf_counter()
         ast = Node("Program", "program", [])
+        # Tokens of parsed statements are released as in iter_statements, so the first token's offset is
+        # read before it can be
+        discard = getattr(self.tokens, "discard", None)
+        start = self.tokens.start_at(0) if len(self.tokens) else None
 
         while (self.position != len(self.tokens)):
             statement = self.parse_statement()
             if statement != None:
                 ast.children.append(statement)
-
+            if discard is not None:
+                discard(self.position)
+        if start is not None:
+            ast.start = start
+            ast.end = self.tokens.end_at(self.position - 1)
+
+        if stats is not None:
+            stats.time("parse", time.perf_counter() - started)
+            stats.count_nodes(ast)
+        if self.semantic:
+            SemanticAnalyzer.analyze(ast, interns=self.tokens.interns)
         return ast
 
+    # Yield each top-level statement as soon as it is parsed, instead of building the Program node. With
+    # semantic, every statement is analyzed in the program's scope before it is yielded, so an error is
+    # raised once the statement it is in has been read. Tokens of the statements already yielded are
+    # released when tokens can discard them, as a TokenWindow does
+    def iter_statements(self):
+        analyzer = SemanticAnalyzer(interns=self.tokens.interns) if self.semantic else None
+        discard = getattr(self.tokens, "discard", None)
+        while (self.position != len(self.tokens)):
+            statement = self.parse_statement()
+            if discard is not None:
+                discard(self.position)
+            if statement is None:
+                continue
+            if analyzer is not None:
+                analyzer.analyze_statement(statement)
+            yield statement
+
     # To parse a block of statements enclosed by curly braces
     def parse_block(self):
+        first = self.position
         self.consume("CURLY_BRACE")
         block = Node("Block", "block", [])
-        block_symbol_table = SymbolTable(self.cur_symbol_table)
-        self.cur_symbol_table = block_symbol_table
 
-        while (self.position != len(self.tokens) and self.peek().type != "CURLY_BRACE"):
+        while (self.position != len(self.tokens) and self.peek_type() != "CURLY_BRACE"):
             block.children.append(self.parse_statement())
 
         self.consume("CURLY_BRACE")
-        self.cur_symbol_table = self.cur_symbol_table.parent
 
-        return block
+        return self.span(block, first)
 
-    # To determine the type of the current statement and delegate to the corresponding parse function
+    # Parse a statement, setting its span to cover all of its tokens
     def parse_statement(self):
-        token = self.peek()
+        first = self.position
+        statement = self.parse_statement_kind()
+        if statement is not None:
+            self.span(statement, first)
+        return statement
+
+    # To determine the type of the current statement and delegate to the corresponding parse function
+    def parse_statement_kind(self):
+        token_type = self.peek_type()
 
         # Consume comments and do not add to AST
-        if token.type == "COMMENT":
+        if token_type == "COMMENT":
             self.consume("COMMENT")
             return
 
-        match (token.value):
+        match (self.peek_value()):
             case "let":
                 declaration = self.parse_declaration()
-                if self.peek().type != "SEMICOLON":
-                    raise Exception("Syntax error: unexpected end of input")
+                if self.peek_type() != "SEMICOLON":
+                    raise self.syntax_error("Syntax error: unexpected end of input")
                 self.consume("SEMICOLON")
                 return declaration
             case "function":
                 self.consume("KEYWORD")
-                fun = Node("Id", self.consume("ID").value, [])
-
-                # Create symbol table for function parameters to be used in function
-                function_symbol_table = SymbolTable(self.cur_symbol_table)
-                self.cur_symbol_table = function_symbol_table
-
+                fun = self.identifier_node([])
+                params_start = self.position
                 self.consume("PARENTHESIS")
 
                 params = self.parse_params()
                 self.consume("PARENTHESIS")
+                self.span(params, params_start)
 
                 fun.children.append(params)
                 rhs = self.parse_assignment()
                 rhs.children.insert(0, fun)
-                if self.peek().type != "SEMICOLON":
-                    raise Exception("Syntax error: unexpected end of input")
+                if self.peek_type() != "SEMICOLON":
+                    raise self.syntax_error("Syntax error: unexpected end of input")
                 self.consume("SEMICOLON")
-
-                self.cur_symbol_table = self.cur_symbol_table.parent
-
-                self.cur_symbol_table.add(fun.value, "ANY")
-
                 return rhs
             case "while":
-                while_node = Node("While", self.consume("KEYWORD").value, [])
+                while_node = Node("While", self.consume("KEYWORD"), [])
                 # self.consume("PARENTHESIS")
                 while_node.children.append(self.parse_expression())
                 # self.consume("PARENTHESIS")
@@ -110,60 +191,41 @@ class Parser:
                 if_block = self.parse_block()
                 branch_node.children.append(cond)
                 branch_node.children.append(if_block)
-                if self.position < len(self.tokens) and self.peek().value == "else":
+                if self.position < len(self.tokens) and self.peek_value() == "else":
                     self.consume("KEYWORD")
                     else_block = self.parse_block()
                     branch_node.children.append(else_block)
                 return branch_node
             case "print":
-                print_node = Node("Print", self.consume("BUILTIN_FUNCTION").value, [])
+                print_node = Node("Print", self.consume("BUILTIN_FUNCTION"), [])
                 print_node.children.append(self.parse_expression())
                 self.consume("SEMICOLON")
                 return print_node
             case "free":
-                free_node = Node("Free", self.consume("BUILTIN_FUNCTION").value, [])
+                free_node = Node("Free", self.consume("BUILTIN_FUNCTION"), [])
                 self.consume("PARENTHESIS")
-                free_var = Node("Id", self.consume("ID").value, [])
+                free_var = self.identifier_node([])
                 free_node.children.append(free_var)
                 self.consume("PARENTHESIS")
                 self.consume("SEMICOLON")
                 return free_node
             case _:
-                raise Exception("Syntax error: unexpected input")
+                raise self.syntax_error("Syntax error: unexpected input")
 
     # To parser declaration statements
     def parse_declaration(self):
         var_type = self.consume("KEYWORD")
-        lhs = Node("Id", self.consume("ID").value, [])
+        lhs = self.identifier_node([])
         # Declarations must include assignment in Bella
         rhs = self.parse_assignment()
         rhs.value = "Declaration"
         rhs.children.insert(0, lhs)
 
-        match (rhs.children[1].type):
-            case "Int":
-                self.cur_symbol_table.add(lhs.value, "INTEGER")
-            case "Float":
-                self.cur_symbol_table.add(lhs.value, "FLOAT")
-            case "Keyword":
-                self.cur_symbol_table.add(lhs.value, "BOOLEAN")
-            case "Id":
-                rhs_type = self.cur_symbol_table.lookup(rhs.children[1].value)
-                self.cur_symbol_table.add(lhs.value, rhs_type)
-            case "Operator":
-                if rhs.children[1].value == "?":
-                    self.cur_symbol_table.add(lhs.value, "ANY")
-                else:
-                    rhs_type = TypeChecker.result_type_of_expression(rhs.children[1], self.cur_symbol_table)
-                    self.cur_symbol_table.add(lhs.value, rhs_type)
-            case _:
-                raise Exception("Unkown code in declaration")
-
         return rhs
 
     # To parse assignment statements
     def parse_assignment(self):
-        assign = Node("Assign", self.consume("ASSIGN").value, [])
+        assign = Node("Assign", self.consume("ASSIGN"), [])
         assign.children.append(self.parse_expression())
 
         return assign
@@ -171,141 +233,195 @@ class Parser:
     # To parse list of parameters
     def parse_params(self):
         params = Node("Parameters", "", [])
-        while self.peek().value != ")":
-            param = self.consume("ID")
-            params.children.append(Node("Id", param.value, []))
-
-            self.cur_symbol_table.add(param.value, "ANY")
-            if self.peek().value != ")":
+        while self.peek_value() != ")":
+            params.children.append(self.identifier_node([]))
+            if self.peek_value() != ")":
                 self.consume("COMMA")
 
         return params
 
-    # To parse a list of arguments for a function call
-    def parse_args(self):
-        args = Node("Parameters", "", [])
-        while self.peek().value != ")":
-            args.children.append(self.parse_expression())
-            if self.peek().value != ")":
-                self.consume("COMMA")
-
-        return args
-
-    # To parse an expression
+    # Consume an ID token into an Id node keyed by the number the lexer interned its name as. Nodes for the
+    # same identifier share one name string
+    def identifier_node(self, children):
+        self.consume("ID")
+        identifier = self.tokens.identifier_at(self.position - 1)
+        node = Node("Id", self.tokens.interns.names[identifier], children)
+        node.ident = identifier
+        return self.span(node, self.position - 1)
+
+    # Consume a literal token into a node of the given type
+    def literal_node(self, type, token_type):
+        return self.share(self.span(Node(type, self.consume(token_type), []), self.position - 1))
+
+    # The node to use for a finished expression node: its shared copy when parsing with a NodeTable
+    def share(self, node):
+        return node if self.node_table is None else self.node_table.share(node)
+
+    # To parse an expression. Operators are handled by precedence climbing over binary_precedence, and
+    # parenthesized expressions and call arguments are pushed on an explicit stack of ExpressionFrames
+    # instead of recursing, so nesting depth is not limited by the interpreter's recursion limit
     def parse_expression(self):
-        if self.peek().value == "-":
-            exp = Node("Operator", self.consume("OPERATOR4").value, [])
-            rhs = self.parse_expression7()
-            exp.children.append(rhs)
-            return exp
-        elif self.peek().value == "!":
-            exp = Node("Operator", self.consume("NOT_OPERATOR").value, [])
-            rhs = self.parse_expression7()
-            exp.children.append(rhs)
-            return exp
-
-        lhs = self.parse_expression1()
-
-        # Check the types of the expression to ensure they are valid
-        if lhs.type == "Operator":
-            result_type = TypeChecker.result_type_of_expression(lhs, self.cur_symbol_table)
-
-
-        # Parse ternary expression if it exists
-        if self.peek().value == "?":
-            exp = Node("Operator", self.consume("OPERATOR").value, [])
-            first_exp = self.parse_expression1()
-            if self.peek().value != ":":
-                raise Exception("Syntax error: Expected \":\"")
-            self.consume("OPERATOR")
-            second_exp = self.parse_expression1()
-            exp.children = [lhs, first_exp, second_exp]
-            lhs = exp
-        return lhs
-
-    def parse_expression1(self):
-        lhs = self.parse_expression2()
-        while self.peek().type == "OPERATOR1":
-            exp = Node("Operator", self.consume("OPERATOR1").value, [lhs])
-            rhs = self.parse_expression2()
-            exp.children.append(rhs)
-
-            lhs = exp
-        return lhs
-
-    def parse_expression2(self):
-        lhs = self.parse_expression3()
-        while self.peek().type == "OPERATOR2":
-            exp = Node("Operator", self.consume("OPERATOR2").value, [lhs])
-            rhs = self.parse_expression3()
-            exp.children.append(rhs)
-
-            lhs = exp
-        return lhs
-
-    def parse_expression3(self):
-        lhs = self.parse_expression4()
-        while self.peek().type == "OPERATOR3":
-            exp = Node("Operator", self.consume("OPERATOR3").value, [lhs])
-            rhs = self.parse_expression4()
-            exp.children.append(rhs)
-
-            lhs = exp
-        return lhs
-
-    def parse_expression4(self):
-        lhs = self.parse_expression5()
-        while self.peek().type == "OPERATOR4":
-            exp = Node("Operator", self.consume("OPERATOR4").value, [lhs])
-            rhs = self.parse_expression5()
-            exp.children.append(rhs)
-
-            lhs = exp
-        return lhs
-
-    def parse_expression5(self):
-        lhs = self.parse_expression6()
-        while self.peek().type == "OPERATOR5":
-            exp = Node("Operator", self.consume("OPERATOR5").value, [lhs])
-            rhs = self.parse_expression6()
-            exp.children.append(rhs)
-
-            lhs = exp
-        return lhs
-
-    def parse_expression6(self):
-        lhs = self.parse_expression7()
-        while self.peek().type == "OPERATOR6":
-            exp = Node("Operator", self.consume("OPERATOR6").value, [lhs])
-            rhs = self.parse_expression7()
-            exp.children.append(rhs)
-
-            lhs = exp
-        return lhs
-
-    # To parse individual terms in an expression
-    def parse_expression7(self):
-        term = self.peek()
-        if term.value == "(":
+        frames = [self.open_expression("expression")]
+
+        while True:
+            node = self.parse_primary(frames)
+
+            # Feed the primary to the innermost expression, closing every expression it completes
+            while node is not None:
+                frame = frames[-1]
+                node = self.continue_expression(frame, node)
+                if node is None:
+                    break
+                frames.pop()
+                if not frames:
+                    return node
+                node = self.close_expression(frames, frame, node)
+
+    # Start a new expression frame, consuming a leading unary operator if there is one
+    def open_expression(self, kind, call=None):
+        frame = ExpressionFrame(kind, call)
+        frame.start = self.tokens.start_at(self.position) if self.position < len(self.tokens) else None
+        value = self.peek_value()
+        if value == "-":
+            frame.unary = self.consume("OPERATOR4")
+        elif value == "!":
+            frame.unary = self.consume("NOT_OPERATOR")
+        return frame
+
+    # To parse individual terms in an expression. Returns None when the term opened a nested expression
+    # frame that has to be parsed first
+    def parse_primary(self, frames):
+        term_type = self.peek_type()
+        if term_type == "PARENTHESIS" and self.peek_value() == "(":
             self.consume("PARENTHESIS")
-            exp = self.parse_expression()
+            frames.append(self.open_expression("parenthesis"))
+            return None
+        elif term_type == "INT":
+            return self.literal_node("Int", "INT")
+        elif term_type == "FLOAT":
+            return self.literal_node("Float", "FLOAT")
+        elif term_type == "ID":
+            identifier = self.identifier_node([])
+            if self.peek_value() != "(":
+                return identifier
+
+            # Function call: parse each argument in its own frame
+            args = Node("Parameters", "", [])
+            args.start = self.tokens.start_at(self.position)
             self.consume("PARENTHESIS")
-            return exp
-        elif term.type == "INT":
-            return Node("Int", self.consume("INT").value, [])
-        elif term.type == "FLOAT":
-            return Node("Float", self.consume("FLOAT").value, [])
-        elif term.type == "ID":
-            identifier = Node("Id", self.consume("ID").value, [])
-            if self.peek().value == "(":
-                self.consume("PARENTHESIS")
-                args = self.parse_args()
-                identifier.children.append(args)
-                self.consume("PARENTHESIS")
-            return identifier
-        elif term.type == "KEYWORD":
-            if term.value != "true" and term.value != "false":
-                raise Exception("Syntax error")
-            return Node("Keyword", self.consume("KEYWORD").value, [])
+            if self.peek_value() != ")":
+                frames.append(self.open_expression("argument", (identifier, args)))
+                return None
+            self.consume("PARENTHESIS")
+            return self.close_call(identifier, args)
+        elif term_type == "KEYWORD":
+            if self.peek_value() != "true" and self.peek_value() != "false":
+                raise self.syntax_error()
+            return self.literal_node("Keyword", "KEYWORD")
         else:
-            raise Exception("Syntax error")
+            raise self.syntax_error()
+
+    # Add a primary to an expression frame. Returns the finished expression, or None if the frame
+    # needs another primary
+    def continue_expression(self, frame, node):
+        if frame.unary is not None:
+            unary = Node("Operator", frame.unary, [node])
+            unary.start = frame.start
+            unary.end = node.end
+            return self.share(unary)
+
+        operands = frame.operands
+        operators = frame.operators
+        operands.append(node)
+        token_type = self.peek_type()
+        precedence = self.binary_precedence.get(token_type)
+        if precedence is not None:
+            # Every level is left-associative, so reduce operators that bind at least as tightly
+            while operators and operators[-1][0] >= precedence:
+                frame.reduce(self.node_table)
+            self.position += 1
+            operators.append((precedence, self.tokens.value_at(self.position - 1)))
+            return None
+
+        while operators:
+            frame.reduce(self.node_table)
+        lhs = operands.pop()
+
+        match (frame.phase):
+            case "binary":
+                # Parse ternary expression if it exists
+                if self.peek_value() == "?":
+                    frame.ternary = Node("Operator", self.consume("OPERATOR"), [lhs])
+                    frame.ternary.start = lhs.start
+                    frame.phase = "ternary_first"
+                    return None
+                return lhs
+            case "ternary_first":
+                if self.peek_value() != ":":
+                    raise self.syntax_error("Syntax error: Expected \":\"")
+                self.consume("OPERATOR")
+                frame.ternary.children.append(lhs)
+                frame.phase = "ternary_second"
+                return None
+            case "ternary_second":
+                frame.ternary.children.append(lhs)
+                frame.ternary.end = lhs.end
+                return self.share(frame.ternary)
+
+    # Finish a nested expression frame. Returns the primary it produces for the enclosing frame, or None
+    # if another argument frame was opened
+    def close_expression(self, frames, frame, node):
+        if frame.kind == "parenthesis":
+            self.consume("PARENTHESIS")
+            # Occurrences of a shared node can have different parentheses, so count them on a copy
+            if self.node_table is not None and id(node) in self.node_table.shared:
+                copy = Node(node.type, node.value, list(node.children))
+                copy.start = node.start
+                copy.end = node.end
+                node = copy
+            node.parentheses += 1
+            return node
+
+        identifier, args = frame.call
+        args.children.append(node)
+        if self.peek_value() != ")":
+            self.consume("COMMA")
+        if self.peek_value() != ")":
+            frames.append(self.open_expression("argument", frame.call))
+            return None
+        self.consume("PARENTHESIS")
+        return self.close_call(identifier, args)
+
+    # Finish a call once its closing parenthesis is consumed, extending its span over the arguments
+    def close_call(self, identifier, args):
+        args.end = identifier.end = self.tokens.end_at(self.position - 1)
+        identifier.children.append(args)
+        return identifier
+
+# The state of one expression being parsed: a top-level expression, a parenthesized expression or a
+# call argument
+class ExpressionFrame:
+    __slots__ = ("kind", "call", "unary", "start", "phase", "operands", "operators", "ternary")
+
+    def __init__(self, kind, call=None):
+        self.kind = kind
+        self.call = call
+        self.unary = None
+        # Offset of the expression's first token
+        self.start = None
+        self.phase = "binary"
+        self.operands = []
+        # (precedence, operator) pairs waiting for their right operand
+        self.operators = []
+        self.ternary = None
+
+    # Combine the top operator with the two operands it applies to, sharing the result through node_table
+    # if one is given
+    def reduce(self, node_table=None):
+        precedence, op = self.operators.pop()
+        rhs = self.operands.pop()
+        lhs = self.operands.pop()
+        node = Node("Operator", op, [lhs, rhs])
+        node.start = lhs.start
+        node.end = rhs.end
+        self.operands.append(node if node_table is None else node_table.share(node))
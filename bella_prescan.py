@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+from array import array
+import string
+
+# NumPy is optional. Without it, prescan returns None and Lexer scans every token with its master regex
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Sources shorter than this are scanned with the regex, as setting up the arrays costs more than it saves
+MIN_SIZE = 8 * 1024
+
+# Character classes of the pre-pass. Every byte of another class, such as one no token starts with, makes
+# its line hard
+OTHER, SPACE, LETTER, DIGIT, UNDERSCORE, OPERATOR, PUNCTUATION, DOT = range(8)
+# Kind code of a byte or pair of bytes that is not a token by itself
+NO_KIND = 255
+
+# Tokens found by the pre-pass, in source order, as the arrays of a TokenStream. Lines it could not lex in
+# bulk are left to the regex: spans holds (token index, start, end) of each run of them, where token index is
+# the number of pre-pass tokens before the run
+class Prescan:
+    def __init__(self, kinds, starts, ends, identifiers, spans):
+        self.kinds = kinds
+        self.starts = starts
+        self.ends = ends
+        # Indexes of the ID tokens, for interning them in order
+        self.identifiers = identifiers
+        self.spans = spans
+
+# Lookup tables derived from a Lexer's patterns, built the first time they are needed
+class Tables:
+    def __init__(self, lexer):
+        kind_of = lambda text: self.kind_of(lexer, text)
+        self.classes = numpy.full(256, OTHER, numpy.uint8)
+        self.singles = numpy.full(256, NO_KIND, numpy.uint8)
+        self.pairs = numpy.full(256 * 256, NO_KIND, numpy.uint8)
+        punctuation = {lexer.token_types.index(token_type)
+                       for token_type in ("PARENTHESIS", "CURLY_BRACE", "SEMICOLON", "COMMA")}
+        for first in string.punctuation:
+            for second in string.punctuation:
+                kind = kind_of(first + second)
+                if kind is not None:
+                    self.pairs[ord(first) * 256 + ord(second)] = kind
+                    self.classes[[ord(first), ord(second)]] = OPERATOR
+        for code in range(128):
+            character = chr(code)
+            kind = kind_of(character)
+            if kind is not None:
+                self.singles[code] = kind
+            if lexer.whitespace_regex.fullmatch(character):
+                self.classes[code] = SPACE
+            elif character in string.ascii_letters:
+                self.classes[code] = LETTER
+            elif character in string.digits:
+                self.classes[code] = DIGIT
+            elif character == "_":
+                self.classes[code] = UNDERSCORE
+            elif character == ".":
+                self.classes[code] = DOT
+            elif kind in punctuation:
+                self.classes[code] = PUNCTUATION
+            elif kind is not None:
+                self.classes[code] = OPERATOR
+
+        # Words that a word token starting with them is split after, with their kind codes
+        self.reserved = [(word, lexer.token_types.index(token_type))
+                         for token_type in ("KEYWORD", "BUILTIN_FUNCTION")
+                         for word in lexer.token_type_patterns[token_type][2:-1].split("|")]
+        self.id_kind = lexer.token_types.index("ID")
+        self.int_kind = lexer.token_types.index("INT")
+        self.float_kind = lexer.token_types.index("FLOAT")
+
+    # Kind code of the token text is exactly, or None
+    @staticmethod
+    def kind_of(lexer, text):
+        match = lexer.token_regex.fullmatch(text)
+        if match is None or match.lastindex is None:
+            return None
+        return lexer.group_kinds[match.lastindex]
+
+tables = None
+
+# Lex the lines of an ASCII source that hold only identifiers, reserved words, integers, floats, operators and
+# punctuation, all with array operations over the source's bytes, so no Python work is done per token. No token
+# spans a newline, so each line can be lexed on its own. Lines with anything else, such as comments, a byte no
+# token starts with, a word that starts with a reserved word, or a run of three operator characters, are
+# marked hard and left to the regex, which is exact for them. Returns a Prescan, or None when NumPy is not
+# installed, the source is short, or it is not ASCII, whose character offsets are not its byte offsets
+def prescan(source, lexer):
+    global tables
+    if numpy is None or len(source) < MIN_SIZE or not source.isascii():
+        return None
+    if tables is None:
+        tables = Tables(lexer)
+
+    data = numpy.frombuffer(source.encode("ascii"), numpy.uint8)
+    size = len(data)
+    classes = tables.classes[data]
+    # Padded so that lookups one before the start or a few past the end read a byte of class OTHER
+    padded_data = numpy.concatenate(([0], data, [0, 0, 0])).astype(numpy.uint8)
+    padded_classes = numpy.concatenate(([OTHER], classes, [OTHER, OTHER, OTHER]))
+    before = lambda positions: padded_data[positions]
+    at = lambda positions: padded_data[positions + 1]
+    class_at = lambda positions: padded_classes[positions + 1]
+
+    newlines = numpy.flatnonzero(data == ord("\n"))
+    line_starts = numpy.concatenate(([0], newlines + 1))
+    line_ends = numpy.concatenate((newlines, [size]))
+    # Line of each position, and whether the regex has to lex each line
+    lines = numpy.cumsum(data == ord("\n")) - (data == ord("\n"))
+    hard = numpy.zeros(len(line_starts), bool)
+
+    def mark(positions):
+        hard[lines[positions]] = True
+
+    mark(numpy.flatnonzero(classes == OTHER))
+    # Comments run to the last semicolon of their line, if there is one
+    mark(numpy.flatnonzero((data[:-1] == ord("/")) & (data[1:] == ord("/"))))
+
+    # Runs of identifier characters, and the end of the digits starting at any position
+    word = ((classes >= LETTER) & (classes <= UNDERSCORE)).astype(numpy.int8)
+    edges = numpy.diff(numpy.concatenate(([0], word, [0])))
+    run_starts = numpy.flatnonzero(edges == 1)
+    run_ends = numpy.flatnonzero(edges == -1)
+    firsts = classes[run_starts]
+    non_digits = numpy.append(numpy.flatnonzero(classes != DIGIT), size)
+    digits_end = lambda positions: non_digits[numpy.searchsorted(non_digits, numpy.minimum(positions, size))]
+    all_digits = digits_end(run_starts) >= run_ends
+    run_count = len(run_starts)
+
+    # Every dot has to be in a float: digits, the dot, digits and an optional exponent, with a minus sign
+    # before them taken into the float, as the regex tries FLOAT before OPERATOR4
+    dots = numpy.flatnonzero(classes == DOT)
+    integer = numpy.minimum(numpy.searchsorted(run_ends, dots), max(run_count - 1, 0))
+    fraction = numpy.minimum(numpy.searchsorted(run_starts, dots + 1), max(run_count - 1, 0))
+    if run_count:
+        valid = ((run_ends[integer] == dots) & (firsts[integer] == DIGIT) & all_digits[integer]
+                 & (before(run_starts[integer]) != ord(".")) & (run_starts[fraction] == dots + 1)
+                 & (firsts[fraction] == DIGIT))
+    else:
+        valid = numpy.zeros(len(dots), bool)
+    fraction_ends = run_ends[fraction] if run_count else dots
+    exponent = digits_end(dots + 1)
+    exponent_digits_end = digits_end(exponent + 1)
+    is_exponent = (at(exponent) == ord("e")) | (at(exponent) == ord("E"))
+    # The fraction run is all digits, or digits, an e and digits
+    whole = (exponent >= fraction_ends) | (is_exponent & (exponent + 1 < fraction_ends)
+                                           & (exponent_digits_end >= fraction_ends))
+    # Or digits and an e, followed by a sign and a run of digits
+    signed = (is_exponent & (exponent + 1 == fraction_ends)
+              & ((at(fraction_ends) == ord("+")) | (at(fraction_ends) == ord("-")))
+              & (class_at(fraction_ends + 1) == DIGIT))
+    if run_count:
+        exponent_run = numpy.minimum(numpy.searchsorted(run_starts, fraction_ends + 1), run_count - 1)
+        signed &= all_digits[exponent_run] & (run_starts[exponent_run] == fraction_ends + 1)
+        float_ends = numpy.where(whole, fraction_ends, run_ends[exponent_run])
+    else:
+        float_ends = fraction_ends
+    valid &= whole | signed
+    valid &= at(float_ends) != ord(".")
+    mark(dots[~valid])
+    dots = dots[valid]
+    float_ends = float_ends[valid]
+    float_starts = run_starts[integer[valid]] if run_count else dots
+    float_starts = float_starts - (before(float_starts) == ord("-"))
+
+    covered = numpy.zeros(size + 1, numpy.int32)
+    numpy.add.at(covered, float_starts, 1)
+    numpy.add.at(covered, float_ends, -1)
+    covered = numpy.cumsum(covered[:size]) > 0
+
+    # Runs outside floats are an integer, an identifier, or exactly a reserved word
+    kept = ~covered[run_starts] if run_count else numpy.zeros(0, bool)
+    word_starts = run_starts[kept]
+    word_ends = run_ends[kept]
+    word_firsts = firsts[kept]
+    word_kinds = numpy.where(word_firsts == DIGIT, tables.int_kind, tables.id_kind).astype(numpy.uint8)
+    mark(word_starts[(word_firsts == UNDERSCORE) | ((word_firsts == DIGIT) & ~all_digits[kept])])
+    letters = numpy.flatnonzero(word_firsts == LETTER)
+    for reserved_word, kind in tables.reserved:
+        # Narrow the words down a character at a time, so most are only compared once
+        matches = letters
+        for offset, character in enumerate(reserved_word):
+            matches = matches[at(numpy.minimum(word_starts[matches] + offset, size)) == ord(character)]
+        exact = word_ends[matches] - word_starts[matches] == len(reserved_word)
+        word_kinds[matches[exact]] = kind
+        mark(word_starts[matches[~exact]])
+
+    punctuation = numpy.flatnonzero(classes == PUNCTUATION)
+
+    # Runs of one or two operator characters are one token, or two when the pair is not an operator
+    operator = ((classes == OPERATOR) & ~covered).astype(numpy.int8)
+    edges = numpy.diff(numpy.concatenate(([0], operator, [0])))
+    operator_starts = numpy.flatnonzero(edges == 1)
+    operator_lengths = numpy.flatnonzero(edges == -1) - operator_starts
+    mark(operator_starts[operator_lengths > 2])
+    pair_kinds = tables.pairs[at(operator_starts).astype(numpy.int64) * 256 + at(operator_starts + 1)]
+    paired = (operator_lengths == 2) & (pair_kinds != NO_KIND)
+    single_starts = numpy.concatenate((operator_starts[~paired],
+                                       operator_starts[(operator_lengths == 2) & ~paired] + 1))
+    single_kinds = tables.singles[data[single_starts]]
+    # A lone | or & is not a token
+    mark(single_starts[single_kinds == NO_KIND])
+
+    starts = numpy.concatenate((word_starts, float_starts, punctuation, operator_starts[paired], single_starts))
+    ends = numpy.concatenate((word_ends, float_ends, punctuation + 1, operator_starts[paired] + 2, single_starts + 1))
+    kinds = numpy.concatenate((word_kinds, numpy.full(len(float_starts), tables.float_kind, numpy.uint8),
+                               tables.singles[data[punctuation]], pair_kinds[paired], single_kinds))
+    easy = ~hard[lines[starts]]
+    order = numpy.argsort(starts[easy], kind="stable")
+    starts = starts[easy][order].astype(numpy.int64)
+    ends = ends[easy][order].astype(numpy.int64)
+    kinds = kinds[easy][order].astype(numpy.uint8)
+
+    # Runs of consecutive hard lines, each lexed by the regex in one go
+    hard_lines = numpy.flatnonzero(hard)
+    breaks = numpy.flatnonzero(numpy.diff(hard_lines) != 1)
+    first_lines = hard_lines[numpy.concatenate(([0], breaks + 1))] if len(hard_lines) else hard_lines
+    last_lines = hard_lines[numpy.append(breaks, len(hard_lines) - 1)] if len(hard_lines) else hard_lines
+    span_starts = line_starts[first_lines]
+    spans = list(zip(numpy.searchsorted(starts, span_starts).tolist(), span_starts.tolist(),
+                     line_ends[last_lines].tolist()))
+
+    return Prescan(array("B", kinds.tobytes()), array("q", starts.tobytes()), array("q", ends.tobytes()),
+                   numpy.flatnonzero(kinds == tables.id_kind).tolist(), spans)
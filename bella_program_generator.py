@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+
+# Generates random Bella programs that lex, parse, type check and pass the memory verifier, for benchmarks.
+# Every expression is built for a known type, pointers are only used while they are allocated and are freed
+# in the block that allocated them. Identifier prefixes avoid the keywords, since the lexer matches keywords
+# as prefixes of longer words
+class ProgramGenerator:
+    int_operators = ["+", "-", "*", "/", "%"]
+    float_operators = ["+", "-", "*", "/"]
+    comparison_operators = ["<", "<=", "==", "!=", ">=", ">"]
+
+    def __init__(self, seed=0, statements=100, nesting_depth=3, expression_depth=3, alloc_density=0.2, block_size=4):
+        self.random = random.Random(seed)
+        # Number of top-level statements
+        self.statements = statements
+        # Deepest nesting of while and if blocks
+        self.nesting_depth = nesting_depth
+        # Deepest nesting of binary operators in an expression
+        self.expression_depth = expression_depth
+        # Probability that a statement allocates a pointer
+        self.alloc_density = alloc_density
+        # Largest number of statements in a nested block
+        self.block_size = block_size
+
+    def generate(self):
+        self.counter = 0
+        # One dict of identifier -> type per open scope, innermost last, and the pointers each scope allocated
+        self.scopes = [{"alloc": "INTEGER"}]
+        self.pointers = [[]]
+        self.functions = []
+        lines = []
+        for _ in range(self.statements):
+            self.statement(lines, 0)
+        self.free_pointers(lines, 0)
+        return "\n".join(lines) + "\n"
+
+    def name(self, prefix):
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+    def visible(self, type):
+        names = []
+        for scope in self.scopes:
+            names.extend(name for name, name_type in scope.items() if name_type == type and name != "alloc")
+        return names
+
+    def statement(self, lines, depth):
+        indent = "    " * depth
+        choice = self.random.random()
+        if choice < self.alloc_density:
+            pointer = self.name("q")
+            lines.append(f"{indent}let {pointer} = alloc();")
+            self.scopes[-1][pointer] = "INTEGER"
+            self.pointers[-1].append(pointer)
+            return
+
+        choice = self.random.random()
+        if choice < 0.4:
+            type = self.random.choice(["INTEGER", "INTEGER", "FLOAT", "BOOLEAN"])
+            # Declare the new name after generating its value, which must not refer to it
+            value = self.expression(type, self.expression_depth)
+            if any(value in pointers for pointers in self.pointers):
+                # Declaring a name from a bare pointer makes it an alias the verifier frees with the pointer
+                value = f"{value} + 0"
+            name = self.name({"INTEGER": "v", "FLOAT": "r", "BOOLEAN": "b"}[type])
+            lines.append(f"{indent}let {name} = {value};")
+            self.scopes[-1][name] = type
+        elif choice < 0.55:
+            lines.append(f"{indent}print {self.printable()};")
+        elif choice < 0.6 and depth == 0:
+            self.function(lines)
+        elif choice < 0.7 and self.pointers[-1]:
+            # Free a pointer early; it is no longer visible to later statements
+            pointer = self.pointers[-1].pop(self.random.randrange(len(self.pointers[-1])))
+            del self.scopes[-1][pointer]
+            lines.append(f"{indent}free({pointer});")
+        elif choice < 0.75:
+            lines.append(f"{indent}// comment {self.counter};")
+        elif depth < self.nesting_depth and choice < 0.88:
+            lines.append(f"{indent}while {self.expression('BOOLEAN', self.expression_depth)}")
+            self.block(lines, depth)
+        elif depth < self.nesting_depth:
+            lines.append(f"{indent}if {self.expression('BOOLEAN', self.expression_depth)}")
+            self.block(lines, depth)
+            if self.random.random() < 0.5:
+                lines.append(f"{indent}else")
+                self.block(lines, depth)
+        else:
+            lines.append(f"{indent}print {self.expression('INTEGER', self.expression_depth)};")
+
+    def block(self, lines, depth):
+        indent = "    " * depth
+        lines.append(f"{indent}{{")
+        self.scopes.append({})
+        self.pointers.append([])
+        for _ in range(self.random.randint(1, self.block_size)):
+            self.statement(lines, depth + 1)
+        self.free_pointers(lines, depth + 1)
+        self.scopes.pop()
+        self.pointers.pop()
+        lines.append(f"{indent}}}")
+
+    # Free the pointers the innermost scope still holds, as the verifier requires before it closes
+    def free_pointers(self, lines, depth):
+        indent = "    " * depth
+        for pointer in self.pointers[-1]:
+            lines.append(f"{indent}free({pointer});")
+            del self.scopes[-1][pointer]
+        self.pointers[-1] = []
+
+    def function(self, lines):
+        name = self.name("fn")
+        params = [self.name("x") for _ in range(self.random.randint(1, 3))]
+        body = f" {self.random.choice(self.int_operators)} ".join(params)
+        lines.append(f"function {name}({', '.join(params)}) = {body};")
+        self.functions.append((name, len(params)))
+        self.scopes[-1][name] = "ANY"
+
+    # A ternary or plain expression for a print statement. Ternaries are only printed, since a declaration
+    # from one has type ANY, which the generator does not track
+    def printable(self):
+        if self.random.random() < 0.3:
+            type = self.random.choice(["INTEGER", "BOOLEAN"])
+            condition = self.expression("BOOLEAN", 1)
+            return f"{condition} ? {self.expression(type, 1)} : {self.expression(type, 1)}"
+        return self.expression(self.random.choice(["INTEGER", "FLOAT", "BOOLEAN"]), self.expression_depth)
+
+    def expression(self, type, depth):
+        if depth <= 0 or self.random.random() < 0.25:
+            return self.leaf(type)
+
+        if type == "BOOLEAN":
+            choice = self.random.random()
+            if choice < 0.4:
+                operand_type = self.random.choice(["INTEGER", "INTEGER", "FLOAT"])
+                # Comparisons do not chain, so their operands stay arithmetic
+                return (f"{self.expression(operand_type, depth - 1)} {self.random.choice(self.comparison_operators)} "
+                        f"{self.expression(operand_type, depth - 1)}")
+            operator = self.random.choice(["&&", "||"])
+            return f"{self.operand('BOOLEAN', depth - 1)} {operator} {self.operand('BOOLEAN', depth - 1)}"
+
+        operators = self.int_operators if type == "INTEGER" else self.float_operators
+        return f"{self.operand(type, depth - 1)} {self.random.choice(operators)} {self.operand(type, depth - 1)}"
+
+    # An operand of a binary operator, parenthesized when it is itself an expression
+    def operand(self, type, depth):
+        expression = self.expression(type, depth)
+        if " " in expression and not expression.startswith("("):
+            return f"({expression})"
+        return expression
+
+    # A literal, variable or call. Call arguments are literals or variables, so calls do not nest
+    def leaf(self, type, calls=True):
+        choice = self.random.random()
+        names = self.visible(type)
+        if names and choice < 0.5:
+            return self.random.choice(names)
+        if type == "INTEGER":
+            if calls and self.functions and choice < 0.6:
+                name, arity = self.random.choice(self.functions)
+                args = ", ".join(self.leaf("INTEGER", False) for _ in range(arity))
+                # Calls have type ANY, so add an integer to give the operand a concrete type
+                return f"({name}({args}) + {self.random.randint(0, 99)})"
+            if choice < 0.65:
+                return f"(-{self.random.randint(1, 99)})"
+            return str(self.random.randint(0, 999))
+        if type == "FLOAT":
+            if choice < 0.6:
+                return f"{self.random.randint(0, 99)}.{self.random.randint(0, 99)}e-{self.random.randint(1, 3)}"
+            return f"{self.random.randint(0, 999)}.{self.random.randint(0, 99)}"
+        if choice < 0.6 and names:
+            return f"(!{self.random.choice(names)})"
+        return self.random.choice(["true", "false"])
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Generate a random Bella program")
+    arguments.add_argument("--seed", type=int, default=0)
+    arguments.add_argument("--statements", type=int, default=100)
+    arguments.add_argument("--nesting-depth", type=int, default=3)
+    arguments.add_argument("--expression-depth", type=int, default=3)
+    arguments.add_argument("--alloc-density", type=float, default=0.2)
+    arguments.add_argument("--block-size", type=int, default=4)
+    options = arguments.parse_args()
+    generator = ProgramGenerator(options.seed, options.statements, options.nesting_depth, options.expression_depth,
+                                 options.alloc_density, options.block_size)
+    print(generator.generate(), end="")
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import time
+
+import bella_stats
+from bella_node import Visitor
+from bella_symbol_table import SymbolTable
+from bella_token import InternTable
+from bella_type_checker import TypeChecker
+
+# Scope and type pass over a tree from a syntax-only parse. Binds every Id to the (scope depth, slot) its
+# identifier resolves to, registers declarations in the symbol tables and infers the type of each expression,
+# raising on undeclared identifiers and incompatible types. Scopes key on the numbers Id nodes carry from
+# interns; without interns, every Id is numbered again from its name. Expressions are checked where the parser used
+# to check them inline, which are the places a binary operator starts an expression, and the whole value of
+# a declaration
+class SemanticAnalyzer(Visitor):
+    def __init__(self, symbol_table=None, interns=None):
+        # Number Ids afresh when they did not come with the table their numbers are from
+        self.renumber = interns is None
+        self.interns = interns if interns is not None else InternTable()
+        if symbol_table is None:
+            symbol_table = SymbolTable(interns=self.interns)
+            symbol_table.add(self.interns.intern("alloc"), "INTEGER")
+            symbol_table.add(self.interns.intern("free"), "VOID")
+        self.root_symbol_table = symbol_table
+        self.cur_symbol_table = symbol_table
+
+    @staticmethod
+    def analyze(ast, symbol_table=None, interns=None):
+        stats = bella_stats.collector
+        if stats is not None:
+            started = time.perf_counter()
+        analyzer = SemanticAnalyzer(symbol_table, interns)
+        analyzer.visit(ast)
+        if stats is not None:
+            stats.time("semantic", time.perf_counter() - started)
+        return analyzer.root_symbol_table
+
+    # Analyze one statement in the current scope, for callers that parse a statement at a time
+    def analyze_statement(self, statement):
+        if statement is not None:
+            self.visit(statement)
+
+    def enter_Block(self, block):
+        self.cur_symbol_table = SymbolTable(self.cur_symbol_table)
+
+    def leave_Block(self, block):
+        self.cur_symbol_table = self.cur_symbol_table.parent
+
+    def enter_Assign(self, statement):
+        if statement.value == "Declaration":
+            self.analyze_declaration(statement)
+        else:
+            self.analyze_function(statement)
+        return False
+
+    def enter_Print(self, statement):
+        self.analyze_expression(statement.children[0])
+        return False
+
+    def enter_Free(self, statement):
+        identifier = statement.children[0]
+        identifier.binding = self.cur_symbol_table.resolve(self.identifier(identifier))
+        return False
+
+    def enter_While(self, statement):
+        self.analyze_expression(statement.children[0])
+        return statement.children[1:]
+
+    def enter_Branch(self, statement):
+        self.analyze_expression(statement.children[0])
+        return statement.children[1:]
+
+    # The number an Id is keyed on in the symbol tables
+    def identifier(self, node):
+        if self.renumber:
+            node.ident = self.interns.intern(node.value)
+        return node.ident
+
+    def analyze_declaration(self, statement):
+        lhs, rhs = statement.children
+        # The value is bound before the name is declared, so it cannot refer to it
+        self.analyze_expression(rhs)
+
+        # Operator subtrees were already annotated, so this only types the nodes that are left
+        if rhs.type == "Operator" and rhs.value == "?":
+            lhs.inferred_type = "ANY"
+        else:
+            lhs.inferred_type = TypeChecker.annotate(rhs, self.cur_symbol_table)
+        self.cur_symbol_table.add(self.identifier(lhs), lhs.inferred_type)
+        lhs.binding = self.cur_symbol_table.resolve(lhs.ident)
+
+    # Parameters get their own scope, which the body is analyzed in. The function's name is declared after
+    # its body, so a function cannot call itself
+    def analyze_function(self, statement):
+        fun, body = statement.children
+        function_symbol_table = SymbolTable(self.cur_symbol_table)
+        for param in fun.children[0].children:
+            function_symbol_table.add(self.identifier(param), "ANY")
+            param.binding = function_symbol_table.resolve(param.ident)
+
+        self.cur_symbol_table = function_symbol_table
+        self.analyze_expression(body)
+        self.cur_symbol_table = function_symbol_table.parent
+
+        self.cur_symbol_table.add(self.identifier(fun), "ANY")
+        fun.binding = self.cur_symbol_table.resolve(fun.ident)
+
+    # Bind the Ids of an expression, then annotate the operators the parser used to check, deepest first. The
+    # parser checked the expression before the "?" of every top-level expression, call argument and pair of
+    # parentheses, so a binary operator is checked when it is one of those or a ternary's condition. A
+    # ternary or unary operator is returned unchecked by the expression that builds it, so it is only
+    # checked when another one, such as a further pair of parentheses, wraps it
+    def analyze_expression(self, exp):
+        symbol_table = self.cur_symbol_table
+        starts = []
+        # Entries are (node, 1 if it is a whole top-level expression, call argument or ternary condition)
+        stack = [(exp, 1)]
+        while stack:
+            node, outer = stack.pop()
+            if node.type == "Id":
+                node.binding = symbol_table.resolve(self.identifier(node))
+                if node.children:
+                    stack.extend((arg, 1) for arg in node.children[0].children)
+                continue
+            if node.type != "Operator":
+                continue
+
+            children = node.children
+            checks = node.parentheses + outer
+            if node.value == "?":
+                if checks >= 2:
+                    starts.append(node)
+                stack.append((children[0], 1))
+                stack.extend((child, 0) for child in children[1:])
+            elif len(children) == 1:
+                if checks >= 2:
+                    starts.append(node)
+                stack.append((children[0], 0))
+            else:
+                if checks:
+                    starts.append(node)
+                stack.extend((child, 0) for child in children)
+
+        for node in reversed(starts):
+            TypeChecker.annotate(node, symbol_table)
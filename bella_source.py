@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+# Offsets of the start of every line of a source, built in one pass of C-level splitting and summing. Tokens
+# and nodes only record offsets, and line and column are looked up here when a diagnostic is shown
+class LineIndex:
+    def __init__(self, source):
+        lines = source.split("\n" if isinstance(source, str) else b"\n")
+        # Each line starts one past the end of the line before it
+        self.starts = array("q", accumulate(map((1).__add__, map(len, lines)), initial=0))
+        self.starts.pop()
+
+    def __len__(self):
+        return len(self.starts)
+
+    # 1-based (line, column) of an offset
+    def position(self, offset):
+        line = bisect_right(self.starts, offset)
+        return line, offset - self.starts[line - 1] + 1
+
+# An error at a span of the source. Other exceptions raised while checking a node get the node's span
+# attached by locate, so every front-end error can be placed
+class SourceError(Exception):
+    def __init__(self, message, start=None, end=None):
+        super().__init__(message)
+        self.start = start
+        self.end = end
+
+# Attach a span to an error unless a more precise one was attached where it was raised
+def locate(error, start, end):
+    if getattr(error, "start", None) is None and start is not None:
+        try:
+            error.start = start
+            error.end = end
+        except AttributeError:
+            pass
+    return error
+
+# (line, column) of the start of an error's span in source, or None if it has no span
+def error_position(error, source):
+    start = getattr(error, "start", None)
+    if start is None:
+        return None
+    return LineIndex(source).position(start)
+
+# "Type: message" of an error, followed by where in source it is when the error has a span
+def describe(error, source):
+    description = f"{type(error).__name__}: {error}"
+    position = error_position(error, source)
+    if position is not None:
+        description += " at line {}, column {}".format(*position)
+    return description
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+from contextlib import contextmanager
+
+# Stats the front end reports to, or None while collection is disabled. Instrumented code reads this once
+# per call and skips all bookkeeping when it is None
+collector = None
+
+# Counters and timings collected from one or more runs of the front end
+class Stats:
+    def __init__(self):
+        # Phase -> wall time in seconds. Type inference runs inside semantic analysis, so its time is also part
+        # of semantic
+        self.seconds = {}
+        # Counter -> value, such as regex attempts, tokens, symbol lookups and parent-chain hops
+        self.counts = {}
+        # Counter -> largest value seen, such as the deepest scope
+        self.maximums = {}
+        # Node type -> number of nodes the parser produced
+        self.nodes = {}
+
+    def time(self, phase, seconds):
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+
+    def count(self, counter, amount=1):
+        self.counts[counter] = self.counts.get(counter, 0) + amount
+
+    def maximum(self, counter, value):
+        if value > self.maximums.get(counter, value - 1):
+            self.maximums[counter] = value
+
+    # Count the nodes of a tree by type, with an explicit stack so deep trees do not hit the recursion limit
+    def count_nodes(self, ast):
+        nodes = self.nodes
+        stack = [ast]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            nodes[node.type] = nodes.get(node.type, 0) + 1
+            stack.extend(node.children)
+
+    def merge(self, other):
+        for phase, seconds in other.seconds.items():
+            self.time(phase, seconds)
+        for counter, value in other.counts.items():
+            self.count(counter, value)
+        for counter, value in other.maximums.items():
+            self.maximum(counter, value)
+        for type, count in other.nodes.items():
+            self.nodes[type] = self.nodes.get(type, 0) + count
+
+    def as_dict(self):
+        stats = {
+            "seconds": dict(self.seconds),
+            "counts": dict(self.counts),
+            "maximums": dict(self.maximums),
+            "nodes": dict(self.nodes),
+        }
+        tokens = self.counts.get("tokens")
+        if tokens:
+            stats["regex_attempts_per_token"] = self.counts.get("regex_attempts", 0) / tokens
+        lookups = self.counts.get("symbol_lookups")
+        if lookups:
+            stats["hops_per_lookup"] = self.counts.get("scope_hops", 0) / lookups
+        return stats
+
+    @staticmethod
+    def from_dict(stats):
+        result = Stats()
+        result.seconds.update(stats["seconds"])
+        result.counts.update(stats["counts"])
+        result.maximums.update(stats["maximums"])
+        result.nodes.update(stats["nodes"])
+        return result
+
+    def report(self):
+        lines = []
+        for phase, seconds in self.seconds.items():
+            lines.append(f"{phase:>24}: {seconds * 1000:12.3f} ms")
+        for counter, value in self.counts.items():
+            lines.append(f"{counter:>24}: {value:12}")
+        for counter, value in self.maximums.items():
+            lines.append(f"{'max ' + counter:>24}: {value:12}")
+        stats = self.as_dict()
+        for ratio in ("regex_attempts_per_token", "hops_per_lookup"):
+            if ratio in stats:
+                lines.append(f"{ratio:>24}: {stats[ratio]:12.3f}")
+        lines.append(f"{'nodes':>24}: {sum(self.nodes.values()):12}")
+        for type, count in sorted(self.nodes.items()):
+            lines.append(f"{type:>24}: {count:12}")
+        return "\n".join(lines)
+
+# Collect stats from the front end for the duration of a with block
+@contextmanager
+def collecting():
+    global collector
+    previous = collector
+    collector = Stats()
+    try:
+        yield collector
+    finally:
+        collector = previous
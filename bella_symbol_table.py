@@ -1,38 +1,98 @@
+import bella_stats
+
+# Fixed-layout record for one declared identifier
+class Symbol:
+    __slots__ = ("type", "initialized")
+
+    def __init__(self, type, initialized=False):
+        self.type = type
+        self.initialized = initialized
+
+# Identifiers are either names or the numbers an InternTable gave them. With interns, the root table and
+# its children key on numbers and turn them back into names for error messages
 class SymbolTable:
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, interns=None):
+        # Identifier -> index of its Symbol in slots
         self.table = {}
+        self.slots = []
         self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        # The tables from the root down to this one, indexed by depth
+        self.scopes = (self,) if parent is None else parent.scopes + (self,)
+        self.interns = interns if parent is None else parent.interns
+
+        stats = bella_stats.collector
+        if stats is not None:
+            stats.maximum("scope_depth", self.depth)
 
     def add(self, identifier, type, initialized=False):
-        if identifier in self.table:
-            if self.lookup(identifier) != type and self.lookup(identifier) != "ANY" and type != "ANY":
-                raise Exception(f"Identifier \"{identifier}\" reassigned to different type")
+        slot = self.table.get(identifier)
+        if slot is None:
+            self.table[identifier] = len(self.slots)
+            self.slots.append(Symbol(type, initialized))
+            return
+
+        # Redeclaring in the same scope reuses the slot
+        symbol = self.slots[slot]
+        if symbol.type != type and symbol.type != "ANY" and type != "ANY":
+            raise Exception(f"Identifier \"{self.name(identifier)}\" reassigned to different type")
+        symbol.type = type
+        symbol.initialized = initialized
 
-        self.table[identifier] = {"type": type, "initialized": initialized}
+    # Name of an identifier, for diagnostics
+    def name(self, identifier):
+        return self.interns.name(identifier) if self.interns is not None else identifier
 
     def is_initialized(self, identifier):
-       return self.table[identifier]["initialized"]
+       return self.slots[self.table[identifier]].initialized
 
     def set_initialized(self, identifier):
         if identifier not in self.table:
-            raise Exception(f"Identifier \"{identifier}\" not declared")
+            raise Exception(f"Identifier \"{self.name(identifier)}\" not declared")
 
-        self.table[identifier]["initialized"] = True
+        self.slots[self.table[identifier]].initialized = True
 
-    def lookup(self, identifier):
-        if identifier in self.table:
-            return self.table[identifier]["type"]
-        cur_table = self.parent
-        while cur_table != None:
-            if identifier in cur_table.table:
-                return cur_table.table[identifier]["type"]
+    # Find the scope that declares an identifier, returning its (scope depth, slot index) binding, or None
+    # if it is not declared in this table or any parent
+    def resolve(self, identifier):
+        cur_table = self
+        while True:
+            slot = cur_table.table.get(identifier)
+            if slot is not None:
+                stats = bella_stats.collector
+                if stats is not None:
+                    stats.count("symbol_lookups")
+                    # Each parent table is one level shallower, so the depth difference is the hops taken
+                    stats.count("scope_hops", self.depth - cur_table.depth)
+                return (cur_table.depth, slot)
+            if cur_table.parent is None:
+                stats = bella_stats.collector
+                if stats is not None:
+                    stats.count("symbol_lookups")
+                    stats.count("scope_hops", self.depth)
+                return cur_table.resolve_missing(identifier)
             cur_table = cur_table.parent
 
-        raise Exception(f"Identifier \"{identifier}\" not declared")
+    # Called on the root table when no scope declares an identifier. Root tables that can see
+    # declarations from outside the current parse override this to bind them
+    def resolve_missing(self, identifier):
+        return None
+
+    # Return the symbol for a binding produced by resolve on this table or one of its ancestors
+    def symbol_at(self, binding):
+        depth, slot = binding
+        return self.scopes[depth].slots[slot]
+
+    def lookup(self, identifier):
+        binding = self.resolve(identifier)
+        if binding is None:
+            raise Exception(f"Identifier \"{self.name(identifier)}\" not declared")
+
+        return self.symbol_at(binding).type
 
 
     def update(self, identifier, newType):
         if identifier not in self.table:
-            raise Exception(f"Identifier \"{identifier}\" not declared")
+            raise Exception(f"Identifier \"{self.name(identifier)}\" not declared")
 
-        self.table[identifier]["type"] = newType
+        self.slots[self.table[identifier]].type = newType
@@ -1,6 +1,136 @@
 #!/usr/bin/env python3
 
+from array import array
+
+# Per-compilation table that numbers each distinct identifier. Symbol tables, the memory verifier and Id
+# nodes key on the numbers, and names are only looked up again for diagnostics
+class InternTable:
+    def __init__(self):
+        # Identifier -> number, and number -> identifier
+        self.numbers = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        number = self.numbers.get(name)
+        if number is None:
+            number = len(self.names)
+            self.numbers[name] = number
+            self.names.append(name)
+        return number
+
+    def name(self, number):
+        return self.names[number]
+
 class Token:
-    def __init__(self, type, value):
+    # Offsets of the token in its source, or None if it was not made by a lexer
+    def __init__(self, type, value, start=None, end=None):
         self.type = type
         self.value = value
+        self.start = start
+        self.end = end
+
+# A token that only records where it is in a bytes-like source and decodes its value when asked for
+class LazyToken:
+    __slots__ = ("type", "start", "end", "source")
+
+    def __init__(self, type, source, start, end):
+        self.type = type
+        self.source = source
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self):
+        value = self.source[self.start:self.end].decode()
+        if self.type == "FLOAT":
+            return float(value)
+        return value
+
+# Compact token store: parallel arrays of small-int kind codes and start/end offsets into the source.
+# Token values are only sliced out of the source when a parser or caller asks for them, except identifiers,
+# which the lexer interns as it finds them
+class TokenStream:
+    def __init__(self, source, types, interns=None):
+        self.source = source
+        # Kind code -> token type name
+        self.types = types
+        self.float_kind = types.index("FLOAT")
+        self.kinds = array("B")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.interns = interns if interns is not None else InternTable()
+        # Token index -> interned number of each ID token
+        self.identifiers = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, kind, start, end):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def type_at(self, index):
+        return self.types[self.kinds[index]]
+
+    def value_at(self, index):
+        value = self.source[self.starts[index]:self.ends[index]]
+        if self.kinds[index] == self.float_kind:
+            return float(value)
+        return value
+
+    # Offsets the token at index starts and ends at in the source
+    def start_at(self, index):
+        return self.starts[index]
+
+    def end_at(self, index):
+        return self.ends[index]
+
+    # Interned number of the ID token at index
+    def identifier_at(self, index):
+        number = self.identifiers.get(index)
+        if number is None:
+            # Appended without going through the lexer
+            number = self.interns.intern(self.source[self.starts[index]:self.ends[index]])
+        return number
+
+    # Materialize a Token object, for callers that still want one
+    def __getitem__(self, index):
+        return Token(self.type_at(index), self.value_at(index), self.starts[index], self.ends[index])
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield self[index]
+
+# Give a plain list of Token objects the same cursor API as TokenStream
+class TokenList:
+    def __init__(self, tokens, interns=None):
+        self.tokens = tokens
+        self.interns = interns if interns is not None else InternTable()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def type_at(self, index):
+        return self.tokens[index].type
+
+    def value_at(self, index):
+        return self.tokens[index].value
+
+    def start_at(self, index):
+        return getattr(self.tokens[index], "start", None)
+
+    def end_at(self, index):
+        return getattr(self.tokens[index], "end", None)
+
+    def identifier_at(self, index):
+        return self.interns.intern(self.tokens[index].value)
+
+    def __getitem__(self, index):
+        return self.tokens[index]
+
+    def __iter__(self):
+        return iter(self.tokens)
@@ -1,3 +1,9 @@
+import time
+
+import bella_stats
+from bella_node import post_order
+from bella_source import locate
+
 class TypeChecker:
     @staticmethod
     def check_assignment(target_type, value_type):
@@ -34,49 +40,90 @@ class TypeChecker:
     def check_op(left_type, op, right_type):
         return left_type == right_type or left_type == "ANY" or right_type == "ANY"
 
+    # Walks the operators post-order with an explicit stack, so deep expressions do not recurse
     @staticmethod
     def result_type_of_expression(exp, symbol_table):
         if exp.type != "Operator":
             # The expression is just a value, so return its type
             return exp.type
-        left_term = exp.children[0]
-        left_term_type = None
-
-        try:
-            right_term = exp.children[1]
-        except:
-            right_term = None
-        right_term_type = None
 
-        op = exp.value
+        types = {}
+        for node in post_order(exp, lambda node: node.children[:2] if node.type == "Operator" else ()):
+            if node.type != "Operator":
+                match (node.type):
+                    case "Id":
+                        types[node] = symbol_table.lookup(node.value)
+                    case "Int":
+                        types[node] = "INTEGER"
+                    case "Float":
+                        types[node] = "FLOAT"
+                    case "Keyword":
+                        types[node] = "BOOLEAN" if node.value == "true" or node.value == "false" else None
+                    case _:
+                        types[node] = None
+                continue
+            left_term_type = types[node.children[0]]
+            if len(node.children) == 1:
+                types[node] = left_term_type
+            else:
+                types[node] = TypeChecker.result_type_of_op(left_term_type, node.value, types[node.children[1]])
+        return types[exp]
 
-        match (left_term.type):
-            case "Operator":
-                left_term_type = TypeChecker.result_type_of_expression(left_term, symbol_table)
+    # Type of a term that is not an operator, or None if it has no known type
+    @staticmethod
+    def type_of_term(term, symbol_table):
+        match (term.type):
             case "Id":
-                left_term_type = symbol_table.lookup(left_term.value)
+                # Ids resolved by SemanticAnalyzer read their slot directly instead of searching the scopes.
+                # An Id without a binding did not resolve, so it is not declared
+                if term.binding is not None:
+                    return symbol_table.symbol_at(term.binding).type
+                raise Exception(f"Identifier \"{term.value}\" not declared")
             case "Int":
-                left_term_type = "INTEGER"
+                return "INTEGER"
             case "Float":
-                left_term_type = "FLOAT"
+                return "FLOAT"
             case "Keyword":
-                if left_term.value == "true" or left_term.value == "false":
-                    left_term_type = "BOOLEAN"
+                if term.value == "true" or term.value == "false":
+                    return "BOOLEAN"
+        return None
 
+    # Infer the type of an expression bottom-up and cache it on each node as inferred_type. Subtrees that
+    # were already annotated (for example parenthesized expressions checked while parsing) are reused
+    # instead of being walked again. Uses an explicit stack, so deep expressions do not recurse
+    @staticmethod
+    def annotate(exp, symbol_table):
+        stats = bella_stats.collector
+        if stats is not None:
+            started = time.perf_counter()
+        # Entries are (node, operands already pushed)
+        stack = [(exp, False)]
+        try:
+            while stack:
+                node, expanded = stack.pop()
+                if node.inferred_type is not None:
+                    continue
+                if node.type != "Operator":
+                    node.inferred_type = TypeChecker.type_of_term(node, symbol_table)
+                    continue
+                if not expanded:
+                    # Annotate the left operand, then the right one, then this node
+                    stack.append((node, True))
+                    for operand in reversed(node.children[:2]):
+                        stack.append((operand, False))
+                    continue
 
-        if right_term == None:
-            return left_term_type
-        match (right_term.type):
-            case "Operator":
-                right_term_type = TypeChecker.result_type_of_expression(right_term, symbol_table)
-            case "Id":
-                right_term_type = symbol_table.lookup(right_term.value)
-            case "Int":
-                right_term_type = "INTEGER"
-            case "Float":
-                right_term_type = "FLOAT"
-            case "Keyword":
-                if right_term.value == "true" or right_term.value == "false":
-                    right_term_type = "BOOLEAN"
+                left_term_type = node.children[0].inferred_type
+                if len(node.children) == 1:
+                    node.inferred_type = left_term_type
+                else:
+                    node.inferred_type = TypeChecker.result_type_of_op(left_term_type, node.value,
+                                                                       node.children[1].inferred_type)
+        except Exception as error:
+            # Place the error at the operator or term that failed
+            raise locate(error, node.start, node.end)
 
-        return TypeChecker.result_type_of_op(left_term_type, op, right_term_type)
+        if stats is not None:
+            stats.time("type inference", time.perf_counter() - started)
+            stats.count("type_inferences")
+        return exp.inferred_type
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import operator
+import sys
+
+from bella_compiler import (CONST, LOAD, STORE, LOAD_LOCAL, BINARY, NEGATE, NOT, JUMP, JUMP_IF_FALSE,
+                            JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, LOOP, CALL, RETURN, PRINT, ALLOC, FREE, HALT,
+                            BINARY_CONST, BINARY_OPERATORS, Function)
+
+# Integer division floors, as the type checker gives INTEGER / INTEGER the type INTEGER
+def divide(left, right):
+    if type(left) is int and type(right) is int:
+        return left // right
+    return left / right
+
+# Operator -> implementation, shared with evaluators that work on the AST
+OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": divide,
+    "%": operator.mod,
+    "**": operator.pow,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    ">": operator.gt,
+}
+BINARY_OPERATIONS = tuple(OPERATIONS[op] for op in BINARY_OPERATORS)
+
+def format_value(value):
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, Function):
+        return f"<function {value.name}>"
+    return str(value)
+
+# Executes Bytecode on an operand stack. Loops can only end through their condition, which the body cannot
+# change since declarations in a block shadow outer variables, so a run may be given the largest number of
+# loop iterations it is allowed to execute before it is stopped with an error
+class VirtualMachine:
+    def __init__(self, bytecode, output=None, loop_limit=None):
+        self.bytecode = bytecode
+        self.output = output if output is not None else sys.stdout
+        self.loop_limit = loop_limit
+        self.variables = [None] * bytecode.variable_count
+        # (operation, constant) of each BINARY_CONST instruction, resolved once before running
+        self.fused_operands = [(BINARY_OPERATIONS[op], bytecode.constants[constant])
+                               for op, constant in bytecode.fused_operands]
+        # Addresses returned by alloc() that have not been freed
+        self.heap = set()
+        self.next_address = 1
+        self.iterations = 0
+
+    def run(self):
+        code = self.bytecode.code
+        constants = self.bytecode.constants
+        variables = self.variables
+        operations = BINARY_OPERATIONS
+        fused_operands = self.fused_operands
+        write = self.output.write
+        loop_limit = self.loop_limit
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        # (return offset, arguments) of each active call
+        frames = []
+        arguments = ()
+        pc = 0
+
+        try:
+            # The dispatch tests the most frequent opcodes first
+            while True:
+                opcode = code[pc]
+                operand = code[pc + 1]
+                pc += 2
+                if opcode == LOAD:
+                    push(variables[operand])
+                elif opcode == CONST:
+                    push(constants[operand])
+                elif opcode == BINARY_CONST:
+                    operation, constant = fused_operands[operand]
+                    stack[-1] = operation(stack[-1], constant)
+                elif opcode == BINARY:
+                    right = pop()
+                    stack[-1] = operations[operand](stack[-1], right)
+                elif opcode == STORE:
+                    variables[operand] = pop()
+                elif opcode == JUMP_IF_FALSE:
+                    if not pop():
+                        pc = operand
+                elif opcode == LOAD_LOCAL:
+                    push(arguments[operand])
+                elif opcode == LOOP:
+                    self.iterations += 1
+                    if loop_limit is not None and self.iterations > loop_limit:
+                        raise Exception(f"Runtime error: loop iteration limit of {loop_limit} exceeded")
+                    pc = operand
+                elif opcode == JUMP:
+                    pc = operand
+                elif opcode == JUMP_IF_FALSE_OR_POP:
+                    if stack[-1]:
+                        pop()
+                    else:
+                        pc = operand
+                elif opcode == JUMP_IF_TRUE_OR_POP:
+                    if stack[-1]:
+                        pc = operand
+                    else:
+                        pop()
+                elif opcode == NEGATE:
+                    stack[-1] = -stack[-1]
+                elif opcode == NOT:
+                    stack[-1] = not stack[-1]
+                elif opcode == CALL:
+                    call_arguments = tuple(stack[len(stack) - operand:])
+                    del stack[len(stack) - operand:]
+                    function = pop()
+                    if not isinstance(function, Function):
+                        raise Exception(f"Runtime error: {format_value(function)} is not a function")
+                    if operand != function.arity:
+                        raise Exception(f"Runtime error: \"{function.name}\" takes {function.arity} arguments, "
+                                        f"got {operand}")
+                    frames.append((pc, arguments))
+                    arguments = call_arguments
+                    pc = function.entry
+                elif opcode == RETURN:
+                    pc, arguments = frames.pop()
+                elif opcode == PRINT:
+                    write(format_value(pop()) + "\n")
+                elif opcode == ALLOC:
+                    push(self.next_address)
+                    self.heap.add(self.next_address)
+                    self.next_address += 1
+                elif opcode == FREE:
+                    address = pop()
+                    if address not in self.heap:
+                        raise Exception(f"Runtime error: free of unallocated address {format_value(address)}")
+                    self.heap.remove(address)
+                elif opcode == HALT:
+                    return
+                else:
+                    raise Exception(f"Runtime error: unknown opcode {opcode}")
+        except ZeroDivisionError:
+            raise Exception("Runtime error: division by zero")
+        except OverflowError:
+            raise Exception("Runtime error: numeric overflow")
+
+    @staticmethod
+    def execute(bytecode, output=None, loop_limit=None):
+        machine = VirtualMachine(bytecode, output, loop_limit)
+        machine.run()
+        return machine
@@ -1,22 +1,112 @@
 #!/usr/bin/env python3
 
+import argparse
+import sys
+
 import bella_lexer as lexer
 import bella_parser as parser
 import bella_memory_verifier as memory_verifier
-import json
+import bella_batch as batch
+import bella_cache as cache
+import bella_stats
+from bella_compiler import Compiler
+from bella_node import write_tree
+from bella_optimizer import Optimizer
+from bella_vm import VirtualMachine
 # program = "a     =   (5 + 3.0) * 2e-2;"
 
-program_file = open("bella_program.bla", "r")
-program = program_file.read()
+def print_ast(path, optimize=False, passes=batch.PASSES):
+    program_file = open(path, "r")
+    program = program_file.read()
+
+    tokens = lexer.Lexer(program).tokenize_compact()
+    # for token in tokens:
+    #     print(f"{{{token.type}, {token.value}}}", end=" ")
+    # print()
+    # print(tokens)
+
+    ast = parser.Parser(tokens, "types" in passes).parse()
+    if optimize:
+        Optimizer.optimize(ast)
+    write_tree(ast, sys.stdout)
+    if "memory" in passes:
+        memory_verifier.MemoryVerifier.verify_allocation(ast)
+
+# Compile a verified program to bytecode and run it
+def run_program(path, loop_limit=None, optimize=False):
+    with open(path, "r") as program_file:
+        program = program_file.read()
+    ast = parser.Parser(lexer.Lexer(program).tokenize_compact()).parse()
+    if optimize:
+        Optimizer.optimize(ast)
+    memory_verifier.MemoryVerifier.verify_allocation(ast)
+    VirtualMachine.execute(Compiler.compile(ast), sys.stdout, loop_limit)
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description="Check Bella programs")
+    arguments.add_argument("paths", nargs="*", help="files, directories or glob patterns of .bla files")
+    arguments.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    arguments.add_argument("--chunksize", type=int, default=16, help="files sent to a worker at a time")
+    arguments.add_argument("--cache", metavar="DIR", help="reuse results stored in a cache directory")
+    arguments.add_argument("--cache-size", type=int, default=cache.DEFAULT_SIZE_LIMIT // (1024 * 1024),
+                           help="cache size limit in MiB (default: %(default)s)")
+    arguments.add_argument("--stats", action="store_true",
+                           help="report time per phase and front-end counters (to stderr with --ast)")
+    arguments.add_argument("--optimize", action="store_true",
+                           help="fold constants and remove dead branches before verifying; memory errors that only "
+                                "happen in a removed branch are not reported")
+    arguments.add_argument("--skip", action="append", choices=batch.PASSES, default=[],
+                           help="skip a check that runs after the syntax check (--run always runs them all)")
+    arguments.add_argument("--syntax-only", action="store_true", help="only check the syntax, skipping every pass")
+    arguments.add_argument("--stream", action="store_true",
+                           help="check a top-level statement at a time, holding only one statement's tree")
+    arguments.add_argument("--share-nodes", action="store_true",
+                           help="share identical literals and constant subexpressions in the AST")
+    arguments.add_argument("--block-workers", type=int, default=None, metavar="N",
+                           help="check the large blocks of each file in N processes, one file at a time")
+    arguments.add_argument("--run", action="store_true", help="run each program instead of checking it")
+    arguments.add_argument("--loop-limit", type=int, default=None,
+                           help="stop a run after this many loop iterations in total")
+    arguments.add_argument("--ast", action="store_true", help="print the AST of a single file instead of checking")
+    options = arguments.parse_args(argv)
+    passes = () if options.syntax_only else tuple(name for name in batch.PASSES if name not in options.skip)
+
+    if options.block_workers and (passes != batch.PASSES or options.optimize or options.stream):
+        arguments.error("--block-workers runs every pass and cannot be combined with --optimize or --stream")
+
+    if options.run:
+        for path in batch.collect_files(options.paths or ["bella_program.bla"]):
+            run_program(path, options.loop_limit, options.optimize)
+        return 0
+
+    # Without paths, keep the original behaviour of printing the AST of the bundled program
+    if options.ast or not options.paths:
+        for path in options.paths or ["bella_program.bla"]:
+            if options.stats:
+                with bella_stats.collecting() as collector:
+                    print_ast(path, options.optimize, passes)
+                print(collector.report(), file=sys.stderr)
+            else:
+                print_ast(path, options.optimize, passes)
+        return 0
 
-lexer = lexer.Lexer(program)
-tokens = lexer.tokenize()
-# for token in tokens:
-#     print(f"{{{token.type}, {token.value}}}", end=" ")
-# print()
-# print(tokens)
+    files = batch.collect_files(options.paths)
+    result_cache = None
+    if options.cache:
+        # Optimized and unoptimized checks, and checks that run different passes, can differ, so they are
+        # cached apart
+        version = cache.front_end_version() + ("+optimize" if options.optimize else "")
+        version += "+" + ",".join(sorted(passes))
+        # Streamed checks report the first error in source order, which can differ
+        version += "+stream" if options.stream else ""
+        # Errors in shared subtrees are placed at their first occurrence
+        version += "+share" if options.share_nodes else ""
+        result_cache = cache.ResultCache(options.cache, options.cache_size * 1024 * 1024, version)
+    # Files are checked one at a time when their blocks are checked in parallel
+    workers = 1 if options.block_workers else options.workers
+    summary = batch.run(files, sys.stdout, workers, options.chunksize, result_cache, options.stats,
+                        options.optimize, passes, options.stream, options.share_nodes, options.block_workers)
+    return 1 if summary["failed"] else 0
 
-parser = parser.Parser(tokens)
-ast = parser.parse()
-print(ast)
-memory_verifier.MemoryVerifier.verify_allocation(ast)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+import random
+
+from bella_program_generator import ProgramGenerator
+
+# A generated program, with one or two of its words swapped for another of its words in two out of three
+# seeds, so that some of the programs fail to parse, type check or verify
+def mutated_program(seed, statements=30):
+    source = ProgramGenerator(seed, statements).generate()
+    if not seed % 3:
+        return source
+    generator = random.Random(seed)
+    words = source.split(" ")
+    for _ in range(generator.randint(1, 2)):
+        words[generator.randrange(len(words))] = words[generator.randrange(len(words))]
+    return " ".join(words)
+
+# The outcome of calling check(source): None if it passes, or the error message
+def outcome(check, source):
+    try:
+        check(source)
+    except Exception as e:
+        return str(e)
+    return None
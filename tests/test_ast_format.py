@@ -0,0 +1,60 @@
+import bella_ast_format as ast_format
+from bella_lexer import Lexer
+from bella_node import compact
+from bella_parser import Parser
+from programs import mutated_program
+
+SOURCE = """let p = alloc();
+let a = 1.5 * 2.0;
+// a comment;
+function f(x, y) = x + (y);
+while a > 0.0 {
+    // inside;
+    let q = f(1, 2) > 2 ? a : 0.0 - a;
+    print(q);
+}
+free(p);
+"""
+
+# Every field of every node, with None children kept in place
+def listing(root):
+    rows = []
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        if node is None:
+            rows.append((None, depth))
+            continue
+        rows.append((node.type, node.value, node.inferred_type, node.binding, node.start, node.end, depth))
+        stack.extend((child, depth + 1) for child in reversed(node.children))
+    return rows
+
+def parse(source, share=False):
+    return Parser(Lexer(source).tokenize_compact(), share=share).parse()
+
+def test_round_trip_through_lazy_nodes_and_nodes():
+    ast = parse(SOURCE)
+    expected = listing(ast)
+    assert (None, 3) in expected
+    ast_file = ast_format.loads(ast_format.dumps(ast))
+    assert listing(ast_file.root) == expected
+    assert listing(ast_file.to_node()) == expected
+
+def test_round_trip_of_compact_nodes():
+    ast = parse(SOURCE)
+    assert listing(ast_format.loads(ast_format.dumps(compact(ast))).root) == listing(ast)
+
+def test_shared_nodes_are_stored_once():
+    ast = parse("let a = 1 + 2; let b = 1 + 2; let c = (1 + 2) * 3;", share=True)
+    data = ast_format.dumps(ast)
+    ast_file = ast_format.loads(data)
+    assert listing(ast_file.to_node()) == listing(ast)
+    assert ast_file.node_count < len(listing(ast))
+
+def test_round_trip_of_generated_programs(tmp_path):
+    for seed in range(0, 30, 3):
+        ast = parse(mutated_program(seed))
+        path = tmp_path / f"{seed}.ast"
+        ast_format.dump(ast, str(path))
+        with ast_format.load(str(path)) as ast_file:
+            assert listing(ast_file.root) == listing(ast)
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import bella_batch
+import main
+
+PROGRAMS = {
+    "good.bla": "let p = alloc();\nprint(p);\nfree(p);\n",
+    "leak.bla": "let p = alloc();\n",
+    "types.bla": "let a = 1;\nlet b = a + 2.0;\n",
+    "nested/syntax.bla": "let a = ;\n",
+}
+
+@pytest.fixture
+def programs(tmp_path):
+    for name, source in PROGRAMS.items():
+        path = tmp_path / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(source)
+    return tmp_path
+
+def check(capsys, *arguments):
+    status = main.main([*map(str, arguments), "--workers", "1"])
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    return status, {result["file"]: result for result in lines[:-1]}, lines[-1]
+
+# (ok, error) of each file, by its path under root
+def outcomes(results, root):
+    return {str(path)[len(str(root)) + 1:]: (result["ok"], result.get("error")) for path, result in results.items()}
+
+def test_results_and_summary(programs, capsys):
+    status, results, summary = check(capsys, programs)
+    assert status == 1
+    assert list(results) == sorted(results)
+    assert outcomes(results, programs) == {
+        "good.bla": (True, None),
+        "leak.bla": (False, "Exception: Memory leak: not all allocated variables are freed at line 1, column 1"),
+        "types.bla": (False, "TypeError: Incompatible types for operation: INTEGER + FLOAT at line 2, column 9"),
+        "nested/syntax.bla": (False, "SourceError: Syntax error at line 1, column 9"),
+    }
+    assert (summary["summary"], summary["files"], summary["passed"], summary["failed"], summary["cached"]) == (
+        True, 4, 1, 3, 0)
+
+def test_cached_results_match(programs, tmp_path_factory, capsys):
+    cache_directory = tmp_path_factory.mktemp("cache")
+    _, first, summary = check(capsys, programs, "--cache", cache_directory)
+    assert summary["cached"] == 0
+    _, second, summary = check(capsys, programs, "--cache", cache_directory)
+    assert summary["cached"] == 4 and summary["failed"] == 3
+    assert all(result["cached"] for result in second.values())
+    assert outcomes(first, programs) == outcomes(second, programs)
+
+    # A different set of passes is cached apart
+    _, _, summary = check(capsys, programs, "--cache", cache_directory, "--skip", "memory")
+    assert summary["cached"] == 0 and summary["failed"] == 2
+
+# Files checked from a memory map have the outcomes of files read whole, and are cached alike
+def test_mapped_files_match(programs, tmp_path_factory, capsys, monkeypatch):
+    _, read, _ = check(capsys, programs)
+    monkeypatch.setattr(bella_batch, "MAP_SIZE", 0)
+    _, mapped, _ = check(capsys, programs)
+    assert outcomes(mapped, programs) == outcomes(read, programs)
+
+    cache_directory = tmp_path_factory.mktemp("cache")
+    check(capsys, programs, "--cache", cache_directory)
+    _, cached, summary = check(capsys, programs, "--cache", cache_directory)
+    assert summary["cached"] == 4
+    assert outcomes(cached, programs) == outcomes(read, programs)
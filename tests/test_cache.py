@@ -0,0 +1,59 @@
+import os
+
+import bella_cache as cache
+from bella_lexer import Lexer
+from bella_node import walk
+from bella_parser import Parser
+
+SOURCE = b"let a = 1 + 2;\nprint(a);\n"
+
+def test_miss_then_hit(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path), version="1")
+    key = result_cache.key(SOURCE)
+    assert result_cache.get_outcome(key) is None
+    assert result_cache.get_ast(key) is None
+
+    ast = Parser(Lexer(SOURCE.decode()).tokenize_compact()).parse()
+    result_cache.put(key, True, None, ast)
+    assert result_cache.get_outcome(key) == (True, None)
+    assert [(node.type, node.value, depth) for node, depth in walk(result_cache.get_ast(key))] == [
+        (node.type, node.value, depth) for node, depth in walk(ast)]
+
+    result_cache.put(result_cache.key(b"print(x);"), False, "Exception: boom")
+    assert result_cache.get_outcome(result_cache.key(b"print(x);")) == (False, "Exception: boom")
+
+def test_other_version_misses(tmp_path):
+    old = cache.ResultCache(str(tmp_path), version="1")
+    old.put(old.key(SOURCE), True)
+    new = cache.ResultCache(str(tmp_path), version="2")
+    assert new.key(SOURCE) != old.key(SOURCE)
+    assert new.get_outcome(new.key(SOURCE)) is None
+    assert cache.ResultCache(str(tmp_path)).version == cache.front_end_version()
+
+def test_corrupt_entry_misses(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path), version="1")
+    key = result_cache.key(SOURCE)
+    result_cache.put(key, True)
+    path = result_cache.path(key)
+    with open(path, "r+b") as entry:
+        entry.truncate(3)
+    assert result_cache.get_outcome(key) is None
+    with open(path, "wb") as entry:
+        entry.write(b"not a pickle")
+    assert result_cache.get_outcome(key) is None
+    assert result_cache.get_ast(key) is None
+
+def test_evict_removes_least_recently_used(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path), version="1")
+    keys = [result_cache.key(bytes([index])) for index in range(4)]
+    for age, key in enumerate(keys):
+        result_cache.put(key, True)
+        # Entries put earlier were used longer ago
+        os.utime(result_cache.path(key), (1000 + age, 1000 + age))
+    # Reading an entry makes it the most recently used
+    assert result_cache.get_outcome(keys[0]) == (True, None)
+
+    size = os.path.getsize(result_cache.path(keys[0]))
+    result_cache.size_limit = 2 * size
+    assert result_cache.evict() == 2
+    assert [result_cache.get_outcome(key) is not None for key in keys] == [True, False, False, True]
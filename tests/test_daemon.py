@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+import pytest
+
+from bella_daemon import (CheckServer, INTERNAL_ERROR, INVALID_PARAMS, METHOD_NOT_FOUND, OpenDocument, RpcError,
+                          check_document)
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+async def opened(text):
+    server = CheckServer(debounce=0)
+    await server.rpc_open("a.bla", text)
+    return server
+
+@pytest.mark.parametrize("edits", [
+    [{"offset": 0, "deleted": 0}],
+    [{"offset": 0, "deleted": 99, "inserted": ""}],
+    [{"offset": -1, "deleted": 0, "inserted": ""}],
+    [{"offset": 0, "deleted": 0, "inserted": "let a = 1;"}, {"offset": 21, "deleted": 0, "inserted": ""}],
+    {"offset": 0, "deleted": 0, "inserted": ""},
+])
+def test_change_rejects_malformed_edits(edits):
+    async def scenario():
+        server = await opened("let x = 1;")
+        with pytest.raises(RpcError):
+            await server.rpc_change("a.bla", edits)
+        diagnostics = await server.rpc_check("a.bla")
+        assert diagnostics["ok"] and diagnostics["version"] == 1
+        assert server.documents["a.bla"].document.text == "let x = 1;"
+    run(scenario())
+
+def test_check_replies_for_the_latest_version():
+    async def scenario():
+        server = await opened("let x = 1;")
+        await server.rpc_change("a.bla", [{"offset": 10, "deleted": 0, "inserted": " let y = x;"}])
+        check = asyncio.ensure_future(server.rpc_check("a.bla"))
+        await asyncio.sleep(0)
+        await server.rpc_change("a.bla", [{"offset": 0, "deleted": 0, "inserted": "print(1 + true);"}])
+        diagnostics = await check
+        assert diagnostics["version"] == server.documents["a.bla"].version == 3
+        assert not diagnostics["ok"]
+    run(scenario())
+
+def test_failed_edit_requires_resync():
+    document = OpenDocument("a.bla")
+    assert check_document(document, [{"text": "let x = 1;"}], lambda: False)["ok"]
+    result = check_document(document, [{"offset": 50, "deleted": 0, "inserted": ""}], lambda: False)
+    assert not result["ok"] and "out of sync" in result["error"]
+    # Edits relative to the client's text cannot be applied until it is sent again
+    assert not check_document(document, [{"offset": 0, "deleted": 0, "inserted": " "}], lambda: False)["ok"]
+    assert check_document(document, [{"text": "let y = 2;"}], lambda: False)["ok"]
+
+def test_memory_errors_are_placed():
+    document = OpenDocument("a.bla")
+    result = check_document(document, [{"text": "let p = alloc();\nfree(p);\nprint(p);"}], lambda: False)
+    assert result["error"].startswith("Exception: Null pointer reference")
+    assert result["error"].endswith("at line 3, column 1")
+
+# Statements below an edit keep the offsets they were parsed at, which errors in them are moved by
+def test_verifier_errors_follow_edits_above_them():
+    document = OpenDocument("a.bla")
+    result = check_document(document, [{"text": "let p = alloc();\nfree(p);\nprint(p);"}], lambda: False)
+    assert result["error"].endswith("at line 3, column 1")
+    result = check_document(document, [{"offset": 0, "deleted": 0, "inserted": "let z = 1;\nlet w = 2;\n\n"}],
+                            lambda: False)
+    assert result["error"].endswith("at line 6, column 1")
+    result = check_document(document, [{"offset": 0, "deleted": 11, "inserted": ""}], lambda: False)
+    assert result["error"].endswith("at line 5, column 1")
+
+# Collects the replies handle writes
+class Replies:
+    def __init__(self):
+        self.lines = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.lines.append(json.loads(data))
+
+    async def drain(self):
+        pass
+
+def reply(server, message):
+    replies = Replies()
+    run(server.handle(json.dumps({"jsonrpc": "2.0", "id": 1, **message}), replies))
+    return replies.lines[0]
+
+# Only params that do not fit the method are invalid; a TypeError raised inside it is an internal error
+@pytest.mark.parametrize("message, code", [
+    ({"method": "open", "params": {"uri": "a.bla"}}, INVALID_PARAMS),
+    ({"method": "open", "params": {"uri": "a.bla", "text": "", "version": 2}}, INVALID_PARAMS),
+    ({"method": "open", "params": "a.bla"}, INVALID_PARAMS),
+    ({"method": "open", "params": {"uri": "a.bla", "text": 5}}, INTERNAL_ERROR),
+    ({"method": "missing"}, METHOD_NOT_FOUND),
+])
+def test_errors_are_told_apart(message, code):
+    assert reply(CheckServer(debounce=0), message)["error"]["code"] == code
+
+def test_params_by_name_or_position():
+    server = CheckServer(debounce=0)
+    assert reply(server, {"method": "open", "params": ["a.bla", "let x = 1;"]})["result"] is None
+    assert reply(server, {"method": "close", "params": {"uri": "a.bla"}})["result"] is None
+    assert server.documents == {}
@@ -0,0 +1,45 @@
+import os
+import random
+
+from bella_incremental import IncrementalDocument
+from bella_lexer import Lexer
+from bella_node import walk
+from bella_parser import Parser
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bella_program.bla")
+
+SNIPPETS = ["let q = 1;\n", "let a = 2.5;\n", "x", "1", "+", " ", "\n", "let z = a + 1;\n", ";", "{", "}",
+            "print a;\n", "// note;\n", "let a = true;\n", "function g(u) = u + a;\n", "let w = g(a) + 1;\n",
+            "if c { print 1; }\n", "else { print 2; }", "let"]
+
+# The tree, with the bindings of the program's own scope left out, since the document numbers its slots in
+# declaration order across edits
+def listing(ast):
+    return [(node.type, node.value, node.inferred_type, node.binding if node.binding is None or node.binding[0] else 0,
+             depth) for node, depth in walk(ast)]
+
+def reparse(text):
+    try:
+        return listing(Parser(Lexer(text).tokenize_compact()).parse())
+    except Exception:
+        return None
+
+# After every edit, the document's tree is the tree of parsing its text from scratch
+def test_edits_match_full_parse():
+    with open(PROGRAM) as program_file:
+        original = program_file.read()
+    generator = random.Random(0)
+    for _ in range(20):
+        text = original
+        document = IncrementalDocument(text)
+        for _ in range(15):
+            offset = generator.randint(0, len(text))
+            deleted = min(generator.choice([0, 0, 1, 2, 5]), len(text) - offset)
+            inserted = generator.choice(SNIPPETS) if generator.random() < 0.8 else ""
+            text = text[:offset] + inserted + text[offset + deleted:]
+            try:
+                document.edit(offset, deleted, inserted)
+                edited = listing(document.ast)
+            except Exception:
+                edited = None
+            assert edited == reparse(text), text
@@ -0,0 +1,142 @@
+import pytest
+
+from bella_lexer import Lexer, StreamCursor, StreamLexer, TokenWindow
+import bella_prescan
+from bella_program_generator import ProgramGenerator
+from bella_source import SourceError
+
+SOURCES = [
+    "",
+    "   \n\t ",
+    "let x = 1;\nprint x;",
+    "// a comment;\nlet y = 2.5e-3 * 4;   // trailing comment;",
+    "let z = -1.5 + 3.25E+2 - 7 ** 2 % 3;",
+    "function f(a, b) = a > b ? a : b;\nwhile x <= 10 && !done { let x = x + 1; }\n",
+    "if a != b || c == d { print(a); } else { free(b); }  \n",
+    # A comment without its closing semicolon lexes as operators and names
+    "let w = 1; // not closed",
+    "let v = 0.5",
+    "let u = 12",
+    "let s = identifier_",
+]
+
+# Sources that stop at a character no token starts with
+BAD_SOURCES = ["let x = 1 # 2;", "let y = 2.5;\n   @", "   $"]
+
+def tokens_of(stream):
+    return [(stream.type_at(index), stream.value_at(index), stream.start_at(index), stream.end_at(index))
+            for index in range(len(stream))]
+
+def window_tokens(source, chunk_size):
+    window = TokenWindow(Lexer(source), chunk_size)
+    tokens = []
+    index = 0
+    while index < len(window):
+        tokens.append((window.type_at(index), window.value_at(index), window.start_at(index), window.end_at(index)))
+        index += 1
+    return tokens
+
+def mapped_tokens(path, source):
+    path.write_text(source)
+    with StreamLexer(path) as stream_lexer:
+        cursor = StreamCursor(stream_lexer)
+        tokens = []
+        index = 0
+        while index < len(cursor):
+            tokens.append((cursor.type_at(index), cursor.value_at(index), cursor.start_at(index), cursor.end_at(index)))
+            # Release every token read, so the cursor drops them as it goes
+            cursor.discard(index)
+            index += 1
+    return tokens
+
+# Chunk sizes that split tokens, comments and whitespace runs at every kind of boundary
+CHUNK_SIZES = [1, 2, 3, 7, 64]
+
+# The three scanners agree on the kind, value and span of every token
+@pytest.mark.parametrize("source", SOURCES)
+def test_scanners_produce_the_same_tokens(source, tmp_path, monkeypatch):
+    expected = [(token.type, token.value, token.start, token.end) for token in Lexer(source).tokenize()]
+    assert tokens_of(Lexer(source).tokenize_compact()) == expected
+    for chunk_size in CHUNK_SIZES:
+        assert window_tokens(source, chunk_size) == expected
+    monkeypatch.setattr(StreamCursor, "drop_size", 1)
+    assert mapped_tokens(tmp_path / "source.bla", source) == expected
+
+def test_float_values_are_floats():
+    kinds = [(token.type, token.value) for token in Lexer("1 1.0 -2.5e1").tokenize()]
+    assert kinds == [("INT", "1"), ("FLOAT", 1.0), ("FLOAT", -25.0)]
+    stream = Lexer("1 1.0 -2.5e1").tokenize_compact()
+    assert [stream.value_at(index) for index in range(len(stream))] == ["1", 1.0, -25.0]
+
+def error_span(scan):
+    with pytest.raises(SourceError) as error:
+        scan()
+    return str(error.value), error.value.start, error.value.end
+
+# The three scanners report a character no token starts with at the same place
+@pytest.mark.parametrize("source", BAD_SOURCES)
+def test_scanners_report_the_same_error(source, tmp_path):
+    expected = error_span(lambda: Lexer(source).tokenize())
+    offset = min(source.find(character) for character in "#@$" if character in source)
+    assert expected == ("Lexer error", offset, offset + 1)
+    assert error_span(lambda: Lexer(source).tokenize_compact()) == expected
+    for chunk_size in CHUNK_SIZES:
+        assert error_span(lambda: window_tokens(source, chunk_size)) == expected
+    assert error_span(lambda: mapped_tokens(tmp_path / "source.bla", source)) == expected
+
+# Lines the pre-pass lexes in bulk next to ones it leaves to the regex: floats in every form, words that start
+# with reserved words, runs of operator characters, comments and characters no token starts with
+PRESCAN_LINES = [
+    "let x = 1.5 + -2.25e-3 * 3.0E+2 - 4.5e1 ** 10;",
+    "let y=x-1.5;let z=(-8)**2;print(y >= z && !(y != z) || z <= 2);",
+    "letter = iffy + elsewhere + printer + freed + trueish + functional;",
+    "if a == b { free(p); } else { print(q, r % 4 / 2); }",
+    "let w = a ? b : c; while w < 10 { let w = w + 1; }",
+    "x = y === z; p = q ***r; s = t <== u; v = !!w; k = a||b&&c;",
+    "1.5.2 3.x 4.5e 6.5e+ 7.5e-1.5 8.5ex 9.5e3x 10..5 _a 12ab .5 x.5",
+    "a | b & c # d",
+    "// a comment; with more ; after it;",
+    "let q = 2; // trailing comment;",
+    "\t\x0b\x0c\x1c let\x1dv = 3;",
+    "",
+]
+
+def prescan_sources():
+    for source in SOURCES + BAD_SOURCES:
+        yield source
+    yield "\n".join(PRESCAN_LINES)
+    # Without the lines that fail, so every line is lexed
+    yield "\n".join(line for line in PRESCAN_LINES if "#" not in line and "1.5.2" not in line)
+    for seed in range(20):
+        yield ProgramGenerator(seed, 20).generate()
+
+def lexed(source):
+    lexer = Lexer(source)
+    try:
+        stream = lexer.tokenize_compact()
+    except SourceError as error:
+        return str(error), error.start, error.end
+    return tokens_of(stream), stream.identifiers, lexer.interns.names, lexer.position
+
+# With NumPy, the pre-pass gives the tokens, identifier numbers and errors of the regex alone
+def test_prescan_matches_regex(monkeypatch):
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(bella_prescan, "MIN_SIZE", 0)
+    source = "\n".join(PRESCAN_LINES)
+    prescanned = bella_prescan.prescan(source, Lexer(source))
+    assert len(prescanned.kinds) and len(prescanned.spans)
+    for source in prescan_sources():
+        prescanned = lexed(source)
+        with monkeypatch.context() as without_numpy:
+            without_numpy.setattr(bella_prescan, "numpy", None)
+            assert lexed(source) == prescanned
+
+# Without NumPy, or for source that is short or not ASCII, the regex lexes everything
+def test_prescan_falls_back(monkeypatch):
+    source = ProgramGenerator(0, 20).generate()
+    monkeypatch.setattr(bella_prescan, "MIN_SIZE", 0)
+    assert bella_prescan.prescan(source + "// é;", Lexer(source)) is None
+    monkeypatch.setattr(bella_prescan, "numpy", None)
+    assert bella_prescan.prescan(source, Lexer(source)) is None
+    expected = [(token.type, token.value, token.start, token.end) for token in Lexer(source).tokenize()]
+    assert tokens_of(Lexer(source).tokenize_compact()) == expected
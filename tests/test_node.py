@@ -0,0 +1,38 @@
+from bella_lexer import Lexer
+from bella_memory_verifier import MemoryVerifier
+from bella_node import compact, walk
+from bella_parser import Parser
+from bella_program_generator import ProgramGenerator
+from programs import mutated_program, outcome
+
+def parse(source):
+    return Parser(Lexer(source).tokenize_compact()).parse()
+
+def listing(root):
+    return [(node.type, node.value, node.binding, node.inferred_type, node.start, node.end, depth)
+            for node, depth in walk(root)]
+
+def test_compact_keeps_comments_in_blocks():
+    ast = parse("while (true) { // hi;\n print(1); }")
+    compacted = compact(ast)
+    assert listing(compacted) == listing(ast)
+    assert None in compacted.children[0].children[1].children
+
+def test_compact_matches_generated_programs():
+    for seed in range(20):
+        ast = parse(ProgramGenerator(seed, 30).generate())
+        assert listing(compact(ast)) == listing(ast)
+
+# Sharing constant subtrees changes neither the tree the passes see nor what they report
+def test_shared_nodes_match_unshared_parse():
+    for seed in range(40):
+        source = mutated_program(seed)
+        results = []
+        for share in (False, True):
+            try:
+                ast = Parser(Lexer(source).tokenize_compact(), share=share).parse()
+                tree = [(node.type, node.value, node.binding, depth) for node, depth in walk(ast)]
+                results.append((tree, outcome(MemoryVerifier.verify_allocation, ast)))
+            except Exception as e:
+                results.append(str(e))
+        assert results[0] == results[1], seed
@@ -0,0 +1,57 @@
+import pytest
+
+from bella_lexer import Lexer
+from bella_memory_verifier import MemoryVerifier
+from bella_optimizer import Optimizer
+from bella_parser import Parser
+
+# The value of the declaration a one-statement program optimizes to
+def optimized_value(expression):
+    ast = Parser(Lexer(f"let x = {expression};").tokenize_compact()).parse()
+    Optimizer.optimize(ast)
+    return ast.children[0].children[1]
+
+@pytest.mark.parametrize("expression, type, value", [
+    ("1 + 2 * 3", "Int", "7"),
+    ("7 / 2", "Int", "3"),
+    ("2.0 ** 0.5", "Float", 2.0 ** 0.5),
+    ("1 < 2 && true", "Keyword", "true"),
+    ("(-8) ** 2", "Int", "64"),
+])
+def test_folds_constant_operators(expression, type, value):
+    node = optimized_value(expression)
+    assert (node.type, node.value) == (type, value)
+
+# Operations that fail or give a value no literal holds are left for the run to report
+@pytest.mark.parametrize("expression", [
+    "(-8.0) ** 0.5",
+    "1 / 0",
+    "1.0 % 0.0",
+    "10.0 ** 400.0",
+    "2 ** 100",
+    "2 ** (0 - 1)",
+])
+def test_leaves_operations_that_cannot_fold(expression):
+    node = optimized_value(expression)
+    assert node.type == "Operator"
+
+def parse(source, share=False):
+    return Parser(Lexer(source).tokenize_compact(), share=share).parse()
+
+# A subtree the parser shares is folded once, and its occurrences are replaced by the same literal
+def test_shared_subtrees_fold_once():
+    source = "let a = 1 + 2; let b = 1 + 2;"
+    assert Optimizer.optimize(parse(source)) == 4
+    ast = parse(source, share=True)
+    assert Optimizer.optimize(ast) == 2
+    first, second = (statement.children[1] for statement in ast.children)
+    assert first is second and (first.type, first.value) == ("Int", "3")
+
+# Memory errors that only happen in a dead block are no longer reported once it is removed
+def test_dead_blocks_are_not_verified():
+    source = "let p = alloc(); free(p); if false { print(p); }"
+    with pytest.raises(Exception, match="already been freed"):
+        MemoryVerifier.verify_allocation(parse(source))
+    ast = parse(source)
+    Optimizer.optimize(ast)
+    MemoryVerifier.verify_allocation(ast)
@@ -0,0 +1,54 @@
+import pytest
+
+import bella_parallel
+from bella_lexer import Lexer
+from bella_memory_verifier import MemoryVerifier
+from bella_parser import Parser
+from programs import mutated_program, outcome
+
+def check_sequentially(source):
+    MemoryVerifier.verify_allocation(Parser(Lexer(source).tokenize_compact()).parse())
+
+# The skeleton with its blocks summarized accepts exactly the programs a sequential check accepts, so the
+# sequential check it falls back on only runs for programs with errors
+@pytest.mark.parametrize("min_block_tokens", [3, 8, 20])
+def test_skeleton_agrees_with_sequential_check(min_block_tokens):
+    for seed in range(40):
+        source = mutated_program(seed)
+        try:
+            accepted = bella_parallel.check_skeleton(source, 1, min_block_tokens)
+        except Exception:
+            accepted = False
+        assert accepted == (outcome(check_sequentially, source) is None), seed
+
+def test_check_source_reports_sequential_errors():
+    for seed in range(40):
+        source = mutated_program(seed)
+        expected = outcome(check_sequentially, source)
+        assert outcome(lambda source: bella_parallel.check_source(source, 1, 5), source) == expected, seed
+
+def test_check_source_with_a_process_pool():
+    for seed in range(3, 6):
+        source = mutated_program(seed, 60)
+        expected = outcome(check_sequentially, source)
+        assert outcome(lambda source: bella_parallel.check_source(source, 2, 5), source) == expected, seed
+
+# Statements that make the programs below long enough for their blocks to be deferred
+PADDING = " ".join(f"let x{index} = {index};" for index in range(20)) + " "
+
+# Blocks that free or read an allocation of the scope around them
+@pytest.mark.parametrize("source, message", [
+    ("let p = alloc(); if (true) { free(p); let a = 1; let b = 2; } print(p);", "has already been freed"),
+    ("let p = alloc(); while (true) { free(p); let a = 1; let b = 2; }", "freed on every iteration"),
+    ("let p = alloc(); let q = p; if (true) { free(q); let a = 1; let b = 2; } else { free(p); }", None),
+    ("let p = alloc(); if (true) { let a = 1; let b = 2; } free(p);", None),
+])
+def test_blocks_that_touch_outer_allocations(source, message):
+    source = PADDING + source
+    tokens = Lexer(source).tokenize_compact()
+    parser = bella_parallel.SkeletonParser(tokens, 5, len(tokens) // bella_parallel.BATCHES_PER_WORKER)
+    parser.parse()
+    assert parser.deferred
+    result = outcome(lambda source: bella_parallel.check_source(source, 1, 5), source)
+    assert result == outcome(check_sequentially, source)
+    assert (result is None) if message is None else (message in result)
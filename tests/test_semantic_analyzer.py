@@ -0,0 +1,38 @@
+import re
+
+import pytest
+
+from bella_lexer import Lexer
+from bella_parser import Parser
+
+PRELUDE = "let c = true; let i = 1; "
+
+def check(source, share=False):
+    Parser(Lexer(PRELUDE + source).tokenize_compact(), share=share).parse()
+
+# Parenthesized operands of a ternary are checked on their own, as the parser used to check them inline
+@pytest.mark.parametrize("share", [False, True])
+@pytest.mark.parametrize("source, message", [
+    ("let z = c ? (1 + 2.0) : 3;", "Incompatible types for operation: INTEGER + FLOAT"),
+    ("let z = c ? 1 : (true && 1);", "Incompatible types for operation: BOOLEAN && INTEGER"),
+    ("let z = c ? (1 * 2.0) + 1 : 3;", "Incompatible types for operation: INTEGER * FLOAT"),
+    ("let z = c ? ((c ? 1 : 2)) : 3;", "Incompatible types for operation: BOOLEAN ? INTEGER"),
+    ("print(c ? 1 : 1 + true);", "Incompatible types for operation: BOOLEAN ? INTEGER"),
+    ("let z = 1 + 2.0 ? 1 : 2;", "Incompatible types for operation: INTEGER + FLOAT"),
+    ("print(-y);", "Identifier \"y\" not declared"),
+    ("print(!(1 < 2.0));", "Incompatible types for operation: INTEGER < FLOAT"),
+])
+def test_rejects_parenthesized_ternary_operands(source, message, share):
+    with pytest.raises(Exception, match=re.escape(message)):
+        check(source, share)
+
+# Operands of a ternary that are not parenthesized are not checked on their own
+@pytest.mark.parametrize("share", [False, True])
+@pytest.mark.parametrize("source", [
+    "let z = c ? 1 + 2.0 : 3;",
+    "let z = c ? (c ? 1 : 2) : 3;",
+    "let z = c ? 1 : true && 1;",
+    "let a = c ? (1 + 2) : 3; let b = c ? (c ? 1 : 2) : (c ? 1 : 2);",
+])
+def test_accepts_unparenthesized_ternary_operands(source, share):
+    check(source, share)
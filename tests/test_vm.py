@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+from bella_benchmark import EXECUTION_PROGRAM, TreeEvaluator
+from bella_compiler import Compiler
+from bella_lexer import Lexer
+from bella_memory_verifier import MemoryVerifier
+from bella_optimizer import Optimizer
+from bella_parser import Parser
+from bella_program_generator import ProgramGenerator
+from bella_vm import VirtualMachine
+
+PROGRAMS = [
+    # Loops and branches
+    "let n = 5; while n > 0 { let n = n - 1; print n; }",
+    "let n = 3; if n % 2 == 0 { print 1; } else { print 2; } if n > 1 { print n * 2; }",
+    # Floats and the arithmetic operators
+    "let a = 7.5; let b = 2.0; print a / b; print a * b - 1.0; print a ** b; print -a;",
+    "print 7 / 2; print (-7) / 2; print 7 % 3; print (-7) % 3; print 2 ** 10; print 2.0 ** 0.5;",
+    "print 7.0 % 2.5; print 1 < 2 && 2.5 >= 2.5; print (!(1 == 2)) || false;",
+    # Constant operands, which the compiler fuses into the instruction that uses them
+    "let x = 3; print x + 1; print 10 - x; print x * 2 + 1; print x ** 2; let y = 2.5; print y * 2.0 + 1.0;",
+    # Functions and ternaries
+    "function f(x, y) = x * y + 1; let c = true; print f(2, 3); print c ? f(1, 1) : 0;",
+    "let p = alloc(); print p; free(p);",
+    # Runtime errors
+    "let x = 0; print 1 / x;",
+    "let x = 0; print 1 % x;",
+    "let x = 0.0; print 1.0 / x;",
+    "let x = 10.0; print x ** 400.0;",
+    "let n = 1; while n > 0 { print n; }",
+]
+
+# Output of a run, ending with the error that stopped it
+def run(execute, source, optimize=False):
+    ast = Parser(Lexer(source).tokenize_compact()).parse()
+    if optimize:
+        Optimizer.optimize(ast)
+    output = io.StringIO()
+    try:
+        execute(ast, output)
+    except Exception as e:
+        output.write(f"error: {e}\n")
+    return output.getvalue()
+
+def run_vm(ast, output):
+    VirtualMachine.execute(Compiler.compile(ast), output, 50)
+
+def run_tree(ast, output):
+    TreeEvaluator(output, 50).run(ast)
+
+@pytest.mark.parametrize("optimize", [False, True])
+@pytest.mark.parametrize("source", PROGRAMS)
+def test_vm_matches_tree_evaluator(source, optimize):
+    assert run(run_vm, source, optimize) == run(run_tree, source, optimize)
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_generated_programs(optimize):
+    for seed in range(20):
+        source = ProgramGenerator(seed, 30).generate()
+        MemoryVerifier.verify_allocation(Parser(Lexer(source).tokenize_compact()).parse())
+        assert run(run_vm, source, optimize) == run(run_tree, source, optimize), seed
+
+def test_execution_program():
+    output = run(run_vm, EXECUTION_PROGRAM)
+    assert output.endswith("error: Runtime error: loop iteration limit of 50 exceeded\n")
+    assert output == run(run_tree, EXECUTION_PROGRAM)